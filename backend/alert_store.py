@@ -0,0 +1,414 @@
+"""
+SQLite storage for acknowledged alerts. The database runs in WAL mode so
+readers never block the writer. All writes go through one writer thread per
+process that reuses a single connection and group-commits: alerts that arrive
+while a commit is running are stored together in the next transaction
+(optionally after a short flush window to gather more). Callers still only
+return once their alert is committed.
+
+The schema is versioned with `PRAGMA user_version`. Opening the store migrates
+older alerts.db files in place.
+"""
+import base64
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+# How long the writer waits for more alerts before committing, and the most it commits at once.
+# Batches form on their own while a commit runs; a window only pays off when commits are slow.
+DEFAULT_FLUSH_SECONDS = 0.0
+DEFAULT_MAX_BATCH = 500
+# How long a connection waits for another process's write lock
+BUSY_TIMEOUT_MS = 5000
+# How long insert()/insert_many() wait for their commit before raising TimeoutError
+WRITE_TIMEOUT_SECONDS = 30.0
+# SQLite integers are signed 64-bit; binding a larger Python int raises OverflowError
+SQLITE_INT_MIN, SQLITE_INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+COLUMNS = ('id', 'type', 'title', 'description', 'priority', 'created_at', 'received_at', 'robot', 'camera')
+# Columns /api/alerts can filter on with an exact match; each has an index on (column, received_at)
+FILTER_COLUMNS = ('type', 'priority', 'robot', 'camera')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Schema versions, applied in order. Version 1 is the original table from database.py.
+MIGRATIONS = [
+    [
+        '''CREATE TABLE IF NOT EXISTS alerts (
+            id TEXT PRIMARY KEY,
+            type TEXT,
+            title TEXT,
+            description TEXT,
+            priority TEXT
+        )''',
+    ],
+    [
+        # Epoch seconds: when the alert was raised (its 'time' field) and when it was stored.
+        # Alerts stored before this version get the migration time for both.
+        'ALTER TABLE alerts ADD COLUMN created_at REAL',
+        'ALTER TABLE alerts ADD COLUMN received_at REAL',
+        'UPDATE alerts SET created_at = :now, received_at = :now',
+        'CREATE INDEX IF NOT EXISTS idx_alerts_received ON alerts (received_at)',
+        'CREATE INDEX IF NOT EXISTS idx_alerts_created ON alerts (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_alerts_type_received ON alerts (type, received_at)',
+        'CREATE INDEX IF NOT EXISTS idx_alerts_priority_received ON alerts (priority, received_at)',
+    ],
+    [
+        # Which robot raised the alert and which camera saw it, when the publisher says so
+        'ALTER TABLE alerts ADD COLUMN robot TEXT',
+        'ALTER TABLE alerts ADD COLUMN camera TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_alerts_robot_received ON alerts (robot, received_at)',
+        'CREATE INDEX IF NOT EXISTS idx_alerts_camera_received ON alerts (camera, received_at)',
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def connect(path, synchronous='NORMAL'):
+    """
+    Opens a WAL-mode connection. With synchronous=NORMAL a commit is not
+    fsynced until the next checkpoint: a power cut may lose the last few
+    alerts, but never corrupts the database.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={synchronous}')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    return conn
+
+
+def migrate(conn):
+    """Brings the schema up to SCHEMA_VERSION. Safe to run from several processes at once."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    conn.isolation_level = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # Re-read under the write lock, another process may have migrated meanwhile
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0 and _has_alerts_table(conn):
+            # Files created by database.py before versioning hold the version 1 table
+            version = 1
+        for number in range(version, SCHEMA_VERSION):
+            for statement in MIGRATIONS[number]:
+                conn.execute(statement, {'now': time.time()} if ':now' in statement else {})
+        conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.isolation_level = ''
+    return SCHEMA_VERSION
+
+
+def _has_alerts_table(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'alerts'").fetchone() is not None
+
+
+def alert_timestamp(value, default):
+    """
+    Epoch seconds of an alert's 'time' field: epoch numbers, ISO 8601, or the
+    frontend/serbot format '%Y-%m-%d %H:%M:%S' in local time. Falls back to `default`.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return float(value)
+        except OverflowError:
+            return default
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.strip()).timestamp()
+        except ValueError:
+            pass
+    return default
+
+
+def alert_camera(alert_data):
+    """
+    The camera of an alert: its 'camera' or 'source' field, else the source of
+    its first violation (serbot alerts covering several cameras are filed
+    under the first one).
+    """
+    camera = alert_data.get('camera', alert_data.get('source'))
+    if camera is None:
+        violations = alert_data.get('violations')
+        if isinstance(violations, list) and violations and isinstance(violations[0], dict):
+            camera = violations[0].get('source')
+    return None if camera is None else str(camera)
+
+
+def alert_row(alert_data, received_at=None):
+    """The column values stored for one alert dict, in COLUMNS order."""
+    received_at = time.time() if received_at is None else received_at
+    robot = alert_data.get('robot')
+    return (
+        str(alert_data.get('id')),
+        alert_data.get('type'),
+        alert_data.get('title'),
+        alert_data.get('description'),
+        alert_data.get('priority'),
+        alert_timestamp(alert_data.get('time'), received_at),
+        received_at,
+        None if robot is None else str(robot),
+        alert_camera(alert_data)
+    )
+
+
+INSERT_SQL = f"INSERT OR REPLACE INTO alerts ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+def parse_time(value):
+    """Epoch seconds of a query bound given as epoch seconds or ISO 8601. Raises ValueError."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    timestamp = alert_timestamp(value, None)
+    if timestamp is None:
+        raise ValueError(f'Invalid time: {value!r}, expected epoch seconds or ISO 8601')
+    return timestamp
+
+
+def encode_cursor(received_at, rowid):
+    """An opaque page cursor pointing just past the alert (received_at, rowid)."""
+    return base64.urlsafe_b64encode(json.dumps([received_at, rowid]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(). Raises ValueError for cursors it did not produce."""
+    try:
+        received_at, rowid = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(received_at), int(rowid)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError(f'Invalid cursor: {cursor!r}')
+
+
+def query_alerts(conn, filters=None, since=None, until=None, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=True):
+    """
+    One page of alerts matching `filters` (exact matches on FILTER_COLUMNS)
+    and since <= received_at < until, newest first unless descending=False.
+    Returns (alerts, next_cursor); next_cursor is None on the last page.
+
+    Pages are keyset-paginated on (received_at, rowid): a page seeks straight
+    to the cursor through the (column, received_at) indexes instead of
+    skipping rows with OFFSET, so every page costs the same however deep it is
+    and however large the table grows.
+    """
+    clauses, params = [], []
+    for column, value in (filters or {}).items():
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f'Cannot filter alerts on {column!r}')
+        clauses.append(f'{column} = ?')
+        params.append(value)
+    if since is not None:
+        clauses.append('received_at >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('received_at < ?')
+        params.append(until)
+    if cursor is not None:
+        received_at, rowid = decode_cursor(cursor)
+        # The redundant range on received_at alone lets SQLite seek the index to the cursor
+        if descending:
+            clauses.append('received_at <= ? AND (received_at < ? OR rowid < ?)')
+        else:
+            clauses.append('received_at >= ? AND (received_at > ? OR rowid > ?)')
+        params.extend([received_at, received_at, rowid])
+    order = 'DESC' if descending else 'ASC'
+    sql = (f"SELECT rowid, {', '.join(COLUMNS)} FROM alerts"
+           f"{' WHERE ' + ' AND '.join(clauses) if clauses else ''}"
+           f" ORDER BY received_at {order}, rowid {order} LIMIT ?")
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1][7], rows[limit - 1][0]) if len(rows) > limit else None
+    return [dict(zip(COLUMNS, row[1:])) for row in rows[:limit]], next_cursor
+
+
+def iter_alerts(conn, filters=None, since=None, until=None, descending=True, page_size=MAX_PAGE_SIZE, limit=None):
+    """
+    Yields every matching alert (at most `limit`), fetching one keyset page at
+    a time so memory stays flat and no read transaction is held between pages.
+    """
+    cursor = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        alerts, cursor = query_alerts(conn, filters, since, until, cursor, size, descending)
+        yield from alerts
+        if remaining is not None:
+            remaining -= len(alerts)
+        if cursor is None:
+            return
+
+
+class AlertStore:
+    """
+    Group-committing alert writer plus per-thread read connections.
+
+    submit() queues one alert and returns a Future that resolves once the
+    alert is committed; insert() waits for it. submit_many() queues a list of
+    alerts that is committed in one transaction. The writer commits everything
+    queued (up to `max_batch` alerts, a bulk list is never split), after waiting
+    `flush_seconds` from the batch's first alert for more to arrive. If a batch
+    fails, its alerts are retried one by one so a single bad alert does not fail
+    the others.
+    """
+
+    def __init__(self, path, flush_seconds=DEFAULT_FLUSH_SECONDS, max_batch=DEFAULT_MAX_BATCH,
+                 synchronous='NORMAL', metrics=None):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.max_batch = max_batch
+        self.synchronous = synchronous
+        # Optional metrics.Metrics; commits are timed as the 'db_commit' stage
+        self.metrics = metrics
+        self.pid = os.getpid()
+        self._conn = connect(path, synchronous)
+        migrate(self._conn)
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self.counters = {'rows': 0, 'commits': 0, 'failed_rows': 0}
+        self._thread = threading.Thread(target=self._run, name='alert-store-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, alert_data):
+        """Queues an alert dict for the next group commit. Returns a Future resolving to None."""
+        future = Future()
+        self._queue.put(([alert_row(alert_data)], future, False))
+        return future
+
+    def insert(self, alert_data, timeout=WRITE_TIMEOUT_SECONDS):
+        """
+        Stores one alert and returns once it is committed. Raises the alert's
+        error (usually sqlite3.Error), or TimeoutError after `timeout` seconds.
+        """
+        self.submit(alert_data).result(timeout=timeout)
+
+    def submit_many(self, alerts):
+        """
+        Queues a list of alert dicts to be committed together. Returns a Future
+        resolving to one entry per alert: None once stored, or its error.
+        """
+        future = Future()
+        received_at = time.time()
+        self._queue.put(([alert_row(alert_data, received_at) for alert_data in alerts], future, True))
+        return future
+
+    def insert_many(self, alerts, timeout=WRITE_TIMEOUT_SECONDS):
+        """
+        Stores a list of alerts in one transaction. Returns the per-alert errors
+        (None when stored); raises TimeoutError after `timeout` seconds.
+        """
+        return self.submit_many(alerts).result(timeout=timeout)
+
+    def _take_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first[0])
+        deadline = time.perf_counter() + self.flush_seconds
+        while size < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # Never let the writer die: callers would wait on their futures forever
+                print(f"Alert writer error: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, batch):
+        rows = [row for item_rows, _, _ in batch for row in item_rows]
+        start = time.perf_counter()
+        try:
+            with self._conn:
+                self._conn.executemany(INSERT_SQL, rows)
+            failures = {}
+        except Exception:
+            # sqlite3.Error, or e.g. OverflowError binding an int beyond 64 bits
+            failures = self._insert_one_by_one(rows)
+        self.counters['commits'] += 1
+        self.counters['rows'] += len(rows) - len(failures)
+        self.counters['failed_rows'] += len(failures)
+        if self.metrics is not None:
+            self.metrics.observe('stage_seconds', time.perf_counter() - start, stage='db_commit')
+            self.metrics.inc('db_rows_total', len(rows) - len(failures))
+        index = 0
+        for item_rows, future, many in batch:
+            errors = [failures.get(i) for i in range(index, index + len(item_rows))]
+            index += len(item_rows)
+            if many:
+                future.set_result(errors)
+            elif errors[0] is not None:
+                future.set_exception(errors[0])
+            else:
+                future.set_result(None)
+
+    def _insert_one_by_one(self, rows):
+        failures = {}
+        for index, row in enumerate(rows):
+            try:
+                with self._conn:
+                    self._conn.execute(INSERT_SQL, row)
+            except Exception as e:
+                failures[index] = e
+        return failures
+
+    def reader(self):
+        """This thread's read connection, opened on first use and reused afterwards."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path, self.synchronous)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def stats(self):
+        commits = self.counters['commits']
+        return dict(self.counters, queue_depth=self._queue.qsize(),
+                    mean_batch_size=round(self.counters['rows'] / commits, 2) if commits else None)
+
+    def close(self):
+        """Commits what is queued and stops the writer."""
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path, **options):
+    """
+    The AlertStore of `path` for this process, created on first use. Forked
+    server workers (e.g. gunicorn with --preload) each get their own writer
+    thread and connections instead of sharing the parent's.
+    """
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None or store.pid != os.getpid():
+            store = _stores[path] = AlertStore(path, **options)
+        return store
@@ -0,0 +1,353 @@
+"""
+ASGI serving mode for the backend, for production use instead of Flask's
+development server:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+
+Serves the same API as app.py (and shares its model, micro-batching scheduler,
+metrics and helpers), but no request handler ever blocks the event loop:
+inference requests await the scheduler's futures, decoding, annotation and
+encoding run on a bounded CPU thread pool, and alert writes await the alert
+store's group commits, so cheap endpoints such as /api/log-alert keep
+answering while inference is saturated. Inference admission is bounded too: once
+PPE_ASGI_MAX_INFERENCE images are in flight further requests wait, and once
+PPE_ASGI_MAX_WAITING requests wait new ones get 503.
+"""
+import asyncio
+import contextlib
+import os
+import sqlite3
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app import (
+    MQTT_INGEST, alert_query_options, alert_store, alerts_ndjson, alerts_page, batch_payload, bulk_alerts_response,
+    check_batch_size, collect_inference_stats, decode_batch, decode_size_option, decode_upload,
+    expand_batch_uploads, log_check_response, metrics, multipart_body, parse_bulk_alerts, priority_error,
+    render_check_result, render_metrics, response_options, scheduler, start_mqtt_ingest, stop_mqtt_ingest,
+    validate_alerts, worker_pool
+)
+
+# Threads for decode/annotate/encode; inference itself runs on the scheduler's worker
+# and alert writes on the alert store's writer thread
+CPU_WORKERS = int(os.getenv('PPE_ASGI_CPU_WORKERS', os.cpu_count() or 4))
+# Images that may be queued at the scheduler at once, and requests allowed to wait for a slot
+MAX_INFERENCE = int(os.getenv('PPE_ASGI_MAX_INFERENCE', 32))
+MAX_WAITING = int(os.getenv('PPE_ASGI_MAX_WAITING', 256))
+# How often the event loop's responsiveness is sampled
+LOOP_LAG_INTERVAL = 0.25
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='ppe-cpu')
+
+metrics.describe('asgi_in_flight', 'ASGI requests being handled, by endpoint')
+metrics.describe('asgi_inference_waiting', 'Inference requests waiting for an admission slot')
+metrics.describe('asgi_event_loop_lag_seconds', 'Delay of the event loop in waking a periodic timer')
+metrics.describe('asgi_cpu_tasks', 'Decode/annotate/encode tasks queued or running on the CPU pool')
+
+
+class InferenceGate:
+    """Bounds the images in flight at the scheduler and counts who is waiting."""
+
+    def __init__(self, slots, max_waiting):
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self.available = slots
+        self.waiting = 0
+        self.rejected = 0
+        self._condition = None
+
+    async def acquire(self, count):
+        """Waits until `count` slots are free. Returns False when too many requests already wait."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        count = min(count, self.slots)
+        async with self._condition:
+            if self.available >= count:
+                self.available -= count
+                return True
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.available >= count)
+            finally:
+                self.waiting -= 1
+            self.available -= count
+            return True
+
+    async def release(self, count):
+        async with self._condition:
+            self.available += min(count, self.slots)
+            self._condition.notify_all()
+
+    def stats(self):
+        return {
+            'slots': self.slots,
+            'in_flight_images': self.slots - self.available,
+            'waiting_requests': self.waiting,
+            'rejected_requests': self.rejected
+        }
+
+
+gate = InferenceGate(MAX_INFERENCE, MAX_WAITING)
+in_flight = {}
+cpu_tasks = {'pending': 0}
+
+
+async def run_cpu(fn, *args):
+    """Runs CPU-bound work on the bounded pool, counting tasks queued or running there."""
+    cpu_tasks['pending'] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(cpu_executor, fn, *args)
+    finally:
+        cpu_tasks['pending'] -= 1
+
+
+def timed_decode(values, image_bytes, frame_bytes):
+    with metrics.timed('stage_seconds', stage='decode'):
+        return decode_upload(values, image_bytes, frame_bytes)
+
+
+async def infer(images):
+    """Queues images at the scheduler and awaits their detections without holding a thread."""
+    if not await gate.acquire(len(images)):
+        return None
+    try:
+        return await asyncio.gather(*(asyncio.wrap_future(scheduler.submit(image)) for image in images))
+    finally:
+        await gate.release(len(images))
+
+
+def busy_response():
+    return JSONResponse({'error': 'Inference queue is full, retry later'}, status_code=503,
+                        headers={'Retry-After': '1'})
+
+
+async def read_request(request):
+    """Returns (values, form) with form fields overridden by query parameters, like Flask's request.values."""
+    form = None
+    values = {}
+    if request.headers.get('content-type', '').startswith(('multipart/form-data', 'application/x-www-form-urlencoded')):
+        form = await request.form(max_files=10000)
+        values.update((k, v) for k, v in form.multi_items() if isinstance(v, str))
+    values.update(request.query_params)
+    return values, form
+
+
+async def check_ppe_image(request):
+    values, form = await read_request(request)
+    try:
+        options = response_options(values)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    image_bytes = frame_bytes = None
+    if form is not None and 'image' in form:
+        image_bytes = await form['image'].read()
+    elif form is not None and 'frame' in form:
+        frame_bytes = await form['frame'].read()
+    elif request.headers.get('content-type', '').startswith('application/octet-stream'):
+        frame_bytes = await request.body()
+
+    try:
+        img_np, scale = await run_cpu(timed_decode, values, image_bytes, frame_bytes)
+    except LookupError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({'error': f'Invalid image file: {str(e)}'}, status_code=400)
+
+    results = await infer([img_np])
+    if results is None:
+        return busy_response()
+    payload, image_bytes, encode_seconds, shape = await run_cpu(render_check_result, img_np, scale, results[0], options)
+    if options[0] == 'multipart':
+        body, mimetype = multipart_body(payload, image_bytes, options[1])
+        response = Response(body, media_type=mimetype)
+    else:
+        response = JSONResponse(payload)
+    log_check_response(options, encode_seconds, shape, len(response.body))
+    return response
+
+
+async def check_ppe_batch(request):
+    values, form = await read_request(request)
+    if form is None:
+        return JSONResponse({'error': 'No images uploaded'}, status_code=400)
+    uploads = [(f.filename, await f.read()) for f in form.getlist('images') if not isinstance(f, str)]
+    archive = await form['archive'].read() if 'archive' in form and not isinstance(form['archive'], str) else None
+    try:
+        items = await run_cpu(expand_batch_uploads, uploads, archive)
+    except zipfile.BadZipFile as e:
+        return JSONResponse({'error': f'Invalid archive: {str(e)}'}, status_code=400)
+    error = check_batch_size(items)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+    try:
+        max_size = decode_size_option(values)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    names, images, scales, errors = await run_cpu(decode_batch, items, max_size)
+    if not images:
+        return JSONResponse({'error': 'No valid images uploaded', 'errors': errors}, status_code=400)
+
+    start = time.perf_counter()
+    batch_results = await infer(images)
+    if batch_results is None:
+        return busy_response()
+    elapsed = time.perf_counter() - start
+    return JSONResponse(await run_cpu(batch_payload, names, scales, batch_results, errors, elapsed))
+
+
+async def log_alert(request):
+    try:
+        alert_data = await request.json()
+        print(f"Received alert to log: {alert_data}")
+
+        # Basic validation
+        if not all(k in alert_data for k in ['id', 'type', 'title']):
+            return JSONResponse({"status": "error", "message": "Missing required alert data"}, status_code=400)
+        error = priority_error(alert_data)
+        if error:
+            return JSONResponse({"status": "error", "message": error}, status_code=400)
+
+        db_start = time.perf_counter()
+        await asyncio.wrap_future(alert_store().submit(alert_data))
+        metrics.observe('stage_seconds', time.perf_counter() - db_start, stage='db_write')
+        return JSONResponse({"status": "success", "message": "Alert logged successfully"}, status_code=201)
+
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return JSONResponse({"status": "error", "message": "Database error"}, status_code=500)
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return JSONResponse({"status": "error", "message": "An unexpected error occurred"}, status_code=500)
+
+
+async def log_alerts(request):
+    try:
+        items = await run_cpu(parse_bulk_alerts, await request.body(), request.headers.get('content-type', ''))
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+    errors = await run_cpu(validate_alerts, items)
+    valid = [item for item, error in zip(items, errors) if error is None]
+    db_start = time.perf_counter()
+    db_errors = await asyncio.wrap_future(alert_store().submit_many(valid)) if valid else []
+    metrics.observe('stage_seconds', time.perf_counter() - db_start, stage='db_write')
+    payload, status = bulk_alerts_response(items, errors, db_errors)
+    return JSONResponse(payload, status_code=status)
+
+
+async def list_alerts(request):
+    try:
+        options = alert_query_options(request.query_params)
+        if options['format'] == 'ndjson':
+            if options['cursor']:
+                raise ValueError('cursor is only supported with format=json')
+            # Starlette pulls each page from the generator on its thread pool
+            return StreamingResponse(alerts_ndjson(options), media_type='application/x-ndjson')
+        return JSONResponse(await run_cpu(alerts_page, options))
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return JSONResponse({"status": "error", "message": "Database error"}, status_code=500)
+
+
+def serving_stats():
+    return {'in_flight': dict(in_flight), 'inference': gate.stats(), 'cpu_workers': CPU_WORKERS,
+            'cpu_tasks': cpu_tasks['pending']}
+
+
+async def inference_stats(request):
+    stats = collect_inference_stats()
+    stats['asgi'] = serving_stats()
+    return JSONResponse(stats)
+
+
+async def prometheus_metrics(request):
+    for endpoint, count in in_flight.items():
+        metrics.set('asgi_in_flight', count, endpoint=endpoint)
+    metrics.set('asgi_inference_waiting', gate.waiting)
+    metrics.set('asgi_cpu_tasks', cpu_tasks['pending'])
+    return Response(render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+class RequestMetricsMiddleware:
+    """Counts requests in flight and records request totals and latency per endpoint, like app.py's hooks."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        endpoint = scope['path'] if scope['path'] in ROUTE_PATHS else 'unmatched'
+        status = {'code': 500}
+        start = time.perf_counter()
+        in_flight[endpoint] = in_flight.get(endpoint, 0) + 1
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight[endpoint] -= 1
+            metrics.inc('requests_total', endpoint=endpoint, status=status['code'])
+            metrics.observe('request_seconds', time.perf_counter() - start, endpoint=endpoint)
+
+
+async def watch_event_loop():
+    """Samples how late the loop wakes a timer; stays near zero while nothing blocks it."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        metrics.observe('asgi_event_loop_lag_seconds', max(loop.time() - expected, 0.0))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    watcher = asyncio.create_task(watch_event_loop())
+    if MQTT_INGEST:
+        start_mqtt_ingest()
+    yield
+    watcher.cancel()
+    stop_mqtt_ingest()
+    scheduler.stop()
+    if worker_pool is not None:
+        worker_pool.close()
+    cpu_executor.shutdown(wait=False)
+    alert_store().close()
+
+
+routes = [
+    Route('/api/check-ppe-image', check_ppe_image, methods=['POST']),
+    Route('/api/check-ppe-batch', check_ppe_batch, methods=['POST']),
+    Route('/api/inference-stats', inference_stats, methods=['GET']),
+    Route('/metrics', prometheus_metrics, methods=['GET']),
+    Route('/api/log-alert', log_alert, methods=['POST']),
+    Route('/api/log-alerts', log_alerts, methods=['POST']),
+    Route('/api/alerts', list_alerts, methods=['GET'])
+]
+ROUTE_PATHS = {route.path for route in routes}
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(RequestMetricsMiddleware)
+    ],
+    lifespan=lifespan
+)
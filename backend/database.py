@@ -1,6 +1,8 @@
 import sqlite3
 import os
 
+from alert_store import SCHEMA_VERSION, connect, migrate
+
 # Get the absolute path of the directory where the script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
 # Define the database path relative to the script's directory
@@ -8,26 +10,18 @@ DB_PATH = os.path.join(script_dir, 'alerts.db')
 
 def init_db():
     try:
-        # Connect to the database file using the robust path
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        # Create the 'alerts' table if it doesn't already exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS alerts (
-                id TEXT PRIMARY KEY,
-                type TEXT,
-                title TEXT,
-                description TEXT,
-                priority TEXT
-            )
-        ''')
+        # Connect to the database file using the robust path (WAL mode)
+        conn = connect(DB_PATH)
 
-        # Commit the changes and close the connection
-        conn.commit()
+        # Create the 'alerts' table, or migrate an existing one to the current schema
+        previous = conn.execute('PRAGMA user_version').fetchone()[0]
+        migrate(conn)
         conn.close()
         print(f"Database '{DB_PATH}' initialized successfully.")
-        print("Table 'alerts' created or already exists.")
+        if previous < SCHEMA_VERSION:
+            print(f"Table 'alerts' migrated from schema version {previous} to {SCHEMA_VERSION}.")
+        else:
+            print("Table 'alerts' is up to date.")
 
     except sqlite3.Error as e:
         print(f"Database error: {e}")
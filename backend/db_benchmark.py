@@ -0,0 +1,155 @@
+"""
+Measures sustained alert inserts/sec of the alert storage paths:
+
+    legacy  a new connection, one INSERT and one commit per alert (rollback journal),
+            as /api/log-alert did before alert_store.py
+    reuse   one WAL connection reused, still one commit per alert
+    group   alert_store.AlertStore: WAL, one writer connection, group commits
+    bulk    AlertStore.insert_many(): --bulk-size alerts per call in one transaction,
+            as /api/log-alerts stores them
+
+Every path is driven by --threads concurrent writers (like concurrent requests)
+for --seconds against a fresh database file, and waits for each commit.
+Latencies are per call, so a bulk call's latency covers all its alerts.
+
+    python db_benchmark.py --threads 16 --seconds 10
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from alert_store import AlertStore, INSERT_SQL, MIGRATIONS, alert_row, connect, migrate
+
+PATHS = ('legacy', 'reuse', 'group', 'bulk')
+
+
+def sample_alert():
+    return {'id': uuid.uuid4().hex, 'type': 'critical', 'title': 'CRITICAL: PPE Missing',
+            'description': 'Person at [10,10,320,475] on camera 0 is missing: gloves, glasses',
+            'priority': 'HIGH', 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def legacy_writer(path):
+    conn = sqlite3.connect(path)
+    for statement in MIGRATIONS[0]:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+    def write(alert):
+        conn = sqlite3.connect(path)
+        conn.execute('INSERT OR REPLACE INTO alerts (id, type, title, description, priority) VALUES (?, ?, ?, ?, ?)',
+                     (str(alert['id']), alert['type'], alert['title'], alert['description'], alert['priority']))
+        conn.commit()
+        conn.close()
+    return write, None
+
+
+def reuse_writer(path, synchronous):
+    conn = connect(path, synchronous)
+    migrate(conn)
+    lock = threading.Lock()
+
+    def write(alert):
+        with lock, conn:
+            conn.execute(INSERT_SQL, alert_row(alert))
+    return write, conn.close
+
+
+def group_writer(path, flush_seconds, synchronous):
+    store = AlertStore(path, flush_seconds=flush_seconds, synchronous=synchronous)
+    return store.insert, store.close
+
+
+def bulk_writer(path, synchronous):
+    store = AlertStore(path, synchronous=synchronous)
+
+    def write(alerts):
+        errors = store.insert_many(alerts)
+        if any(errors):
+            raise next(e for e in errors if e is not None)
+    return write, store.close
+
+
+def measure(path_name, db_path, threads, seconds, flush_seconds, synchronous, bulk_size):
+    per_call = bulk_size if path_name == 'bulk' else 1
+    if path_name == 'legacy':
+        write, close = legacy_writer(db_path)
+    elif path_name == 'reuse':
+        write, close = reuse_writer(db_path, synchronous)
+    elif path_name == 'group':
+        write, close = group_writer(db_path, flush_seconds, synchronous)
+    else:
+        write, close = bulk_writer(db_path, synchronous)
+
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(index):
+        while time.perf_counter() < deadline:
+            item = [sample_alert() for _ in range(bulk_size)] if per_call > 1 else sample_alert()
+            start = time.perf_counter()
+            try:
+                write(item)
+            except sqlite3.Error:
+                errors[index] += 1
+                continue
+            latencies[index].append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if close is not None:
+        close()
+
+    values = np.concatenate([np.asarray(l) for l in latencies]) * 1000 if any(latencies) else np.zeros(1)
+    inserted = sum(len(l) for l in latencies) * per_call
+    return {
+        'path': path_name,
+        'inserts_per_sec': round(inserted / elapsed, 1),
+        'inserted': inserted,
+        'errors': sum(errors) * per_call,
+        'p50_ms': round(float(np.percentile(values, 50)), 2),
+        'p99_ms': round(float(np.percentile(values, 99)), 2)
+    }
+
+
+def run(threads=16, seconds=10.0, flush_seconds=0.0, synchronous='NORMAL', directory=None, bulk_size=500):
+    results = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        for path_name in PATHS:
+            results.append(measure(path_name, os.path.join(tmp, f'{path_name}.db'), threads, seconds, flush_seconds,
+                                   synchronous, bulk_size))
+            print(results[-1])
+    legacy = results[0]['inserts_per_sec']
+    for row in results:
+        row['speedup'] = round(row['inserts_per_sec'] / legacy, 2) if legacy else None
+    return {'threads': threads, 'seconds': seconds, 'flush_ms': flush_seconds * 1000, 'synchronous': synchronous,
+            'bulk_size': bulk_size, 'sqlite': sqlite3.sqlite_version, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare alert insert throughput of the storage paths')
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent writers')
+    parser.add_argument('--seconds', type=float, default=10.0, help='Duration per path')
+    parser.add_argument('--flush-ms', type=float, default=0.0, help='Group commit flush window')
+    parser.add_argument('--synchronous', choices=('NORMAL', 'FULL'), default='NORMAL',
+                        help='SQLite synchronous mode of the WAL paths')
+    parser.add_argument('--dir', default=None,
+                        help='Directory for the temporary databases; use the disk alerts.db lives on')
+    parser.add_argument('--bulk-size', type=int, default=500, help='Alerts per insert_many() call of the bulk path')
+    args = parser.parse_args()
+    print(json.dumps(run(args.threads, args.seconds, args.flush_ms / 1000, args.synchronous, args.dir, args.bulk_size),
+                     indent=2))
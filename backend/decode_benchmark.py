@@ -0,0 +1,95 @@
+"""
+Measures decode time and peak memory of the upload decode paths on an image:
+
+    legacy   PIL open + convert('RGB') + np.array, then the RGB->BGR copy made for encoding
+    decode   cv2.imdecode straight into one BGR array
+    reduced  decode with JPEG DCT scaling to --max-size
+
+Peak memory is the growth of the process's maximum resident set size while
+decoding once, measured in a fresh process per path so earlier runs cannot
+hide it.
+
+    python decode_benchmark.py photo_4k.jpg --max-size 640
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import resource
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_decode import decode_image
+
+PATHS = ('legacy', 'decode', 'reduced')
+
+
+def _legacy(data, max_size):
+    img = np.array(Image.open(io.BytesIO(data)).convert('RGB'))
+    return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+
+
+def _decode(data, max_size):
+    return decode_image(data)[0]
+
+
+def _reduced(data, max_size):
+    return decode_image(data, max_size)[0]
+
+
+DECODERS = {'legacy': _legacy, 'decode': _decode, 'reduced': _reduced}
+
+
+def _max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _measure(path, data, max_size, repeat, queue):
+    decoder = DECODERS[path]
+    before = _max_rss_bytes()
+    image = decoder(data, max_size)
+    peak = _max_rss_bytes() - before
+    shape = image.shape
+    del image
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decoder(data, max_size)
+        timings.append(time.perf_counter() - start)
+    queue.put({
+        'path': path,
+        'shape': list(shape),
+        'peak_rss_growth_mb': round(peak / 2 ** 20, 2),
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'min_ms': round(min(timings) * 1000, 2)
+    })
+
+
+def run(image_path, max_size=640, repeat=10):
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for path in PATHS:
+        queue = context.Queue()
+        process = context.Process(target=_measure, args=(path, data, max_size, repeat, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return {'image': image_path, 'bytes': len(data), 'max_size': max_size, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare upload decode paths')
+    parser.add_argument('image', help='Encoded image to decode')
+    parser.add_argument('--max-size', type=int, default=640, help='Target longest side for the reduced path')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed decodes per path')
+    args = parser.parse_args()
+    print(json.dumps(run(args.image, args.max_size, args.repeat), indent=2))
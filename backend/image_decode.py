@@ -0,0 +1,84 @@
+"""
+Upload decoding for the backend. Encoded images are decoded by OpenCV straight
+from the request bytes into one BGR array (the layout both YOLO and OpenCV
+drawing/encoding use), and JPEGs can be shrunk during decoding with libjpeg's
+DCT scaling so a 4K upload never exists at full resolution. Raw frames sent by
+gateways are wrapped without copying.
+"""
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Raw frame pixel formats and their bytes per pixel
+RAW_FORMATS = {'bgr24': 3, 'rgb24': 3, 'bgra32': 4, 'gray8': 1}
+
+# DCT scale factors supported by libjpeg through OpenCV's reduced-read flags
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# Uploads were never EXIF-rotated by the previous PIL path, keep it that way
+_IGNORE_ORIENTATION = cv2.IMREAD_IGNORE_ORIENTATION
+
+
+def _reduction_flag(data, max_size):
+    """The strongest JPEG DCT reduction that keeps the longest side at or above `max_size`."""
+    header = Image.open(io.BytesIO(data))
+    if header.format != 'JPEG':
+        return cv2.IMREAD_COLOR, 1
+    longest = max(header.size)
+    for factor, flag in _REDUCED_FLAGS:
+        if longest // factor >= max_size:
+            return flag, factor
+    return cv2.IMREAD_COLOR, 1
+
+
+def decode_image(data, max_size=None):
+    """
+    Decodes encoded image bytes into a BGR uint8 array.
+
+    With `max_size`, JPEGs larger than twice `max_size` are decoded at 1/2,
+    1/4 or 1/8 scale, staying at least `max_size` on their longest side; other
+    formats are decoded at full size. Returns (image, scale) where `scale` is
+    decoded size over original size. Raises ValueError if the bytes are not an image.
+    """
+    flag, factor = cv2.IMREAD_COLOR, 1
+    if max_size:
+        try:
+            flag, factor = _reduction_flag(data, max_size)
+        except Exception as e:
+            raise ValueError('cannot identify image') from e
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag | _IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError('cannot decode image')
+    return image, 1.0 / factor
+
+
+def wrap_raw_frame(data, width, height, pixel_format='bgr24', max_size=None):
+    """
+    Turns a raw frame (`width` x `height` pixels in `pixel_format`) into a BGR
+    array. bgr24 frames are wrapped without a copy (the result is read-only);
+    other formats are converted once. With `max_size` larger frames are
+    shrunk. Returns (image, scale) like decode_image().
+    """
+    if pixel_format not in RAW_FORMATS:
+        raise ValueError(f'format must be one of {tuple(RAW_FORMATS)}')
+    if width <= 0 or height <= 0:
+        raise ValueError('width and height must be positive')
+    channels = RAW_FORMATS[pixel_format]
+    expected = width * height * channels
+    if len(data) != expected:
+        raise ValueError(f'expected {expected} bytes for a {width}x{height} {pixel_format} frame, got {len(data)}')
+    frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, channels)
+    if pixel_format == 'rgb24':
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    elif pixel_format == 'bgra32':
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+    elif pixel_format == 'gray8':
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+    scale = 1.0
+    if max_size and max(width, height) > max_size:
+        scale = max_size / max(width, height)
+        frame = cv2.resize(frame, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                           interpolation=cv2.INTER_AREA)
+    return frame, scale
@@ -0,0 +1,127 @@
+import threading
+import queue
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class MicroBatchScheduler:
+    """
+    Queues inference requests from many callers and runs them in batches on a
+    single worker thread. A batch is dispatched as soon as it holds
+    `max_batch_size` items or the oldest item has waited `max_wait_ms`.
+
+    `infer_fn` receives a list of inputs and must return a list of results of
+    the same length and order.
+    """
+
+    def __init__(self, infer_fn, max_batch_size=8, max_wait_ms=10, history=2048):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=history)
+        self._batch_sizes = Counter()
+        self._batches = 0
+        self._requests = 0
+        self._thread = threading.Thread(target=self._run, name='inference-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queues one input and returns a Future resolving to its result."""
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def infer(self, item, timeout=None):
+        """Queues one input and blocks until its result is ready."""
+        return self.submit(item).result(timeout=timeout)
+
+    def infer_many(self, items, timeout=None):
+        """Queues several inputs at once and blocks until all results are ready."""
+        futures = [self.submit(item) for item in items]
+        return [f.result(timeout=timeout) for f in futures]
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            inputs = [item for item, _, _ in batch]
+            try:
+                outputs = list(self.infer_fn(inputs))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            if len(outputs) != len(batch):
+                # zip() would leave the unmatched futures unresolved and their requests hanging
+                error = RuntimeError(f'infer_fn returned {len(outputs)} outputs for a batch of {len(batch)}')
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            done = time.perf_counter()
+            for (_, future, queued_at), output in zip(batch, outputs):
+                future.set_result(output)
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._latencies.extend(done - queued_at for _, _, queued_at in batch)
+
+    def stats(self):
+        """Latency percentiles (ms) and batch-size histogram since startup."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            histogram = dict(sorted(self._batch_sizes.items()))
+            batches = self._batches
+            requests = self._requests
+        def to_ms(value):
+            return round(value * 1000, 2) if value is not None else None
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue_depth': self._queue.qsize(),
+            'requests': requests,
+            'batches': batches,
+            'mean_batch_size': round(requests / batches, 2) if batches else None,
+            'batch_size_histogram': histogram,
+            'latency_ms': {
+                'p50': to_ms(percentile(latencies, 50)),
+                'p99': to_ms(percentile(latencies, 99)),
+                'max': to_ms(latencies[-1] if latencies else None),
+                'samples': len(latencies)
+            }
+        }
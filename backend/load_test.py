@@ -0,0 +1,146 @@
+"""
+Load test for the backend: measures /api/log-alert latency on an idle server,
+then again while several clients keep /api/check-ppe-image saturated. With the
+ASGI serving mode (asgi_app.py) the log-alert latency should stay flat.
+
+    python load_test.py --url http://localhost:5001 --image sample.jpg --clients 16 --duration 20
+
+Probe alerts are stored with ids starting with 'loadtest-'.
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+
+
+def _post(url, body, content_type, timeout=60):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def multipart_image(image_bytes, filename):
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'.encode(),
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        image_bytes,
+        f'\r\n--{boundary}--\r\n'.encode()
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def summarize(latencies):
+    if not latencies:
+        return {'count': 0}
+    values = np.asarray(latencies) * 1000
+    return {
+        'count': len(values),
+        'p50_ms': round(float(np.percentile(values, 50)), 2),
+        'p95_ms': round(float(np.percentile(values, 95)), 2),
+        'p99_ms': round(float(np.percentile(values, 99)), 2),
+        'max_ms': round(float(values.max()), 2)
+    }
+
+
+def probe_log_alert(base_url, duration, rate):
+    """Posts one alert every 1/rate seconds and returns the request latencies."""
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    next_send = time.perf_counter()
+    while time.perf_counter() < deadline:
+        body = json.dumps({'id': f'loadtest-{uuid.uuid4()}', 'type': 'loadtest', 'title': 'Load test probe',
+                           'description': '', 'priority': 'low'}).encode()
+        start = time.perf_counter()
+        status = _post(f'{base_url}/api/log-alert', body, 'application/json')
+        latencies.append(time.perf_counter() - start)
+        errors += status != 201
+        next_send += 1.0 / rate
+        time.sleep(max(next_send - time.perf_counter(), 0))
+    return latencies, errors
+
+
+def saturate(base_url, image_bytes, filename, clients, stop, results):
+    """Keeps `clients` concurrent /api/check-ppe-image requests running until `stop` is set."""
+    body, content_type = multipart_image(image_bytes, filename)
+    url = f'{base_url}/api/check-ppe-image?response=json'
+    lock = threading.Lock()
+
+    def client():
+        while not stop.is_set():
+            start = time.perf_counter()
+            status = _post(url, body, content_type)
+            with lock:
+                results['latencies'].append(time.perf_counter() - start)
+                results['statuses'][status] = results['statuses'].get(status, 0) + 1
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def run(base_url, image_path, clients=16, duration=20.0, rate=10.0, warmup=3.0):
+    base_url = base_url.rstrip('/')
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+
+    idle_latencies, idle_errors = probe_log_alert(base_url, duration, rate)
+
+    stop = threading.Event()
+    inference = {'latencies': [], 'statuses': {}}
+    threads = saturate(base_url, image_bytes, image_path.rsplit('/', 1)[-1], clients, stop, inference)
+    time.sleep(warmup)
+    loaded_start = time.perf_counter()
+    loaded_latencies, loaded_errors = probe_log_alert(base_url, duration, rate)
+    loaded_elapsed = time.perf_counter() - loaded_start
+    completed = len(inference['latencies'])
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    try:
+        with urllib.request.urlopen(f'{base_url}/api/inference-stats', timeout=10) as response:
+            server_stats = json.load(response)
+    except (urllib.error.URLError, ValueError):
+        server_stats = None
+
+    idle = summarize(idle_latencies)
+    loaded = summarize(loaded_latencies)
+    return {
+        'url': base_url,
+        'clients': clients,
+        'log_alert_idle': dict(idle, errors=idle_errors),
+        'log_alert_under_inference': dict(loaded, errors=loaded_errors),
+        'p95_ratio': round(loaded['p95_ms'] / idle['p95_ms'], 2) if idle.get('p95_ms') and loaded.get('p95_ms') else None,
+        'inference': dict(summarize(inference['latencies']), statuses=inference['statuses'],
+                          requests_per_sec=round(completed / (warmup + loaded_elapsed), 2)),
+        'server_stats': server_stats
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that /api/log-alert stays fast while inference is saturated')
+    parser.add_argument('--url', default='http://localhost:5001', help='Backend base URL')
+    parser.add_argument('--image', required=True, help='Image posted to /api/check-ppe-image')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent inference clients')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds per measurement phase')
+    parser.add_argument('--rate', type=float, default=10.0, help='log-alert probes per second')
+    parser.add_argument('--output', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.url, args.image, args.clients, args.duration, args.rate)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
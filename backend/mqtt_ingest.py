@@ -0,0 +1,314 @@
+"""
+Backend-side subscriber that stores alerts straight from the MQTT alerts
+topic, so they reach alerts.db whether or not a dashboard is open.
+
+Messages are buffered and written to SQLite in batches, one transaction per
+batch through the alert store's writer. Messages are acknowledged manually
+and only after their alert is committed: with QoS 1 and a persistent session
+an alert is never lost when the backend stops between receiving and storing
+it, it is redelivered instead. Redeliveries (and repeated ids within a batch)
+are recognised by alert id and skipped.
+
+A broker only redelivers unacknowledged messages when the session resumes,
+not on a live connection, so failed writes are retried here with exponential
+backoff: for as long as the database is unavailable, and up to `max_attempts`
+for an alert the store rejects, which is then acknowledged and dropped.
+Acknowledgements wait for the whole batch and go out in arrival order.
+
+The ingestor only needs a client with `subscribe(topic, qos)`, `ack(mid, qos)`
+and paho's `on_connect`/`on_message` callbacks, so a local broker stand-in can
+replace paho in tests.
+
+Run it next to the backend:
+
+    python mqtt_ingest.py
+
+or inside app.py / asgi_app.py with PPE_MQTT_INGEST=1 (single-process servers
+only; several processes sharing one client id disconnect each other). Broker
+settings come from the same MQTT_* variables as serbot_inference.py.
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from alert_store import alert_timestamp
+
+# Keys an alert message needs to be stored, as for /api/log-alert
+REQUIRED_KEYS = ('id', 'type', 'title')
+DEFAULT_MAX_BATCH = 500
+# How long the ingestor waits for more messages before writing a batch
+DEFAULT_FLUSH_SECONDS = 0.05
+# Backoff between attempts to store a batch: doubling from the first delay up to the cap
+DEFAULT_RETRY_SECONDS = 0.5
+MAX_RETRY_SECONDS = 30.0
+# Attempts before an alert the store keeps rejecting is dropped
+DEFAULT_MAX_ATTEMPTS = 8
+# How long the broker keeps the subscription and unacknowledged alerts while the backend is away
+SESSION_EXPIRY_SECONDS = 7 * 24 * 3600
+
+OUTCOMES = ('stored', 'duplicate', 'invalid', 'failed')
+
+
+def parse_alert(payload):
+    """The alert dict of a message payload, or None if it is not a storable alert."""
+    try:
+        alert = json.loads(payload)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(alert, dict) or not all(k in alert for k in REQUIRED_KEYS):
+        return None
+    return alert
+
+
+class AlertIngestor:
+    """
+    Buffers alert messages from `on_message` and stores them in batches of up
+    to `max_batch`, waiting `flush_seconds` from a batch's first message for
+    more to arrive. Invalid messages are acknowledged and dropped. A batch
+    whose write fails is retried after `retry_seconds`, doubling up to
+    MAX_RETRY_SECONDS, before any of it is acknowledged; messages still
+    unstored at close() are left unacknowledged for the next session.
+    """
+
+    def __init__(self, store, topic='alerts', qos=1, max_batch=DEFAULT_MAX_BATCH,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS, retry_seconds=DEFAULT_RETRY_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, metrics=None):
+        self.store = store
+        self.topic = topic
+        self.qos = qos
+        self.max_batch = max_batch
+        self.flush_seconds = flush_seconds
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        # Optional metrics.Metrics shared with the backend
+        self.metrics = metrics
+        self.client = None
+        self.counters = {outcome: 0 for outcome in OUTCOMES}
+        self.counters.update(batches=0, received=0, retries=0)
+        self.last_lag = None
+        self.started = time.monotonic()
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='mqtt-ingest', daemon=True)
+        self._thread.start()
+        if metrics is not None:
+            metrics.describe('mqtt_ingest_messages_total', 'Alert messages from MQTT by outcome')
+            metrics.describe('mqtt_ingest_lag_seconds', 'Time from receiving an alert message to committing it')
+            metrics.describe('mqtt_alert_age_seconds', 'Time from an alert being raised to its commit')
+            metrics.describe('mqtt_ingest_queue_depth', 'Alert messages received but not yet stored')
+
+    def attach(self, client):
+        """Takes over `client`'s connect and message callbacks."""
+        self.client = client
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        # Subscribe on every (re)connect; a resumed session keeps its subscription but this is harmless
+        print(f"[MQTT ingest] Connected ({rc}), subscribing to '{self.topic}'")
+        client.subscribe(self.topic, qos=self.qos)
+
+    def on_message(self, client, userdata, message):
+        self._queue.put((message.payload, message.mid, message.qos, time.time()))
+
+    def _take_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.flush_seconds
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _stored_ids(self, ids):
+        """The subset of `ids` already in the database."""
+        conn = self.store.reader()
+        placeholders = ', '.join('?' * len(ids))
+        return {row[0] for row in conn.execute(f'SELECT id FROM alerts WHERE id IN ({placeholders})', ids)}
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            alerts = [parse_alert(payload) for payload, _, _, _ in batch]
+            # None until a message is settled: stored, duplicate, invalid or failed (dropped)
+            outcomes = [None if alert is not None else 'invalid' for alert in alerts]
+            delay = self.retry_seconds
+            # Attempts that reached the store; only these count towards dropping a rejected alert
+            attempts = 0
+            while None in outcomes:
+                try:
+                    self._store(batch, alerts, outcomes, attempts + 1 >= self.max_attempts)
+                    attempts += 1
+                except Exception as e:
+                    # The store is unavailable (locked, timed out, ...): retry without a limit
+                    print(f"[MQTT ingest] Database error with {outcomes.count(None)} message(s) unstored: {e}")
+                if None not in outcomes or self._stop.wait(delay):
+                    break
+                self.counters['retries'] += 1
+                delay = min(delay * 2, MAX_RETRY_SECONDS)
+            self._acknowledge(batch, outcomes)
+
+    def _store(self, batch, alerts, outcomes, last_attempt):
+        """Stores the alerts whose outcome is still None and settles what it can. Raises when the store fails."""
+        pending = [index for index, outcome in enumerate(outcomes) if outcome is None]
+        stored = self._stored_ids(list({str(alerts[index]['id']) for index in pending}))
+        new = []
+        for index in pending:
+            alert_id = str(alerts[index]['id'])
+            if alert_id in stored:
+                outcomes[index] = 'duplicate'
+            else:
+                stored.add(alert_id)
+                new.append(index)
+
+        errors = self.store.insert_many([alerts[index] for index in new]) if new else []
+        committed = time.time()
+        for index, error in zip(new, errors):
+            alert, arrived = alerts[index], batch[index][3]
+            if error is None:
+                outcomes[index] = 'stored'
+                if self.metrics is not None:
+                    self.metrics.observe('mqtt_ingest_lag_seconds', committed - arrived)
+                    created = alert_timestamp(alert.get('time'), None)
+                    if created is not None:
+                        self.metrics.observe('mqtt_alert_age_seconds', max(committed - created, 0.0))
+            elif last_attempt:
+                print(f"[MQTT ingest] Dropping alert {alert['id']} after {self.max_attempts} attempts: {error}")
+                outcomes[index] = 'failed'
+            else:
+                print(f"[MQTT ingest] Failed to store alert {alert['id']}, will retry: {error}")
+        self.last_lag = committed - min(item[3] for item in batch)
+
+    def _acknowledge(self, batch, outcomes):
+        # In arrival order, as MQTT requires: stop at the first message left unstored by close()
+        for (_, mid, qos, _), outcome in zip(batch, outcomes):
+            if outcome is None:
+                self._count('failed', outcomes.count(None))
+                break
+            if self.client is not None:
+                self.client.ack(mid, qos)
+            self._count(outcome)
+        self.counters['batches'] += 1
+        self.counters['received'] += len(batch)
+
+    def _count(self, outcome, count=1):
+        self.counters[outcome] += count
+        if self.metrics is not None:
+            self.metrics.inc('mqtt_ingest_messages_total', count, outcome=outcome)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        batches = self.counters['batches']
+        return dict(self.counters, topic=self.topic, queue_depth=self.queue_depth(),
+                    stored_per_sec=round(self.counters['stored'] / elapsed, 2) if elapsed > 0 else None,
+                    mean_batch_size=round(self.counters['received'] / batches, 2) if batches else None,
+                    last_lag_seconds=round(self.last_lag, 4) if self.last_lag is not None else None)
+
+    def close(self):
+        """Stores what is buffered (one attempt per batch while a write is failing) and stops."""
+        self._stop.set()
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+
+
+def mqtt_settings():
+    """Broker settings from the environment, named as for serbot_inference.py. Raises ValueError when missing."""
+    settings = {
+        'broker': os.getenv('MQTT_BROKER'),
+        'port': os.getenv('MQTT_PORT'),
+        'username': os.getenv('MQTT_USERNAME'),
+        'password': os.getenv('MQTT_PASSWORD'),
+        'topic': os.getenv('PPE_MQTT_INGEST_TOPIC', os.getenv('MQTT_TOPIC', 'alerts')),
+        'client_id': os.getenv('PPE_MQTT_CLIENT_ID', 'ppe_backend_ingest'),
+        'tls': os.getenv('MQTT_TLS', '1') == '1'
+    }
+    missing = [f'MQTT_{key.upper()}' for key in ('broker', 'port') if not settings[key]]
+    if missing:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
+    settings['port'] = int(settings['port'])
+    return settings
+
+
+def connect_ingestor(ingestor, settings):
+    """
+    Connects a paho client for `ingestor` with a persistent MQTTv5 session,
+    so alerts published while the backend is down are delivered when it returns.
+    """
+    import paho.mqtt.client as mqtt
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+
+    client = mqtt.Client(client_id=settings['client_id'], protocol=mqtt.MQTTv5, manual_ack=True)
+    if settings['tls']:
+        client.tls_set()
+    if settings['username']:
+        client.username_pw_set(settings['username'], settings['password'])
+    client.reconnect_delay_set(min_delay=1, max_delay=60)
+    ingestor.attach(client)
+    properties = Properties(PacketTypes.CONNECT)
+    properties.SessionExpiryInterval = SESSION_EXPIRY_SECONDS
+    client.connect_async(settings['broker'], settings['port'], clean_start=False, properties=properties)
+    client.loop_start()
+    return client
+
+
+def start_ingest(store, metrics=None, settings=None, **options):
+    """Starts an AlertIngestor on the configured broker. Returns (ingestor, client)."""
+    settings = settings or mqtt_settings()
+    ingestor = AlertIngestor(store, settings['topic'], metrics=metrics, **options)
+    return ingestor, connect_ingestor(ingestor, settings)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    from alert_store import get_store
+    from database import DB_PATH
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(script_dir, '../serbot'))
+    from metrics import Metrics
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Store alerts from the MQTT alerts topic in alerts.db')
+    parser.add_argument('--batch', type=int, default=DEFAULT_MAX_BATCH, help='Most alerts written per transaction')
+    parser.add_argument('--flush-ms', type=float, default=DEFAULT_FLUSH_SECONDS * 1000,
+                        help='How long to wait for more messages before writing a batch')
+    parser.add_argument('--stats-interval', type=float, default=30.0, help='Seconds between printed ingest stats')
+    parser.add_argument('--metrics-file', default=None,
+                        help='Write Prometheus metrics to this file every stats interval (node_exporter textfile)')
+    args = parser.parse_args()
+
+    metrics = Metrics('ppe_backend')
+    store = get_store(DB_PATH, metrics=metrics)
+    ingestor, client = start_ingest(store, metrics, max_batch=args.batch, flush_seconds=args.flush_ms / 1000)
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            metrics.set('mqtt_ingest_queue_depth', ingestor.queue_depth())
+            print(f"[MQTT ingest] {json.dumps(ingestor.stats())}")
+            if args.metrics_file:
+                metrics.write(args.metrics_file)
+    except KeyboardInterrupt:
+        print("Stopping MQTT ingest.")
+    finally:
+        ingestor.close()
+        client.loop_stop()
+        store.close()
@@ -0,0 +1,118 @@
+"""
+Measures /api/alerts query latency as the alerts table grows: the first page,
+a page 90% of the way through the table, and filtered pages (type, robot,
+time range), each fetched with keyset pagination (alert_store.query_alerts)
+and, for comparison, with LIMIT/OFFSET.
+
+    python query_benchmark.py --rows 100000 1000000 3000000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from alert_store import COLUMNS, INSERT_SQL, connect, encode_cursor, migrate, query_alerts
+
+TYPES = ('critical', 'warning', 'info')
+PRIORITIES = ('HIGH', 'MEDIUM', 'LOW')
+ROBOTS = [f'robot-{i}' for i in range(20)]
+
+
+def populate(conn, rows, start=0, chunk=50000):
+    """Appends alerts start..rows, about one per second, spread over the robots and types."""
+    rng = random.Random(start)
+    base = 1.7e9
+    for first in range(start, rows, chunk):
+        batch = []
+        for i in range(first, min(first + chunk, rows)):
+            robot = rng.choice(ROBOTS)
+            batch.append((f'bench-{i}', rng.choice(TYPES), 'CRITICAL: PPE Missing',
+                          f'Person at [10,10,320,475] on camera {i % 4} is missing: gloves',
+                          rng.choice(PRIORITIES), base + i, base + i, robot, str(i % 4)))
+        with conn:
+            conn.executemany(INSERT_SQL, batch)
+
+
+def where_clause(filters, since):
+    clauses = [f'{column} = ?' for column in filters]
+    params = list(filters.values())
+    if since is not None:
+        clauses.append('received_at >= ?')
+        params.append(since)
+    return (f" WHERE {' AND '.join(clauses)}" if clauses else ''), params
+
+
+def offset_page(conn, filters, since, page, limit):
+    where, params = where_clause(filters, since)
+    sql = (f"SELECT rowid, {', '.join(COLUMNS)} FROM alerts{where}"
+           f" ORDER BY received_at DESC, rowid DESC LIMIT ? OFFSET ?")
+    return conn.execute(sql, params + [limit, page * limit]).fetchall()
+
+
+def keyset_cursor(conn, filters, since, page, limit):
+    """The cursor a client paging with query_alerts holds before `page`; None for the first page."""
+    if page == 0:
+        return None
+    last = offset_page(conn, filters, since, page - 1, limit)[-1]
+    return encode_cursor(last[COLUMNS.index('received_at') + 1], last[0])
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return round(float(np.median(samples)) * 1000, 3)
+
+
+def measure(conn, rows, limit, repeat):
+    cases = {
+        'all': ({}, None),
+        'type': ({'type': 'warning'}, None),
+        'robot': ({'robot': 'robot-7'}, None),
+        'last_hour': ({}, 1.7e9 + rows - 3600),
+    }
+    results = {}
+    for name, (filters, since) in cases.items():
+        where, params = where_clause(filters, since)
+        matching = conn.execute(f'SELECT count(*) FROM alerts{where}', params).fetchone()[0]
+        for label, page in (('first', 0), ('deep', int(matching / limit * 0.9))):
+            cursor = keyset_cursor(conn, filters, since, page, limit)
+            results[f'{name}_{label}'] = {
+                'page': page,
+                'keyset_ms': timed(lambda: query_alerts(conn, filters, since, None, cursor, limit), repeat),
+                'offset_ms': timed(lambda: offset_page(conn, filters, since, page, limit), repeat)
+            }
+    return results
+
+
+def run(row_counts, limit=100, repeat=5, directory=None):
+    report = []
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        conn = connect(os.path.join(tmp, 'alerts.db'))
+        migrate(conn)
+        populated = 0
+        for rows in sorted(row_counts):
+            populate(conn, rows, populated)
+            populated = rows
+            conn.execute('ANALYZE')
+            report.append({'rows': rows, 'queries': measure(conn, rows, limit, repeat)})
+            print(json.dumps(report[-1]))
+        conn.close()
+    return {'limit': limit, 'sqlite': sqlite3.sqlite_version, 'results': report}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare keyset and OFFSET pagination latency of /api/alerts queries')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000], help='Table sizes to measure')
+    parser.add_argument('--limit', type=int, default=100, help='Page size')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per query, the median is reported')
+    parser.add_argument('--dir', default=None, help='Directory for the temporary database')
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.limit, args.repeat, args.dir), indent=2))
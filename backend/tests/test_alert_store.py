@@ -0,0 +1,102 @@
+import sqlite3
+import time
+
+import pytest
+
+from alert_store import (
+    COLUMNS, FILTER_COLUMNS, SCHEMA_VERSION, AlertStore, decode_cursor, encode_cursor, iter_alerts, migrate, query_alerts
+)
+
+
+def alert(alert_id, **fields):
+    return dict({'id': alert_id, 'type': 'critical', 'title': 'CRITICAL: PPE Missing', 'time': time.time()}, **fields)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AlertStore(str(tmp_path / 'alerts.db'), flush_seconds=0.001)
+    yield store
+    store.close()
+
+
+def stored_ids(store):
+    return sorted(row[0] for row in store.reader().execute('SELECT id FROM alerts'))
+
+
+def test_an_unbindable_alert_fails_alone_and_the_writer_keeps_running(store):
+    with pytest.raises(OverflowError):
+        store.insert(alert('huge', priority=10 ** 30), timeout=5)
+    errors = store.insert_many([alert('a'), alert('big', priority=-10 ** 30), alert('b')], timeout=5)
+    assert [type(error) for error in errors] == [type(None), OverflowError, type(None)]
+    with pytest.raises(sqlite3.Error):
+        store.insert(alert('nested', priority={'not': 'a scalar'}), timeout=5)
+
+    store.insert(alert('after'), timeout=5)
+    assert stored_ids(store) == ['a', 'after', 'b']
+    assert store.stats()['failed_rows'] == 3
+
+
+def test_an_out_of_range_time_falls_back_to_the_received_time(store):
+    store.insert(alert('far', time=10 ** 400), timeout=5)
+    created_at, received_at = store.reader().execute('SELECT created_at, received_at FROM alerts').fetchone()
+    assert created_at == received_at
+
+
+def test_a_pre_versioning_database_is_migrated_in_place(tmp_path):
+    path = str(tmp_path / 'alerts.db')
+    # The table database.py created before the schema was versioned
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('CREATE TABLE alerts (id TEXT PRIMARY KEY, type TEXT, title TEXT, description TEXT, priority TEXT)')
+        conn.execute("INSERT INTO alerts VALUES ('old', 'critical', 'CRITICAL: PPE Missing', NULL, 'high')")
+    conn.close()
+
+    before = time.time()
+    store = AlertStore(path)
+    store.insert(alert('new', robot='robot-1', camera='cam-0'), timeout=5)
+    conn = store.reader()
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    assert [row[1] for row in conn.execute('PRAGMA table_info(alerts)')] == list(COLUMNS)
+    old = conn.execute("SELECT priority, created_at, received_at, robot FROM alerts WHERE id = 'old'").fetchone()
+    assert old[0] == 'high' and old[1] == old[2] >= before and old[3] is None
+    indexes = {row[1] for row in conn.execute('PRAGMA index_list(alerts)')}
+    assert {f'idx_alerts_{column}_received' for column in FILTER_COLUMNS} <= indexes
+    store.close()
+
+    # Reopening finds the latest version and leaves the data alone
+    store = AlertStore(path)
+    assert migrate(store.reader()) == SCHEMA_VERSION
+    assert stored_ids(store) == ['new', 'old']
+    store.close()
+
+
+def test_cursors_round_trip_and_reject_foreign_values():
+    assert decode_cursor(encode_cursor(1700000000.25, 42)) == (1700000000.25, 42)
+    for cursor in ('', 'not-a-cursor', encode_cursor('soon', 1)[:-2]):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_keyset_pages_cover_every_match_once(store, descending):
+    # Bulk lists share one received_at, so pages have to split ties on rowid
+    store.insert_many([alert(f'a{i:02}', priority='high' if i % 3 else 'low', camera=f'cam-{i % 2}')
+                       for i in range(25)], timeout=5)
+    store.insert_many([alert(f'b{i:02}', priority='high', camera='cam-0') for i in range(10)], timeout=5)
+    conn = store.reader()
+    filters = {'priority': 'high', 'camera': 'cam-0'}
+    expected = [row[0] for row in conn.execute(
+        'SELECT id FROM alerts WHERE priority = ? AND camera = ? ORDER BY received_at, rowid', ('high', 'cam-0'))]
+    if descending:
+        expected.reverse()
+
+    pages, cursor = [], None
+    while True:
+        alerts, cursor = query_alerts(conn, filters, cursor=cursor, limit=4, descending=descending)
+        pages.append([a['id'] for a in alerts])
+        if cursor is None:
+            break
+    assert [alert_id for page in pages for alert_id in page] == expected
+    assert all(len(page) == 4 for page in pages[:-1]) and 0 < len(pages[-1]) <= 4
+    streamed = [a['id'] for a in iter_alerts(conn, filters, descending=descending, page_size=3, limit=7)]
+    assert streamed == expected[:7]
@@ -0,0 +1,73 @@
+import json
+import time
+
+import pytest
+
+# app.py loads the detector at import; without its dependencies these tests are skipped
+app = pytest.importorskip('app')
+
+
+def alert(alert_id, **fields):
+    return dict({'id': alert_id, 'type': 'critical', 'title': 'CRITICAL: PPE Missing', 'time': time.time()}, **fields)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DATABASE_PATH', str(tmp_path / 'alerts.db'))
+    yield app.app.test_client()
+    app.alert_store().close()
+
+
+def test_alert_pages_and_ndjson_stream_list_the_same_alerts(client):
+    app.alert_store().insert_many([alert(f'a{i}', robot='robot-1' if i % 2 else 'robot-2') for i in range(9)])
+
+    ids, cursor = [], None
+    while True:
+        query = {'robot': 'robot-1', 'order': 'asc', 'limit': 2, **({'cursor': cursor} if cursor else {})}
+        page = client.get('/api/alerts', query_string=query).get_json()
+        ids += [a['id'] for a in page['alerts']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert ids == ['a1', 'a3', 'a5', 'a7']
+
+    response = client.get('/api/alerts', query_string={'robot': 'robot-1', 'order': 'asc', 'format': 'ndjson'})
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in response.get_data(as_text=True).splitlines()] == ids
+
+
+def test_invalid_alert_queries_are_rejected(client):
+    for query in ({'cursor': 'bogus'}, {'order': 'sideways'}, {'limit': 0}, {'format': 'ndjson', 'cursor': 'x'}):
+        response = client.get('/api/alerts', query_string=query)
+        assert response.status_code == 400 and response.get_json()['message']
+
+
+def test_bulk_alerts_report_each_item_and_store_the_valid_ones(client):
+    items = [alert('ok-1'), {'id': 'partial'}, 'not an object', alert('huge', priority=10 ** 30), alert('ok-2')]
+    response = client.post('/api/log-alerts', json=items)
+    assert response.status_code == 207
+    payload = response.get_json()
+    assert payload['stored'] == 2 and payload['failed'] == 3 and payload['message']
+    assert [(r['index'], r['id'], r['status']) for r in payload['results']] == [
+        (0, 'ok-1', 'stored'), (1, 'partial', 'error'), (2, None, 'error'), (3, 'huge', 'error'), (4, 'ok-2', 'stored')]
+    assert payload['results'][1]['message'] == 'Missing required alert data: title, type'
+    stored = app.alert_store().reader().execute('SELECT id FROM alerts ORDER BY id').fetchall()
+    assert [row[0] for row in stored] == ['ok-1', 'ok-2']
+
+
+def test_bulk_alerts_with_nothing_stored_are_a_400_with_per_item_results(client):
+    body = '{"id": "x"}\nnot json\n'
+    response = client.post('/api/log-alerts', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 400
+    payload = response.get_json()
+    assert payload['status'] == 'error' and payload['message'] == 'Stored 0 of 2 alerts'
+    assert [r['status'] for r in payload['results']] == ['error', 'error']
+    assert payload['results'][1]['message'].startswith('Invalid JSON')
+
+
+def test_database_errors_fail_only_their_bulk_items():
+    items = [alert('a'), alert('b'), {'id': 'c'}]
+    payload, status = app.bulk_alerts_response(items, [None, None, 'Missing'], [None, OverflowError('too big')])
+    assert status == 207
+    assert [(r['status'], r.get('message')) for r in payload['results']] == [
+        ('stored', None), ('error', 'Database error'), ('error', 'Missing')]
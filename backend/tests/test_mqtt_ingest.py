@@ -0,0 +1,178 @@
+import json
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from alert_store import AlertStore
+from mqtt_ingest import AlertIngestor
+
+
+class FakeClient:
+    """Stands in for a paho client with manual acknowledgements."""
+
+    def __init__(self):
+        self.subscriptions = []
+        self.acks = []
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append((topic, qos))
+
+    def ack(self, mid, qos):
+        self.acks.append(mid)
+
+
+class FlakyStore:
+    """An AlertStore that rejects chosen alert ids a number of times, after failing entirely `outages` times."""
+
+    def __init__(self, store, rejections=None, outages=0):
+        self.store = store
+        self.rejections = dict(rejections or {})
+        self.outages = outages
+        self.calls = 0
+
+    def reader(self):
+        return self.store.reader()
+
+    def insert_many(self, alerts):
+        self.calls += 1
+        if self.outages:
+            self.outages -= 1
+            raise sqlite3.OperationalError('database is locked')
+        errors = []
+        for alert in alerts:
+            rejected = self.rejections.get(alert['id'], 0) > 0
+            if rejected:
+                self.rejections[alert['id']] -= 1
+            errors.append(sqlite3.IntegrityError('rejected') if rejected else None)
+        self.store.insert_many([alert for alert, error in zip(alerts, errors) if error is None])
+        return errors
+
+
+def alert(alert_id):
+    return json.dumps({'id': alert_id, 'type': 'critical', 'title': 'CRITICAL: PPE Missing', 'time': time.time()})
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AlertStore(str(tmp_path / 'alerts.db'), flush_seconds=0.001)
+    yield store
+    store.close()
+
+
+def deliver(ingestor, client, payloads, first_mid=1):
+    for mid, payload in enumerate(payloads, first_mid):
+        ingestor.on_message(client, None, SimpleNamespace(payload=payload, mid=mid, qos=1))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def stored_ids(store):
+    return sorted(row[0] for row in store.reader().execute('SELECT id FROM alerts'))
+
+
+def test_subscribes_on_every_connect(store):
+    client = FakeClient()
+    ingestor = AlertIngestor(store, topic='alerts', qos=1)
+    ingestor.attach(client)
+    client.on_connect(client, None, {}, 0)
+    client.on_connect(client, None, {}, 0)
+    assert client.subscriptions == [('alerts', 1), ('alerts', 1)]
+    ingestor.close()
+
+
+def test_duplicates_are_acked_but_stored_once_across_batches_and_restarts(store):
+    client = FakeClient()
+    ingestor = AlertIngestor(store)
+    ingestor.attach(client)
+    deliver(ingestor, client, [alert('a'), alert('b'), alert('a')])
+    wait_for(lambda: ingestor.counters['batches'] >= 1)
+    # A redelivery in a later batch
+    deliver(ingestor, client, [alert('b'), alert('c')], first_mid=4)
+    ingestor.close()
+
+    # ...and after a restart
+    restarted = AlertIngestor(store)
+    restarted.attach(client)
+    deliver(restarted, client, [alert('c'), alert('d')], first_mid=6)
+    restarted.close()
+
+    assert stored_ids(store) == ['a', 'b', 'c', 'd']
+    assert client.acks == [1, 2, 3, 4, 5, 6, 7]
+    assert ingestor.counters['stored'] == 3 and ingestor.counters['duplicate'] == 2
+    assert restarted.counters['stored'] == 1 and restarted.counters['duplicate'] == 1
+
+
+def test_invalid_payloads_are_acked_and_dropped(store):
+    client = FakeClient()
+    ingestor = AlertIngestor(store)
+    ingestor.attach(client)
+    deliver(ingestor, client, [b'not json', json.dumps(['a list']), json.dumps({'id': 'x'}), alert('ok')])
+    ingestor.close()
+
+    assert stored_ids(store) == ['ok']
+    assert client.acks == [1, 2, 3, 4]
+    assert ingestor.counters['invalid'] == 3
+
+
+def test_rejected_alerts_are_retried_locally_before_acking_in_order(store):
+    client = FakeClient()
+    flaky = FlakyStore(store, rejections={'bad': 2})
+    ingestor = AlertIngestor(flaky, retry_seconds=0.01)
+    ingestor.attach(client)
+    deliver(ingestor, client, [alert('good'), alert('bad'), alert('later')])
+    wait_for(lambda: ingestor.counters['batches'] >= 1)
+    ingestor.close()
+
+    # No broker redelivery on a live connection: the ingestor itself retried 'bad'
+    assert stored_ids(store) == ['bad', 'good', 'later']
+    assert client.acks == [1, 2, 3]
+    assert ingestor.counters['retries'] == 2 and ingestor.counters['failed'] == 0
+
+
+def test_a_store_outage_is_retried_beyond_max_attempts(store):
+    client = FakeClient()
+    flaky = FlakyStore(store, outages=5)
+    ingestor = AlertIngestor(flaky, retry_seconds=0.01, max_attempts=2)
+    ingestor.attach(client)
+    deliver(ingestor, client, [alert('a'), alert('b')])
+    wait_for(lambda: ingestor.counters['batches'] >= 1)
+    ingestor.close()
+
+    assert stored_ids(store) == ['a', 'b']
+    assert client.acks == [1, 2]
+    assert flaky.calls == 6
+
+
+def test_an_alert_rejected_max_attempts_times_is_acked_and_dropped(store):
+    client = FakeClient()
+    flaky = FlakyStore(store, rejections={'bad': 100})
+    ingestor = AlertIngestor(flaky, retry_seconds=0.01, max_attempts=3)
+    ingestor.attach(client)
+    deliver(ingestor, client, [alert('good'), alert('bad'), alert('later')])
+    wait_for(lambda: ingestor.counters['batches'] >= 1)
+    ingestor.close()
+
+    assert stored_ids(store) == ['good', 'later']
+    assert client.acks == [1, 2, 3]
+    assert flaky.calls == 3 and ingestor.counters['failed'] == 1
+
+
+def test_close_leaves_unstored_messages_unacked_for_the_next_session(store):
+    client = FakeClient()
+    flaky = FlakyStore(store, outages=10 ** 6)
+    ingestor = AlertIngestor(flaky, retry_seconds=0.01)
+    ingestor.attach(client)
+    deliver(ingestor, client, [b'not json', alert('a'), alert('b')])
+    wait_for(lambda: flaky.calls >= 2)
+    ingestor.close()
+
+    assert client.acks == [1]
+    assert stored_ids(store) == []
+    assert ingestor.counters['invalid'] == 1 and ingestor.counters['failed'] == 2
@@ -1,8 +1,16 @@
 import { alerts } from './config.js';
 
+// Acknowledgements made within this many milliseconds are logged with one request
+const ACK_FLUSH_MS = 500;
+
+// Use environment variable for the API URL, with a local fallback
+const logAlertsUrl = () => `${import.meta.env.VITE_BACKEND_API_URL || 'http://127.0.0.1:5001'}/api/log-alerts`;
+
 export class AlertManager {
     constructor() {
         this.alertsContainer = document.getElementById('alertsContainer');
+        this.pendingAcks = [];
+        this.ackTimer = null;
         this.initializeAlerts();
         this.setupEventListeners();
     }
@@ -56,34 +64,64 @@ export class AlertManager {
         return { id, type, title, description, priority };
     }
 
-    async acknowledgeAlert(button) {
+    acknowledgeAlert(button) {
         const alertCard = button.closest('.alert-card');
         alertCard.style.opacity = '0.7';
         button.textContent = 'Acknowledged';
         button.disabled = true;
         button.style.background = 'rgba(100, 100, 100, 0.3)';
 
-        // --- Send data to backend for logging ---
-        const alertData = this.getAlertDataFromCard(alertCard);
-        
+        // --- Queue data for logging; acknowledgements are sent to the backend in batches ---
+        this.pendingAcks.push(this.getAlertDataFromCard(alertCard));
+        if (!this.ackTimer) {
+            this.ackTimer = setTimeout(() => this.flushAcknowledgements(), ACK_FLUSH_MS);
+        }
+    }
+
+    async flushAcknowledgements() {
+        const alertBatch = this.pendingAcks;
+        this.pendingAcks = [];
+        this.ackTimer = null;
+        if (alertBatch.length === 0) {
+            return;
+        }
+
         try {
-            // Use environment variable for the API URL, with a local fallback
-            const apiUrl = import.meta.env.VITE_BACKEND_API_URL || 'http://127.0.0.1:5001';
-            const response = await fetch(`${apiUrl}/api/log-alert`, {
+            const response = await fetch(logAlertsUrl(), {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify(alertData),
+                body: JSON.stringify(alertBatch),
             });
             const result = await response.json();
             if (response.ok) {
-                console.log('Alert logged successfully:', result.message);
+                console.log(`Logged ${result.stored} alert(s)`);
             } else {
-                console.error('Failed to log alert:', result.message);
+                console.error('Failed to log alerts:', result.message);
             }
+            // Per-alert results come with 201/207 and with a 400 where no alert was stored
+            (result.results || [])
+                .filter(item => item.status !== 'stored')
+                .forEach(item => console.error('Failed to log alert:', item.id, item.message));
         } catch (error) {
-            console.error('Error sending alert to backend:', error);
+            console.error('Error sending alerts to backend:', error);
+        }
+    }
+
+    // Sends acknowledgements still waiting for the timer when the page is hidden or closed
+    beaconAcknowledgements() {
+        if (this.pendingAcks.length === 0) {
+            return;
+        }
+        clearTimeout(this.ackTimer);
+        // text/plain keeps the cross-origin beacon a simple request; the backend parses the JSON array regardless
+        const body = new Blob([JSON.stringify(this.pendingAcks)], { type: 'text/plain;charset=UTF-8' });
+        if (navigator.sendBeacon(logAlertsUrl(), body)) {
+            this.pendingAcks = [];
+            this.ackTimer = null;
+        } else {
+            this.flushAcknowledgements();
         }
     }
 
@@ -114,5 +152,11 @@ export class AlertManager {
                 this.resolveAlert(e.target);
             }
         });
+        window.addEventListener('pagehide', () => this.beaconAcknowledgements());
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') {
+                this.beaconAcknowledgements();
+            }
+        });
     }
 } 
\ No newline at end of file
@@ -143,7 +143,7 @@ if (uploadBtn && fileInput && modal && closeModal && resultImage && resultDetail
       const data = await res.json();
       // Display result
       if (data.annotated_image) {
-        resultImage.innerHTML = `<img src="data:image/png;base64,${data.annotated_image}" style="max-width:100%;">`;
+        resultImage.innerHTML = `<img src="data:image/${data.image_format || 'png'};base64,${data.annotated_image}" style="max-width:100%;">`;
       } else {
         resultImage.innerHTML = '';
       }
@@ -0,0 +1,152 @@
+"""
+Alert publishing layer for the serbot. Violations found in one frame are
+coalesced into a single MQTT message, repeats of the same person/location and
+missing-PPE set are suppressed for a configurable window, and every topic is
+rate limited by a token bucket. Counters record what was merged or dropped.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = max(float(burst), 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+def violation_key(person_xyxy, missing_ppe, track_id=None, grid=50, source=None):
+    """
+    Identity of a violation for repeat suppression: the source and track ID
+    when tracking, otherwise the source and the person box snapped to a
+    `grid`-pixel grid, plus the missing set.
+    """
+    if track_id is not None:
+        where = (source, 'track', track_id)
+    else:
+        where = (source, 'box') + tuple(int(v) // grid for v in person_xyxy)
+    return where, frozenset(missing_ppe)
+
+
+def build_alert_payload(violations, robot=None):
+    """One alert message for all violations of a frame, in the frontend's alert format."""
+    lines = []
+    for v in violations:
+        who = f"Person #{v['track_id']}" if v.get('track_id') is not None else 'Person'
+        where = f" on camera {v['source']}" if v.get('source') is not None else ''
+        lines.append(f"{who} at {v['person_box']}{where} is missing: {', '.join(v['missing_ppe'])}")
+    payload = {
+        "id": uuid.uuid4().hex,
+        "icon": "⚠️",
+        "title": "CRITICAL: PPE Missing" if len(violations) == 1 else f"CRITICAL: PPE Missing ({len(violations)} persons)",
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "description": "; ".join(lines),
+        "priority": "HIGH",
+        "type": "critical",
+        "violations": violations
+    }
+    if robot is not None:
+        payload["robot"] = robot
+    # Single-person messages keep the original top-level fields
+    if len(violations) == 1:
+        payload["person_box"] = violations[0]["person_box"]
+        payload["missing_ppe"] = violations[0]["missing_ppe"]
+    return payload
+
+
+class AlertPublisher:
+    """
+    Collects violations with `add` and publishes them with `flush`, once per frame.
+
+    Violations seen within `suppress_window` seconds are dropped. When the
+    topic's token bucket is empty the frame's violations stay pending and are
+    merged into the next message, up to `max_pending` of them.
+    """
+
+    def __init__(self, client, topic, suppress_window=60.0, rate=0.5, burst=3, max_pending=100, grid=50, qos=0,
+                 robot=None):
+        self.client = client
+        self.topic = topic
+        self.suppress_window = suppress_window
+        self.max_pending = max_pending
+        self.grid = grid
+        self.qos = qos
+        # Identifies this robot in its alerts so the backend can filter by robot
+        self.robot = robot
+        self.buckets = {}
+        self.bucket_rate = rate
+        self.bucket_burst = burst
+        self.last_seen = {}
+        self.pending = []
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, person_xyxy, missing_ppe, track_id=None, source=None):
+        """Queues one raw violation. Returns False if it was suppressed or dropped."""
+        now = time.monotonic()
+        key = violation_key(person_xyxy, missing_ppe, track_id, self.grid, source)
+        with self._lock:
+            self.counters['raw'] += 1
+            last = self.last_seen.get(key)
+            if last is not None and now - last < self.suppress_window:
+                self.counters['suppressed'] += 1
+                return False
+            if len(self.pending) >= self.max_pending:
+                self.counters['dropped'] += 1
+                return False
+            self.last_seen[key] = now
+            x1, y1, x2, y2 = (int(v) for v in person_xyxy)
+            violation = {"person_box": f"[{x1},{y1},{x2},{y2}]", "missing_ppe": list(missing_ppe)}
+            if track_id is not None:
+                violation["track_id"] = track_id
+            if source is not None:
+                violation["source"] = source
+            self.pending.append(violation)
+            return True
+
+    def flush(self, topic=None):
+        """Publishes pending violations as one message if the topic's rate limit allows."""
+        topic = topic or self.topic
+        with self._lock:
+            self._forget_expired()
+            if not self.pending:
+                return None
+            bucket = self.buckets.setdefault(topic, TokenBucket(self.bucket_rate, self.bucket_burst))
+            if not bucket.try_acquire():
+                self.counters['rate_limited'] += 1
+                return None
+            violations, self.pending = self.pending, []
+            self.counters['published'] += 1
+            self.counters['merged'] += len(violations) - 1
+        payload = build_alert_payload(violations, self.robot)
+        self.client.publish(topic, json.dumps(payload), qos=self.qos)
+        print(f"[ALERT] Sent MQTT ({len(violations)} violation(s)): {payload['description']}")
+        return payload
+
+    def _forget_expired(self):
+        now = time.monotonic()
+        expired = [k for k, t in self.last_seen.items() if now - t >= self.suppress_window]
+        for k in expired:
+            del self.last_seen[k]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = len(self.pending)
+        return stats
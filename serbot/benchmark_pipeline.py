@@ -0,0 +1,265 @@
+"""
+Benchmark runner for the detection pipeline. Replays a directory of images
+and video files through every stage (decode, inference per model, detection
+extraction, NMS/WBF fusion, PPE assignment, annotation and encoding), then
+writes throughput and p50/p95/p99 latency per stage as JSON, together with the
+commit and hardware the run was made on, so runs can be compared.
+
+    python benchmark_pipeline.py --media samples/ --output bench.json
+    python benchmark_pipeline.py --media samples/ --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+from ensemble import extract_detections, missing_ppe_per_person, nms_merge, wbf_merge
+from model_backends import BACKEND_PYTORCH, BACKENDS, PRECISION_FP32, PRECISIONS, load_model
+from ppe_assignment import POLICIES, POLICY_CENTER
+
+# Same ensemble as serbot_inference.MODEL_PATHS
+MODEL_PATHS = ['yolo8s.pt', 'yolo8n.pt', 'yolov8x.pt']
+ALL_PPE_CLASSES = ['face-guard', 'ear-mufs', 'safety-vest', 'gloves', 'glasses']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+
+class StageTimer:
+    """Collects per-call durations for named pipeline stages."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.enabled = True
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        if self.enabled:
+            self.durations[name].append(time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        if self.enabled:
+            self.durations[name].append(seconds)
+
+    def summary(self):
+        """Calls, throughput (calls per second of stage time) and latency percentiles in ms, per stage."""
+        stages = {}
+        for name, values in self.durations.items():
+            values = np.asarray(values)
+            total = float(values.sum())
+            stages[name] = {
+                'count': len(values),
+                'total_s': round(total, 4),
+                'throughput_per_s': round(len(values) / total, 2) if total > 0 else None,
+                'mean_ms': round(float(values.mean()) * 1000, 3),
+                'p50_ms': round(float(np.percentile(values, 50)) * 1000, 3),
+                'p95_ms': round(float(np.percentile(values, 95)) * 1000, 3),
+                'p99_ms': round(float(np.percentile(values, 99)) * 1000, 3)
+            }
+        return stages
+
+
+def media_files(path):
+    """Images and videos under `path` (a file or a directory), in a stable order."""
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, _, names in sorted(os.walk(path)):
+        files.extend(os.path.join(root, n) for n in sorted(names)
+                     if n.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS))
+    return files
+
+
+def iter_frames(files, timer, max_video_frames=100):
+    """Yields BGR frames of every file, timing image and video decoding as the 'decode' stage."""
+    for path in files:
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            start = time.perf_counter()
+            frame = cv2.imread(path)
+            timer.record('decode', time.perf_counter() - start)
+            if frame is not None:
+                yield frame
+            continue
+        cap = cv2.VideoCapture(path)
+        for _ in range(max_video_frames):
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            timer.record('decode', time.perf_counter() - start)
+            yield frame
+        cap.release()
+
+
+def annotate(frame, detections, missing_per_person):
+    """Draws person boxes and their missing PPE the way the apps do."""
+    annotated = frame.copy()
+    for (x1, y1, x2, y2), missing in zip(detections.person_boxes.tolist(), missing_per_person):
+        color = (0, 0, 255) if missing else (0, 255, 0)
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
+        label = 'Missing: ' + ', '.join(missing) if missing else 'All PPE'
+        cv2.putText(annotated, label, (x1, max(y1 - 10, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    for (x1, y1, x2, y2), label in zip(detections.ppe_boxes.tolist(), detections.ppe_labels):
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        cv2.putText(annotated, label, (x1, max(y1 - 10, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+    return annotated
+
+
+def process_frame(frame, models, timer, conf_threshold, required_ppe, imgsz=None):
+    """Runs one frame through every stage."""
+    frame_start = time.perf_counter()
+    options = {'imgsz': imgsz} if imgsz else {}
+    members = []
+    for path, model in models:
+        with timer.stage(f'inference:{path}'):
+            results = model(frame, conf=conf_threshold, verbose=False, **options)[0]
+        with timer.stage('extract'):
+            detections = extract_detections(results, model.names, ALL_PPE_CLASSES)
+        if detections is not None:
+            members.append(detections)
+    if not members:
+        return
+
+    with timer.stage('fusion:nms'):
+        merged = nms_merge(members, conf_threshold)
+    with timer.stage('fusion:wbf'):
+        wbf_merge(members, skip_threshold=conf_threshold)
+
+    missing = {}
+    for policy in POLICIES:
+        with timer.stage(f'assignment:{policy}'):
+            missing[policy] = missing_ppe_per_person(merged, required_ppe, policy=policy)
+
+    with timer.stage('annotate'):
+        annotated = annotate(frame, merged, missing[POLICY_CENTER])
+    with timer.stage('encode:jpg'):
+        cv2.imencode('.jpg', annotated)
+    with timer.stage('encode:png'):
+        cv2.imencode('.png', annotated)
+    timer.record('frame_total', time.perf_counter() - frame_start)
+
+
+def _version(module_name):
+    try:
+        return __import__(module_name).__version__
+    except Exception:
+        return None
+
+
+def environment():
+    """Commit and hardware the run was made on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'versions': {name: _version(name) for name in ('numpy', 'cv2', 'ultralytics', 'torch')}
+    }
+
+
+def compare(results, baseline):
+    """Relative change of p50/p95 per stage against a previous run."""
+    changes = {}
+    for name, stage in results['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if not old:
+            continue
+        changes[name] = {
+            key: round((stage[key] - old[key]) / old[key] * 100, 1) if old[key] else None
+            for key in ('p50_ms', 'p95_ms')
+        }
+    return changes
+
+
+def run(media, model_paths, conf_threshold=0.5, required_ppe=None, max_video_frames=100, warmup=3, repeat=1,
+        backend=BACKEND_PYTORCH, precision=PRECISION_FP32, calibration=None, imgsz=None):
+    files = media_files(media)
+    if not files:
+        raise ValueError(f'No images or videos found in {media}')
+    required_ppe = required_ppe or ALL_PPE_CLASSES
+    models = [(path, load_model(path, backend, precision, calibration)) for path in model_paths]
+    timer = StageTimer()
+
+    # Warm-up frames are run through the pipeline but not recorded
+    timer.enabled = False
+    for i, frame in enumerate(iter_frames(files, timer, max_video_frames)):
+        if i >= warmup:
+            break
+        process_frame(frame, models, timer, conf_threshold, required_ppe, imgsz)
+    timer.enabled = True
+
+    frames = 0
+    wall_start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in iter_frames(files, timer, max_video_frames):
+            process_frame(frame, models, timer, conf_threshold, required_ppe, imgsz)
+            frames += 1
+    wall = time.perf_counter() - wall_start
+
+    return {
+        'environment': environment(),
+        'config': {
+            'media': media, 'files': len(files), 'models': model_paths, 'backend': backend, 'precision': precision,
+            'conf': conf_threshold, 'imgsz': imgsz, 'required_ppe': required_ppe,
+            'max_video_frames': max_video_frames, 'warmup': warmup, 'repeat': repeat
+        },
+        'frames': frames,
+        'wall_s': round(wall, 3),
+        'frames_per_s': round(frames / wall, 2) if wall > 0 else None,
+        'stages': timer.summary()
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the PPE detection pipeline')
+    parser.add_argument('--media', required=True, help='Image/video file or directory to replay')
+    parser.add_argument('--models', nargs='+', default=MODEL_PATHS, help='Models to run on every frame')
+    parser.add_argument('--conf', type=float, default=0.5, help='Confidence threshold')
+    parser.add_argument('--ppe', nargs='*', default=ALL_PPE_CLASSES, help='Required PPE items')
+    parser.add_argument('--imgsz', type=int, default=None, help='Model input size (default: the model\'s own)')
+    parser.add_argument('--max-video-frames', type=int, default=100, help='Frames replayed from each video')
+    parser.add_argument('--warmup', type=int, default=3, help='Frames run before measuring')
+    parser.add_argument('--repeat', type=int, default=1, help='Times the media is replayed')
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND_PYTORCH, help='Inference backend')
+    parser.add_argument('--precision', choices=PRECISIONS, default=PRECISION_FP32, help='Model precision')
+    parser.add_argument('--calibration', default=None, help='INT8 calibration images or video')
+    parser.add_argument('--output', default=None, help='Write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', default=None, help='Previous results JSON to compare p50/p95 against')
+    args = parser.parse_args()
+
+    try:
+        results = run(args.media, args.models, conf_threshold=args.conf, required_ppe=args.ppe,
+                      max_video_frames=args.max_video_frames, warmup=args.warmup, repeat=max(args.repeat, 1),
+                      backend=args.backend, precision=args.precision, calibration=args.calibration,
+                      imgsz=args.imgsz)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['change_vs_baseline_pct'] = compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}: {results['frames']} frames at {results['frames_per_s']} frames/s")
+    else:
+        print(json.dumps(results, indent=2))
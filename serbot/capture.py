@@ -0,0 +1,136 @@
+"""
+Latest-frame-only capture for the serbot. A background thread keeps calling
+`grab()` so OpenCV's internal buffer never holds stale frames, and a frame is
+only decoded (`retrieve()`) when inference asks for one. Inference therefore
+always gets the freshest frame and frames nobody uses are never decoded.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class LatestFrameCapture:
+    """
+    `cv2.VideoCapture` wrapper with a single-slot, latest-wins buffer.
+
+    `read()` returns `(ret, frame)` like OpenCV. Video files are grabbed at
+    their native frame rate so they play back in real time instead of being
+    skipped through as fast as the decoder allows. A file ends at EOF; a
+    camera or stream that stops delivering is reopened up to `reopen_attempts`
+    times, `reopen_delay` seconds apart, and only ends when that fails.
+    """
+
+    def __init__(self, source, history=512, reopen_attempts=3, reopen_delay=1.0):
+        self.source = source
+        self.reopen_attempts = reopen_attempts
+        self.reopen_delay = reopen_delay
+        self.reopened = 0
+        self.cap = cv2.VideoCapture(source)
+        self.is_file = isinstance(source, str) and os.path.isfile(source)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+        self.frame_period = 1.0 / fps if fps and fps > 0 else 0.0
+        self.grabbed = 0
+        self.delivered = 0
+        self.ages = deque(maxlen=history)
+        self.ended = False
+        self._cond = threading.Condition()
+        self._want = False
+        self._frame = None
+        self._frame_time = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'capture-{self.source}', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        next_grab = time.monotonic()
+        while not self._stop.is_set():
+            if self.frame_period:
+                delay = next_grab - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_grab += self.frame_period
+            ok = self.cap.grab()
+            if not ok and not self.is_file:
+                ok = self._reopen()
+            grabbed_at = time.monotonic()
+            with self._cond:
+                if not ok:
+                    self.ended = True
+                    self._cond.notify_all()
+                    return
+                self.grabbed += 1
+                if self._want:
+                    ok, frame = self.cap.retrieve()
+                    self._frame = frame if ok else None
+                    self._frame_time = grabbed_at
+                    self._want = False
+                    self._cond.notify_all()
+
+    def _reopen(self):
+        """Reopens a stalled camera/stream and grabs from it. Returns False if every attempt failed."""
+        for attempt in range(1, self.reopen_attempts + 1):
+            if self._stop.wait(self.reopen_delay):
+                return False
+            print(f"[Capture] Reopening {self.source} (attempt {attempt} of {self.reopen_attempts})")
+            self.cap.release()
+            self.cap = cv2.VideoCapture(self.source)
+            if self.cap.isOpened() and self.cap.grab():
+                self.reopened += 1
+                return True
+        return False
+
+    def request(self):
+        """Asks the capture thread to decode the next grabbed frame."""
+        with self._cond:
+            if not self.ended:
+                self._want = True
+
+    def collect(self, timeout=5.0):
+        """
+        Waits for the frame asked for with `request()` and returns `(ret, frame)`.
+        `(False, None)` after a timeout only means no frame yet; `ended` tells
+        whether the source is gone.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: not self._want or self.ended, timeout)
+            if self._want or self._frame is None:
+                self._want = False
+                return False, None
+            frame, self._frame = self._frame, None
+            self.delivered += 1
+            self.ages.append(time.monotonic() - self._frame_time)
+            return True, frame
+
+    def read(self, timeout=5.0):
+        """Waits for the next grabbed frame and returns `(ret, frame)`."""
+        self.request()
+        return self.collect(timeout)
+
+    def stats(self):
+        """Frame age when handed to inference (ms) and frames grabbed but never used."""
+        ages = sorted(self.ages)
+        p50 = ages[len(ages) // 2] * 1000 if ages else None
+        return {
+            'grabbed': self.grabbed,
+            'reopened': self.reopened,
+            'delivered': self.delivered,
+            'dropped': self.grabbed - self.delivered,
+            'frame_age_ms_p50': round(p50, 2) if p50 is not None else None,
+            'frame_age_ms_max': round(ages[-1] * 1000, 2) if ages else None
+        }
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self.cap.release()
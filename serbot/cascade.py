@@ -0,0 +1,133 @@
+"""
+Confidence-gated model cascade. The cheapest model runs on every frame and
+the frame is escalated to the next, larger model only when its result is
+uncertain: a person or PPE item scored close to the confidence threshold, or
+the result disagrees with the previous frame.
+"""
+import time
+from collections import Counter
+
+import numpy as np
+
+from ensemble import Detections, empty_detections, extract_detections
+
+
+def _filter(detections, conf_threshold):
+    """Drops detections scored below the final confidence threshold."""
+    person_keep = detections.person_scores >= conf_threshold
+    ppe_keep = detections.ppe_scores >= conf_threshold
+    return Detections(
+        detections.person_boxes[person_keep], detections.person_scores[person_keep],
+        detections.ppe_boxes[ppe_keep], detections.ppe_scores[ppe_keep],
+        [label for label, keep in zip(detections.ppe_labels, ppe_keep) if keep]
+    )
+
+
+def _summary(detections):
+    """What has to stay stable between frames: person count and PPE label counts."""
+    return len(detections.person_boxes), Counter(detections.ppe_labels)
+
+
+class ModelCascade:
+    """
+    Runs `models` (ordered cheapest first) as escalating tiers.
+
+    A tier is run with its confidence lowered by `margin` so that near-miss
+    detections are visible. Its result is uncertain when any person or PPE
+    score lies within `margin` of `conf_threshold`, or when the person count
+    or PPE label counts differ from the previous accepted frame. Uncertain
+    frames go to the next tier; the last tier is always accepted.
+    """
+
+    def __init__(self, models, ppe_classes, margin=0.15, check_previous=True):
+        self.models = list(models)
+        self.ppe_classes = ppe_classes
+        self.margin = margin
+        self.check_previous = check_previous
+        # Summary of the last accepted frame, per stream key
+        self.previous = {}
+        self.runs = [0] * len(self.models)
+        self.accepted = [0] * len(self.models)
+        self.tier_time = [0.0] * len(self.models)
+        self.reasons = Counter()
+        self.frames = 0
+        self.wall = 0.0
+
+    def _uncertain(self, detections, conf_threshold, previous):
+        low, high = conf_threshold - self.margin, conf_threshold + self.margin
+        if np.any((detections.person_scores >= low) & (detections.person_scores < high)):
+            return 'person_confidence'
+        if np.any((detections.ppe_scores >= low) & (detections.ppe_scores < high)):
+            return 'ppe_confidence'
+        if self.check_previous and previous is not None:
+            if _summary(_filter(detections, conf_threshold)) != previous:
+                return 'previous_frame'
+        return None
+
+    def detect_batch(self, frames, conf_threshold, keys=None):
+        """
+        Cascades several frames at once: each tier runs one batched call over
+        the frames still pending. `keys` name the stream of every frame so the
+        previous-frame check compares frames of the same camera.
+        """
+        start = time.perf_counter()
+        keys = keys if keys is not None else [None] * len(frames)
+        query_conf = max(conf_threshold - self.margin, 0.01)
+        accepted = [None] * len(frames)
+        pending = list(range(len(frames)))
+        for tier, model in enumerate(self.models):
+            if not pending:
+                break
+            tier_start = time.perf_counter()
+            results = model([frames[i] for i in pending], conf=query_conf, verbose=False)
+            self.runs[tier] += len(pending)
+            self.tier_time[tier] += time.perf_counter() - tier_start
+
+            last_tier = tier == len(self.models) - 1
+            escalated = []
+            for i, result in zip(pending, results):
+                detections = extract_detections(result, model.names, self.ppe_classes)
+                if detections is None:
+                    self.reasons['no_person_class'] += 1
+                    escalated.append(i)
+                    continue
+                reason = None if last_tier else self._uncertain(detections, conf_threshold, self.previous.get(keys[i]))
+                accepted[i] = _filter(detections, conf_threshold)
+                if reason is None:
+                    self.accepted[tier] += 1
+                else:
+                    self.reasons[reason] += 1
+                    escalated.append(i)
+            pending = escalated
+
+        accepted = [a if a is not None else empty_detections() for a in accepted]
+        for key, detections in zip(keys, accepted):
+            self.previous[key] = _summary(detections)
+        self.frames += len(frames)
+        self.wall += time.perf_counter() - start
+        return accepted
+
+    def __call__(self, frame, conf_threshold):
+        return self.detect_batch([frame], conf_threshold)[0]
+
+    def stats(self):
+        """Escalation rate and mean latency per tier, plus mean latency per frame."""
+        tiers = []
+        for tier in range(len(self.models)):
+            runs = self.runs[tier]
+            escalated = self.runs[tier + 1] if tier + 1 < len(self.models) else 0
+            tiers.append({
+                'runs': runs,
+                'accepted': self.accepted[tier],
+                'escalation_rate': round(escalated / runs, 3) if runs else None,
+                'mean_ms': round(self.tier_time[tier] / runs * 1000, 2) if runs else None
+            })
+        return {
+            'frames': self.frames,
+            'tiers': tiers,
+            'escalation_reasons': dict(self.reasons),
+            'wall_ms': round(self.wall / self.frames * 1000, 2) if self.frames else None
+        }
+
+    def close(self):
+        pass
@@ -0,0 +1,597 @@
+"""
+Persistent history of every detection: when, which source, box, class,
+confidence and, for persons, the PPE they were missing.
+
+Rows are appended to a compact SQLite table (integer-coded timestamps,
+sources, labels and boxes; missing PPE as a bitmask of label ids) by a writer
+thread that commits once per `flush_seconds`, so recording never blocks the
+capture loop on disk. Maintenance runs on the same thread: finished time
+buckets are rolled up into per-minute counts per source and label, raw rows
+older than `raw_retention` are deleted once rolled up, and rollups older than
+`rollup_retention` are deleted. Raw rows answer "what exactly happened" for
+the last days, rollups answer "how often" for weeks.
+
+    history = open_history()
+    history.record_detections('robot-1/0', detections, missing_per_person)
+    for row in history.detections(since=time.time() - 3600, label='person'):
+        ...
+
+Reports (one row per person, see REPORT_COLUMNS) are exported as CSV or
+Parquet a chunk at a time with export_file(), for any time range the raw
+rows still cover.
+
+Run it directly to benchmark writes, maintenance, queries and exports on synthetic history:
+
+    python detection_store.py --days 14 --sources 4 --fps 2
+"""
+import argparse
+import atexit
+import csv
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+DEFAULT_PATH = os.getenv('SERBOT_HISTORY_PATH',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'detection_history.db'))
+# Raw detections are kept for days, per-minute rollups for months
+DEFAULT_RAW_RETENTION = float(os.getenv('SERBOT_HISTORY_RAW_DAYS', 2)) * 86400
+DEFAULT_ROLLUP_RETENTION = float(os.getenv('SERBOT_HISTORY_ROLLUP_DAYS', 90)) * 86400
+DEFAULT_BUCKET_SECONDS = 60
+DEFAULT_FLUSH_SECONDS = 1.0
+DEFAULT_MAINTENANCE_SECONDS = 60.0
+# Rows waiting for the writer; beyond this the oldest are dropped instead of growing memory
+DEFAULT_MAX_PENDING = 100000
+# Rows deleted per transaction when pruning, so readers and the writer interleave
+PRUNE_CHUNK = 20000
+# Missing PPE is stored as a bitmask over label ids
+MAX_LABEL_ID = 62
+# Detection reports: one row per person, columns as in the apps' detection tables
+REPORT_COLUMNS = ('timestamp', 'source', 'person_location', 'confidence', 'missing_PPE', 'alert')
+REPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+# Report rows held in memory at once while exporting
+REPORT_CHUNK_ROWS = 10000
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS labels (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)',
+    # ts in epoch milliseconds, confidence in thousandths, missing: bitmask of label ids (persons only)
+    '''CREATE TABLE IF NOT EXISTS detections (
+        ts INTEGER NOT NULL,
+        source INTEGER NOT NULL,
+        label INTEGER NOT NULL,
+        x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+        confidence INTEGER,
+        missing INTEGER
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections (ts)',
+    # bucket in epoch seconds. missing: for persons, how many missed any PPE; for a PPE label,
+    # how many persons missed that item
+    '''CREATE TABLE IF NOT EXISTS rollups (
+        bucket INTEGER NOT NULL,
+        source INTEGER NOT NULL,
+        label INTEGER NOT NULL,
+        detections INTEGER NOT NULL,
+        confidence_sum INTEGER NOT NULL,
+        confidence_max INTEGER NOT NULL,
+        missing INTEGER NOT NULL,
+        PRIMARY KEY (bucket, source, label)
+    ) WITHOUT ROWID''',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)',
+]
+
+ROLLUP_SQL = '''
+    INSERT INTO rollups (bucket, source, label, detections, confidence_sum, confidence_max, missing)
+    SELECT ts / :bucket_ms * :bucket_s AS b, source, label, COUNT(*), COALESCE(SUM(confidence), 0),
+           COALESCE(MAX(confidence), 0), COALESCE(SUM(missing > 0), 0)
+    FROM detections WHERE ts >= :start AND ts < :end GROUP BY b, source, label
+    ON CONFLICT (bucket, source, label) DO UPDATE SET
+        detections = detections + excluded.detections,
+        confidence_sum = confidence_sum + excluded.confidence_sum,
+        confidence_max = MAX(confidence_max, excluded.confidence_max),
+        missing = missing + excluded.missing
+'''
+ROLLUP_MISSING_SQL = '''
+    INSERT INTO rollups (bucket, source, label, detections, confidence_sum, confidence_max, missing)
+    SELECT ts / :bucket_ms * :bucket_s AS b, source, :label, 0, 0, 0, COUNT(*)
+    FROM detections WHERE ts >= :start AND ts < :end AND missing & :bit GROUP BY b, source
+    ON CONFLICT (bucket, source, label) DO UPDATE SET missing = missing + excluded.missing
+'''
+
+
+def robot_id():
+    """This machine's name in detection sources, as in serbot alerts."""
+    return os.getenv('SERBOT_ROBOT_ID', socket.gethostname())
+
+
+def source_name(camera, robot=None):
+    """The history source of a camera: '<robot>/<camera>'."""
+    return f'{robot or robot_id()}/{camera}'
+
+
+def report_formats():
+    """The report formats this install can write: Parquet needs pyarrow."""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return ['csv']
+    return list(REPORT_FORMATS)
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    # Only takes effect on a new file: lets maintenance hand freed pages back to the filesystem
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class DetectionStore:
+    """
+    Append-only detection history with rollups and retention.
+
+    record() and record_detections() only queue rows; the writer thread
+    commits them every `flush_seconds` and runs maintain() every
+    `maintenance_seconds`. Queries use a read connection per thread and see
+    rows once they are committed.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, raw_retention=DEFAULT_RAW_RETENTION,
+                 rollup_retention=DEFAULT_ROLLUP_RETENTION, bucket_seconds=DEFAULT_BUCKET_SECONDS,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS, maintenance_seconds=DEFAULT_MAINTENANCE_SECONDS,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.path = path
+        self.raw_retention = raw_retention
+        self.rollup_retention = rollup_retention
+        self.bucket_seconds = int(bucket_seconds)
+        self.flush_seconds = flush_seconds
+        self.maintenance_seconds = maintenance_seconds
+        self.max_pending = max_pending
+        self.pid = os.getpid()
+        self._conn = connect(path)
+        with self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+        self._label_ids = dict(self._conn.execute('SELECT name, id FROM labels'))
+        self._source_ids = dict(self._conn.execute('SELECT name, id FROM sources'))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = []
+        self.counters = {'rows': 0, 'commits': 0, 'dropped': 0, 'rolled_up': 0, 'pruned': 0, 'pruned_rollups': 0}
+        self.last_maintenance_seconds = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='detection-store-writer', daemon=True)
+        self._thread.start()
+
+    def record(self, source, person_boxes, person_scores, missing_per_person, ppe_boxes=(), ppe_scores=(),
+               ppe_labels=(), timestamp=None):
+        """
+        Queues the detections of one frame: persons with the PPE each one is
+        missing (aligned with `person_boxes`) and the PPE items found.
+        """
+        ts = int((time.time() if timestamp is None else timestamp) * 1000)
+        rows = [(ts, source, 'person', *(int(v) for v in box), int(score * 1000), tuple(missing or ()))
+                for box, score, missing in zip(np.asarray(person_boxes).tolist(), np.asarray(person_scores).tolist(),
+                                               missing_per_person)]
+        rows += [(ts, source, label, *(int(v) for v in box), int(score * 1000), None)
+                 for box, score, label in zip(np.asarray(ppe_boxes).tolist(), np.asarray(ppe_scores).tolist(),
+                                              ppe_labels)]
+        if not rows:
+            return
+        with self._lock:
+            self._pending.extend(rows)
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                del self._pending[:overflow]
+                self.counters['dropped'] += overflow
+
+    def record_detections(self, source, detections, missing_per_person, timestamp=None):
+        """Queues an ensemble.Detections and the missing PPE per person, see record()."""
+        self.record(source, detections.person_boxes, detections.person_scores, missing_per_person,
+                    detections.ppe_boxes, detections.ppe_scores, detections.ppe_labels, timestamp)
+
+    def _id(self, table, cache, name):
+        value = cache.get(name)
+        if value is None:
+            self._conn.execute(f'INSERT OR IGNORE INTO {table} (name) VALUES (?)', (name,))
+            value = cache[name] = self._conn.execute(f'SELECT id FROM {table} WHERE name = ?', (name,)).fetchone()[0]
+        return value
+
+    def _missing_mask(self, names):
+        mask = 0
+        for name in names:
+            label = self._id('labels', self._label_ids, name)
+            if label > MAX_LABEL_ID:
+                raise ValueError(f'Too many labels to store missing PPE as a bitmask ({name!r} has id {label})')
+            mask |= 1 << label
+        return mask
+
+    def flush(self):
+        """Commits the queued rows. Runs on the writer thread."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        try:
+            with self._conn:
+                encoded = [(ts, self._id('sources', self._source_ids, source),
+                            self._id('labels', self._label_ids, label), x1, y1, x2, y2, confidence,
+                            None if missing is None else self._missing_mask(missing))
+                           for ts, source, label, x1, y1, x2, y2, confidence, missing in rows]
+                self._conn.executemany('INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', encoded)
+        except Exception:
+            # The rollback also undid new sources/labels: reload the id caches so they match the database
+            self._label_ids = dict(self._conn.execute('SELECT name, id FROM labels'))
+            self._source_ids = dict(self._conn.execute('SELECT name, id FROM sources'))
+            self.counters['dropped'] += len(rows)
+            raise
+        self.counters['rows'] += len(rows)
+        self.counters['commits'] += 1
+        return len(rows)
+
+    def _meta(self, conn, key, default=None):
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def rolled_up_until(self):
+        """Epoch seconds up to which raw rows have been rolled up."""
+        return self._meta(self.reader(), 'rolled_up_until')
+
+    def maintain(self, now=None):
+        """Rolls up finished buckets, then applies retention. Called by the writer thread."""
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+        bucket_ms = self.bucket_seconds * 1000
+        # Leave a grace period for rows still queued for the writer
+        end = int((now - 2 * self.flush_seconds) * 1000) // bucket_ms * bucket_ms
+        with self._conn:
+            # Read the marker, roll up and move it in one write transaction: processes sharing the
+            # database would otherwise both roll up the same range and double-count it
+            self._conn.execute('BEGIN IMMEDIATE')
+            since = self._meta(self._conn, 'rolled_up_until')
+            if since is None:
+                first = self._conn.execute('SELECT MIN(ts) FROM detections').fetchone()[0]
+                since = end if first is None else first // bucket_ms * bucket_ms
+            else:
+                since = int(since * 1000)
+            if end > since:
+                params = {'bucket_ms': bucket_ms, 'bucket_s': self.bucket_seconds, 'start': since, 'end': end}
+                self.counters['rolled_up'] += self._conn.execute(ROLLUP_SQL, params).rowcount
+                # Labels added by other processes too, not just this one's cache
+                for name, label in self._conn.execute('SELECT name, id FROM labels').fetchall():
+                    if label <= MAX_LABEL_ID and name != 'person':
+                        self._conn.execute(ROLLUP_MISSING_SQL, dict(params, label=label, bit=1 << label))
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('rolled_up_until', ?)", (end / 1000,))
+        rolled_up = max(since, end) / 1000
+
+        # Raw rows go once they are both old enough and rolled up
+        raw_cutoff = int(min(now - self.raw_retention, rolled_up) * 1000)
+        while True:
+            with self._conn:
+                deleted = self._conn.execute(
+                    'DELETE FROM detections WHERE rowid IN (SELECT rowid FROM detections WHERE ts < ? LIMIT ?)',
+                    (raw_cutoff, PRUNE_CHUNK)).rowcount
+            self.counters['pruned'] += deleted
+            if deleted < PRUNE_CHUNK:
+                break
+        with self._conn:
+            self.counters['pruned_rollups'] += self._conn.execute(
+                'DELETE FROM rollups WHERE bucket < ?', (int(now - self.rollup_retention),)).rowcount
+        self._conn.execute('PRAGMA incremental_vacuum')
+        self.last_maintenance_seconds = time.perf_counter() - start
+
+    def _run(self):
+        next_maintenance = time.monotonic() + self.maintenance_seconds
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+                if time.monotonic() >= next_maintenance:
+                    self.maintain()
+                    next_maintenance = time.monotonic() + self.maintenance_seconds
+            except Exception as e:
+                # Keep the writer alive whatever failed; the rows of a failed flush are counted as dropped
+                self._report_error(e)
+        try:
+            self.flush()
+        except Exception as e:
+            self._report_error(e)
+
+    def _report_error(self, error):
+        kind = 'Database error' if isinstance(error, sqlite3.Error) else 'Error'
+        print(f"[History] {kind}: {error!r}")
+
+    def reader(self):
+        """This thread's read connection, opened on first use and reused afterwards."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def _names(self, conn, table):
+        return dict(conn.execute(f'SELECT id, name FROM {table}'))
+
+    def _filters(self, conn, source, label):
+        """SQL conditions for optional source/label names; None when a name is unknown (nothing matches)."""
+        clauses, params = [], []
+        for column, table, name in (('source', 'sources', source), ('label', 'labels', label)):
+            if name is not None:
+                row = conn.execute(f'SELECT id FROM {table} WHERE name = ?', (name,)).fetchone()
+                if row is None:
+                    return None
+                clauses.append(f'{column} = ?')
+                params.append(row[0])
+        return clauses, params
+
+    def _formatter(self, conn):
+        sources, labels = self._names(conn, 'sources'), self._names(conn, 'labels')
+        label_bits = [(1 << label_id, name) for label_id, name in sorted(labels.items()) if label_id <= MAX_LABEL_ID]
+
+        def format_row(row):
+            ts, source_id, label_id, x1, y1, x2, y2, confidence, missing = row
+            return {
+                'time': ts / 1000,
+                'source': sources.get(source_id),
+                'label': labels.get(label_id),
+                'box': [x1, y1, x2, y2],
+                'confidence': confidence / 1000,
+                'missing_ppe': None if missing is None else [name for bit, name in label_bits if missing & bit]
+            }
+        return format_row
+
+    def detections(self, since=None, until=None, source=None, label=None, page_size=5000):
+        """
+        Yields raw detections with since <= time < until, oldest first, as
+        dicts. Reads a page at a time (keyset on time), so memory stays flat
+        however long the range.
+        """
+        conn = self.reader()
+        filters = self._filters(conn, source, label)
+        if filters is None:
+            return
+        clauses, params = filters
+        format_row = self._formatter(conn)
+        ts = int(since * 1000) if since is not None else -1
+        rowid = -1
+        end = int(until * 1000) if until is not None else 2 ** 62
+        sql = (f"SELECT rowid, ts, source, label, x1, y1, x2, y2, confidence, missing FROM detections"
+               f" WHERE ts >= ? AND ts < ? AND (ts > ? OR rowid > ?)"
+               f"{''.join(' AND ' + clause for clause in clauses)} ORDER BY ts, rowid LIMIT ?")
+        while True:
+            rows = conn.execute(sql, [ts, end, ts, rowid] + params + [page_size]).fetchall()
+            for row in rows:
+                yield format_row(row[1:])
+            if len(rows) < page_size:
+                return
+            rowid, ts = rows[-1][:2]
+
+    def recent(self, limit=50, source=None, label=None):
+        """The newest `limit` raw detections, newest first."""
+        conn = self.reader()
+        filters = self._filters(conn, source, label)
+        if filters is None:
+            return []
+        clauses, params = filters
+        rows = conn.execute(
+            f"SELECT ts, source, label, x1, y1, x2, y2, confidence, missing FROM detections"
+            f"{' WHERE ' + ' AND '.join(clauses) if clauses else ''} ORDER BY ts DESC, rowid DESC LIMIT ?",
+            params + [limit]).fetchall()
+        format_row = self._formatter(conn)
+        return [format_row(row) for row in rows]
+
+    def rollups(self, since=None, until=None, source=None, label=None, bucket_seconds=None):
+        """
+        Rolled-up counts with since <= bucket < until, oldest first, re-grouped
+        into `bucket_seconds` (a multiple of the store's bucket) when given.
+        """
+        conn = self.reader()
+        filters = self._filters(conn, source, label)
+        if filters is None:
+            return []
+        clauses, params = filters
+        width = max(int(bucket_seconds or self.bucket_seconds), self.bucket_seconds)
+        clauses = ['bucket >= ?', 'bucket < ?'] + clauses
+        params = [int(since) if since is not None else 0, int(until) if until is not None else 2 ** 62] + params
+        sources, labels = self._names(conn, 'sources'), self._names(conn, 'labels')
+        rows = conn.execute(
+            f"SELECT bucket / {width} * {width} AS b, source, label, SUM(detections), SUM(confidence_sum),"
+            f" MAX(confidence_max), SUM(missing) FROM rollups WHERE {' AND '.join(clauses)}"
+            f" GROUP BY b, source, label ORDER BY b", params).fetchall()
+        return [{'bucket': bucket, 'source': sources.get(source_id), 'label': labels.get(label_id),
+                 'detections': count, 'mean_confidence': round(conf_sum / count / 1000, 3) if count else None,
+                 'max_confidence': conf_max / 1000, 'missing': missing}
+                for bucket, source_id, label_id, count, conf_sum, conf_max, missing in rows]
+
+    def report_chunks(self, since=None, until=None, source=None, chunk_rows=REPORT_CHUNK_ROWS):
+        """Yields the person detections of a report as lists of up to `chunk_rows` detection dicts, oldest first."""
+        rows = self.detections(since, until, source, 'person', page_size=chunk_rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_rows))
+            if not chunk:
+                return
+            yield chunk
+
+    def export_csv(self, file, since=None, until=None, source=None, chunk_rows=REPORT_CHUNK_ROWS):
+        """Writes a CSV report (REPORT_COLUMNS) to the text `file` a chunk at a time. Returns the rows written."""
+        writer = csv.writer(file)
+        writer.writerow(REPORT_COLUMNS)
+        written = 0
+        for chunk in self.report_chunks(since, until, source, chunk_rows):
+            writer.writerows(
+                (datetime.fromtimestamp(row['time']).strftime('%Y-%m-%d %H:%M:%S'), row['source'],
+                 '[{},{},{},{}]'.format(*row['box']), row['confidence'],
+                 ', '.join(row['missing_ppe']) or 'None', 'Yes' if row['missing_ppe'] else 'No')
+                for row in chunk)
+            written += len(chunk)
+        return written
+
+    def export_parquet(self, file, since=None, until=None, source=None, chunk_rows=REPORT_CHUNK_ROWS):
+        """
+        Writes a Parquet report to `file` (path or binary file), one row group
+        per chunk, with typed columns: UTC timestamps, boxes and missing PPE as
+        lists, alert as a bool. Needs pyarrow. Returns the rows written.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([('timestamp', pa.timestamp('ms', tz='UTC')), ('source', pa.string()),
+                            ('person_location', pa.list_(pa.int32())), ('confidence', pa.float32()),
+                            ('missing_PPE', pa.list_(pa.string())), ('alert', pa.bool_())])
+        written = 0
+        with pq.ParquetWriter(file, schema) as writer:
+            for chunk in self.report_chunks(since, until, source, chunk_rows):
+                writer.write_table(pa.table({
+                    'timestamp': [round(row['time'] * 1000) for row in chunk],
+                    'source': [row['source'] for row in chunk],
+                    'person_location': [row['box'] for row in chunk],
+                    'confidence': [row['confidence'] for row in chunk],
+                    'missing_PPE': [row['missing_ppe'] for row in chunk],
+                    'alert': [bool(row['missing_ppe']) for row in chunk]
+                }, schema=schema))
+                written += len(chunk)
+        return written
+
+    def export_file(self, fmt='csv', since=None, until=None, source=None, directory=None):
+        """
+        Writes a report in `fmt` (see REPORT_FORMATS) to a new temporary file
+        chunk by chunk, so memory stays flat however long the range. Returns
+        (path, rows); the caller deletes the file.
+        """
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f'Unknown report format {fmt!r}, expected one of {", ".join(REPORT_FORMATS)}')
+        fd, path = tempfile.mkstemp(prefix='ppe_detection_report_', suffix=f'.{fmt}', dir=directory)
+        try:
+            if fmt == 'parquet':
+                with os.fdopen(fd, 'wb') as file:
+                    rows = self.export_parquet(file, since, until, source)
+            else:
+                with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+                    rows = self.export_csv(file, since, until, source)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, rows
+
+    def stats(self):
+        page_count = self.reader().execute('PRAGMA page_count').fetchone()[0]
+        page_size = self.reader().execute('PRAGMA page_size').fetchone()[0]
+        with self._lock:
+            pending = len(self._pending)
+        return dict(self.counters, pending=pending, database_bytes=page_count * page_size,
+                    rolled_up_until=self.rolled_up_until(),
+                    last_maintenance_seconds=round(self.last_maintenance_seconds, 4)
+                    if self.last_maintenance_seconds is not None else None)
+
+    def close(self):
+        """Commits what is queued and stops the writer."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=10)
+        self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_history(path=DEFAULT_PATH, **options):
+    """
+    The DetectionStore of `path` for this process, created on first use, so
+    Streamlit reruns share one writer. It is closed (flushed) at exit.
+    """
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None or store.pid != os.getpid():
+            store = _stores[path] = DetectionStore(path, **options)
+            atexit.register(store.close)
+        return store
+
+
+def synthetic_history(store, days, sources, fps, persons=3, seed=0, now=None):
+    """Records `days` of detections ending at `now` for benchmarking. Returns the rows written."""
+    rng = np.random.default_rng(seed)
+    now = time.time() if now is None else now
+    ppe = ['glasses', 'gloves', 'safety-vest', 'face-guard', 'ear-mufs']
+    frames = int(days * 86400 * fps)
+    written = 0
+    for index in range(frames):
+        ts = now - days * 86400 + index / fps
+        for source in range(sources):
+            boxes = rng.integers(0, 1000, size=(persons, 4))
+            missing = [list(rng.choice(ppe, size=rng.integers(0, 3), replace=False)) for _ in range(persons)]
+            store.record(f'robot-{source}/0', boxes, rng.random(persons), missing, boxes[:2], rng.random(2),
+                         ppe[:2], timestamp=ts)
+            written += persons + 2
+        if index % 2000 == 0:
+            store.flush()
+    store.flush()
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the detection history store on synthetic data')
+    parser.add_argument('--days', type=float, default=3.0, help='Days of history to generate')
+    parser.add_argument('--sources', type=int, default=4, help='Sources (robots/cameras)')
+    parser.add_argument('--fps', type=float, default=0.2, help='Detection frames per second per source')
+    parser.add_argument('--raw-days', type=float, default=DEFAULT_RAW_RETENTION / 86400, help='Raw retention')
+    parser.add_argument('--dir', default=None, help='Directory for the temporary database')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        # The writer thread is idle in the benchmark: flushes and maintenance are driven here
+        store = DetectionStore(os.path.join(tmp, 'history.db'), raw_retention=args.raw_days * 86400,
+                               flush_seconds=3600, maintenance_seconds=3600)
+        now = time.time()
+        start = time.perf_counter()
+        rows = synthetic_history(store, args.days, args.sources, args.fps, now=now)
+        write_seconds = time.perf_counter() - start
+        size_before = store.stats()['database_bytes']
+        start = time.perf_counter()
+        store.maintain(now=now)
+        maintain_seconds = time.perf_counter() - start
+
+        def timed(fn):
+            start = time.perf_counter()
+            result = fn()
+            return round((time.perf_counter() - start) * 1000, 2), len(result)
+
+        report = {
+            'rows': rows,
+            'rows_per_sec': round(rows / write_seconds),
+            'bytes_per_row': round(size_before / rows, 1),
+            'maintain_seconds': round(maintain_seconds, 2),
+            'stats': store.stats(),
+            'query_ms_rows': {
+                'raw_last_hour_one_source': timed(lambda: list(store.detections(now - 3600, source='robot-0/0'))),
+                'raw_last_hour_persons': timed(lambda: list(store.detections(now - 3600, label='person'))),
+                'recent_50': timed(lambda: store.recent(50)),
+                'rollups_all_hourly': timed(lambda: store.rollups(bucket_seconds=3600)),
+                'rollups_day_one_source': timed(lambda: store.rollups(now - 86400, source='robot-0/0')),
+            }
+        }
+        # Exports stream a chunk at a time: peak memory should not depend on the range.
+        # Timed untraced, then run again under tracemalloc for the peak
+        for fmt in report_formats():
+            start = time.perf_counter()
+            path, exported = store.export_file(fmt, now - 86400, directory=tmp)
+            seconds = time.perf_counter() - start
+            size = os.path.getsize(path)
+            os.remove(path)
+            tracemalloc.start()
+            os.remove(store.export_file(fmt, now - 86400, directory=tmp)[0])
+            report[f'export_{fmt}_last_day'] = {
+                'rows': exported, 'rows_per_sec': round(exported / seconds), 'bytes': size,
+                'peak_traced_mb': round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+            }
+            tracemalloc.stop()
+        store.close()
+        print(json.dumps(report, indent=2))
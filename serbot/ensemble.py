@@ -0,0 +1,238 @@
+"""
+Multi-model ensemble for the serbot detectors. Member models run concurrently
+on a thread pool (PyTorch releases the GIL inside its kernels) and their
+person/PPE detections are merged either with the original person-only NMS or
+with weighted box fusion (WBF) over every class.
+"""
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from ppe_assignment import POLICY_CENTER, as_boxes, detection_arrays, find_missing_ppe
+
+FUSION_NMS = 'nms'
+FUSION_WBF = 'wbf'
+FUSION_MODES = (FUSION_NMS, FUSION_WBF)
+
+# Detections of one frame, boxes are xyxy pixel coordinates. `ppe_owner` holds,
+# per PPE item, the index of the person it was found on when the detector knows
+# it (two-stage crops); otherwise it is None and the assignment policy decides.
+Detections = namedtuple('Detections', ['person_boxes', 'person_scores', 'ppe_boxes', 'ppe_scores', 'ppe_labels',
+                                       'ppe_owner'], defaults=(None,))
+
+
+def empty_detections():
+    return Detections(np.zeros((0, 4), dtype=int), np.zeros(0), np.zeros((0, 4), dtype=int), np.zeros(0), [])
+
+
+def extract_detections(results, class_names, ppe_classes):
+    """
+    Splits one YOLO result into person and PPE detections.
+    Returns None when the model has no 'person' class.
+    """
+    person_class_indices = [k for k, v in class_names.items() if v == 'person']
+    if not person_class_indices:
+        return None
+    ppe_class_indices = [k for k, v in class_names.items() if v in ppe_classes]
+    xyxy, conf, cls = detection_arrays(results.boxes)
+    person_mask = cls == person_class_indices[0]
+    ppe_mask = np.isin(cls, ppe_class_indices) & ~person_mask
+    return Detections(
+        xyxy[person_mask], conf[person_mask],
+        xyxy[ppe_mask], conf[ppe_mask], [class_names[c] for c in cls[ppe_mask]]
+    )
+
+
+def missing_ppe_per_person(detections, required_ppe, policy=POLICY_CENTER, **options):
+    """Missing required PPE for every detected person, in `required_ppe` order."""
+    if detections.ppe_owner is None:
+        return find_missing_ppe(detections.person_boxes, detections.ppe_boxes, detections.ppe_labels,
+                                required_ppe, policy=policy, **options)
+    found = [set() for _ in range(len(detections.person_boxes))]
+    for owner, label in zip(detections.ppe_owner, detections.ppe_labels):
+        found[owner].add(label)
+    return [[ppe for ppe in required_ppe if ppe not in ppe_found] for ppe_found in found]
+
+
+def box_iou(box, boxes):
+    """IoU of one xyxy box against an (N, 4) array of boxes."""
+    boxes = as_boxes(boxes)
+    ix1 = np.maximum(box[0], boxes[:, 0])
+    iy1 = np.maximum(box[1], boxes[:, 1])
+    ix2 = np.minimum(box[2], boxes[:, 2])
+    iy2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area + areas - intersection
+    return np.divide(intersection, union, out=np.zeros_like(union, dtype=np.float64), where=union > 0)
+
+
+def weighted_boxes_fusion(boxes_list, scores_list, labels_list, weights=None, iou_threshold=0.55, skip_threshold=0.0):
+    """
+    Weighted box fusion (Solovyev et al.) over the outputs of several models.
+
+    Boxes of the same label whose IoU with a cluster's fused box exceeds
+    `iou_threshold` join that cluster. The fused box is the confidence-weighted
+    mean of its members and its confidence is the mean member confidence,
+    scaled down when fewer models than the ensemble size agree on it.
+    Returns (boxes (N, 4) float, scores (N,), labels list).
+    """
+    if weights is None:
+        weights = np.ones(len(boxes_list))
+    weights = np.asarray(weights, dtype=np.float64)
+    total_weight = weights.sum()
+
+    entries = []
+    for model_idx, (boxes, scores, labels) in enumerate(zip(boxes_list, scores_list, labels_list)):
+        for box, score, label in zip(as_boxes(boxes), scores, labels):
+            if score >= skip_threshold:
+                entries.append((label, float(score) * weights[model_idx], weights[model_idx], box.astype(np.float64)))
+
+    fused_boxes, fused_scores, fused_labels = [], [], []
+    for label in sorted({e[0] for e in entries}):
+        members = sorted((e for e in entries if e[0] == label), key=lambda e: e[1], reverse=True)
+        clusters = []
+        cluster_boxes = np.zeros((0, 4))
+        for _, score, weight, box in members:
+            match = -1
+            if len(clusters):
+                ious = box_iou(box, cluster_boxes)
+                best = int(np.argmax(ious))
+                if ious[best] > iou_threshold:
+                    match = best
+            if match < 0:
+                clusters.append([(score, weight, box)])
+                cluster_boxes = np.vstack([cluster_boxes, box])
+            else:
+                clusters[match].append((score, weight, box))
+                scores = np.array([m[0] for m in clusters[match]])
+                boxes = np.array([m[2] for m in clusters[match]])
+                cluster_boxes[match] = (scores[:, None] * boxes).sum(axis=0) / scores.sum()
+        for cluster, box in zip(clusters, cluster_boxes):
+            scores = np.array([m[0] for m in cluster])
+            cluster_weight = sum(m[1] for m in cluster)
+            fused_boxes.append(box)
+            fused_scores.append(scores.mean() * min(cluster_weight, total_weight) / total_weight)
+            fused_labels.append(label)
+
+    return as_boxes(np.array(fused_boxes)), np.array(fused_scores), fused_labels
+
+
+def nms_merge(member_detections, conf_threshold, iou_threshold=0.45):
+    """
+    The original merge: NMS over the person boxes of all members, PPE boxes
+    concatenated as they are.
+    """
+    person_boxes = np.vstack([d.person_boxes for d in member_detections])
+    person_scores = np.concatenate([d.person_scores for d in member_detections])
+    keep = []
+    if len(person_boxes):
+        boxes_xywh = [[x1, y1, x2 - x1, y2 - y1] for x1, y1, x2, y2 in person_boxes.tolist()]
+        keep = cv2.dnn.NMSBoxes(boxes_xywh, person_scores.tolist(), conf_threshold, iou_threshold)
+        keep = np.asarray(keep, dtype=int).flatten()
+    return Detections(
+        person_boxes[keep], person_scores[keep],
+        np.vstack([d.ppe_boxes for d in member_detections]),
+        np.concatenate([d.ppe_scores for d in member_detections]),
+        [label for d in member_detections for label in d.ppe_labels]
+    )
+
+
+def wbf_merge(member_detections, weights=None, iou_threshold=0.55, skip_threshold=0.0):
+    """Fuses persons and every PPE class of all members with weighted box fusion."""
+    boxes_list, scores_list, labels_list = [], [], []
+    for d in member_detections:
+        boxes_list.append(np.vstack([d.person_boxes, d.ppe_boxes]))
+        scores_list.append(np.concatenate([d.person_scores, d.ppe_scores]))
+        labels_list.append(['person'] * len(d.person_boxes) + list(d.ppe_labels))
+    boxes, scores, labels = weighted_boxes_fusion(boxes_list, scores_list, labels_list, weights,
+                                                  iou_threshold, skip_threshold)
+    boxes = np.rint(boxes).astype(int)
+    is_person = np.array([label == 'person' for label in labels], dtype=bool)
+    return Detections(
+        boxes[is_person], scores[is_person],
+        boxes[~is_person], scores[~is_person], [label for label in labels if label != 'person']
+    )
+
+
+class ModelEnsemble:
+    """
+    Runs every member model on a frame and merges their detections.
+    With `parallel`, members run concurrently so the wall-clock time of a
+    frame approaches that of the slowest member instead of their sum.
+    """
+
+    def __init__(self, models, ppe_classes, fusion=FUSION_NMS, weights=None, parallel=True,
+                 iou_threshold=None):
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"Unknown fusion mode '{fusion}', expected one of {FUSION_MODES}")
+        self.models = list(models)
+        self.ppe_classes = ppe_classes
+        self.fusion = fusion
+        self.weights = weights
+        self.iou_threshold = iou_threshold
+        self.executor = ThreadPoolExecutor(max_workers=len(self.models)) if parallel and len(self.models) > 1 else None
+        self.timings = {'frames': 0, 'wall': 0.0, 'members': [0.0] * len(self.models)}
+
+    def _run_member(self, index, frames, conf_threshold):
+        model = self.models[index]
+        start = time.perf_counter()
+        results = model(frames, conf=conf_threshold, verbose=False)
+        detections = [extract_detections(r, model.names, self.ppe_classes) for r in results]
+        return index, detections, time.perf_counter() - start
+
+    def _merge(self, members, weights, conf_threshold):
+        if not members:
+            return empty_detections()
+        if self.fusion == FUSION_WBF:
+            return wbf_merge(members, weights, iou_threshold=self.iou_threshold or 0.55, skip_threshold=conf_threshold)
+        return nms_merge(members, conf_threshold, iou_threshold=self.iou_threshold or 0.45)
+
+    def detect_batch(self, frames, conf_threshold, keys=None):
+        """Runs every member once over all `frames` and merges per frame."""
+        start = time.perf_counter()
+        if self.executor is not None:
+            futures = [self.executor.submit(self._run_member, i, frames, conf_threshold) for i in range(len(self.models))]
+            outputs = [f.result() for f in futures]
+        else:
+            outputs = [self._run_member(i, frames, conf_threshold) for i in range(len(self.models))]
+
+        merged = []
+        for frame_idx in range(len(frames)):
+            members = []
+            weights = []
+            for index, detections, _ in outputs:
+                if detections[frame_idx] is not None:
+                    members.append(detections[frame_idx])
+                    weights.append(self.weights[index] if self.weights else 1.0)
+            merged.append(self._merge(members, weights, conf_threshold))
+
+        for index, _, elapsed in outputs:
+            self.timings['members'][index] += elapsed
+        self.timings['frames'] += len(frames)
+        self.timings['wall'] += time.perf_counter() - start
+        return merged
+
+    def __call__(self, frame, conf_threshold):
+        return self.detect_batch([frame], conf_threshold)[0]
+
+    def stats(self):
+        """Mean per-member and per-frame wall-clock latency in milliseconds."""
+        frames = max(self.timings['frames'], 1)
+        members_ms = [round(t / frames * 1000, 2) for t in self.timings['members']]
+        return {
+            'frames': self.timings['frames'],
+            'fusion': self.fusion,
+            'parallel': self.executor is not None,
+            'member_ms': members_ms,
+            'sum_member_ms': round(sum(members_ms), 2),
+            'wall_ms': round(self.timings['wall'] / frames * 1000, 2)
+        }
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,146 @@
+"""
+In-process metrics shared by the backend and the serbot: counters, gauges and
+latency histograms with labels, rendered in the Prometheus text format or as a
+JSON-friendly snapshot. Recording is a dict lookup and a few additions under a
+lock, cheap enough to leave on for every frame and request.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from sub-millisecond post-processing up to slow inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    A registry of named metrics. Names are prefixed with `namespace`; a
+    metric's type is fixed by its first use (`inc`, `set` or `observe`).
+    """
+
+    def __init__(self, namespace, buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._types = {}
+        self._help = {}
+        self._values = {}
+        self.started = time.time()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def _series(self, name, kind, labels):
+        known = self._types.setdefault(name, kind)
+        if known != kind:
+            raise ValueError(f"Metric '{name}' is a {known}, not a {kind}")
+        return self._values.setdefault(name, {}), _label_key(labels)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series, key = self._series(name, COUNTER, labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            series, key = self._series(name, GAUGE, labels)
+            series[key] = value
+
+    def observe(self, name, seconds, **labels):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series, key = self._series(name, HISTOGRAM, labels)
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            hist[0][index] += 1
+            hist[1] += seconds
+            hist[2] += 1
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Observes the duration of the `with` block into histogram `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                full = f'{self.namespace}_{name}'
+                kind = self._types[name]
+                if name in self._help:
+                    lines.append(f'# HELP {full} {self._help[name]}')
+                lines.append(f'# TYPE {full} {kind}')
+                for key, value in sorted(self._values[name].items()):
+                    if kind != HISTOGRAM:
+                        lines.append(f'{full}{_format_labels(key)} {_format_value(value)}')
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                        cumulative += bucket_count
+                        le = (('le', _format_value(bound)),)
+                        lines.append(f'{full}_bucket{_format_labels(key, le)} {cumulative}')
+                    lines.append(f'{full}_sum{_format_labels(key)} {_format_value(total)}')
+                    lines.append(f'{full}_count{_format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """
+        Counters and gauges as values, histograms as count, sum and mean in
+        milliseconds, keyed by metric name and then by 'label=value,...'.
+        """
+        snapshot = {'uptime_seconds': round(time.time() - self.started, 1)}
+        with self._lock:
+            for name, series in self._values.items():
+                entries = {}
+                for key, value in series.items():
+                    label = ','.join(f'{k}={v}' for k, v in key) or 'all'
+                    if self._types[name] == HISTOGRAM:
+                        _, total, count = value
+                        value = {'count': count, 'sum_seconds': round(total, 6),
+                                 'mean_ms': round(total / count * 1000, 3) if count else None}
+                    entries[label] = value
+                snapshot[name] = entries
+        return snapshot
+
+    def write(self, path):
+        """
+        Atomically writes the metrics to `path`: Prometheus text for `.prom`
+        files (e.g. for node_exporter's textfile collector), JSON otherwise.
+        """
+        content = self.render() if path.endswith('.prom') else json.dumps(self.snapshot(), indent=2)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
@@ -0,0 +1,287 @@
+"""
+CPU inference backends for the PPE models. A `.pt` checkpoint can be served by
+PyTorch directly, or exported once to ONNX Runtime or OpenVINO, optionally as a
+static INT8 model calibrated on sample frames from our own cameras. Exported
+models are written next to the checkpoint and reused on later runs, and all
+backends are loaded through `ultralytics.YOLO` so callers keep the same API.
+
+Run this module directly to compare latency and detection drift (mAP@0.5
+against the PyTorch FP32 detections) of every backend on a set of frames.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+from ppe_assignment import detection_arrays
+from tracker import iou_matrix
+
+BACKEND_PYTORCH = 'pytorch'
+BACKEND_ONNX = 'onnx'
+BACKEND_OPENVINO = 'openvino'
+BACKENDS = (BACKEND_PYTORCH, BACKEND_ONNX, BACKEND_OPENVINO)
+PRECISION_FP32 = 'fp32'
+PRECISION_INT8 = 'int8'
+PRECISIONS = (PRECISION_FP32, PRECISION_INT8)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def exported_path(model_path, backend, precision=PRECISION_FP32):
+    """Where the exported model for `backend`/`precision` lives, named the way ultralytics recognises it."""
+    stem = os.path.splitext(model_path)[0]
+    suffix = '_int8' if precision == PRECISION_INT8 else ''
+    if backend == BACKEND_ONNX:
+        return f'{stem}{suffix}.onnx'
+    if backend == BACKEND_OPENVINO:
+        return f'{stem}{suffix}_openvino_model'
+    return model_path
+
+
+def load_frames(source, count=100):
+    """
+    Reads up to `count` BGR frames from a directory of images or a video file
+    (evenly spaced over the video).
+    """
+    if os.path.isdir(source):
+        names = sorted(n for n in os.listdir(source) if n.lower().endswith(IMAGE_EXTENSIONS))
+        frames = [cv2.imread(os.path.join(source, n)) for n in names[:count]]
+        return [f for f in frames if f is not None]
+
+    cap = cv2.VideoCapture(source)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    step = max(total // count, 1) if total > 0 else 1
+    frames = []
+    index = 0
+    while len(frames) < count:
+        ok = cap.grab()
+        if not ok:
+            break
+        if index % step == 0:
+            ok, frame = cap.retrieve()
+            if ok:
+                frames.append(frame)
+        index += 1
+    cap.release()
+    return frames
+
+
+def preprocess(frame, imgsz=640):
+    """Letterboxes a BGR frame into the (1, 3, imgsz, imgsz) float input the exported models take."""
+    h, w = frame.shape[:2]
+    scale = imgsz / max(h, w)
+    resized = cv2.resize(frame, (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)),
+                         interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top = (imgsz - resized.shape[0]) // 2
+    left = (imgsz - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    image = canvas[:, :, ::-1].transpose(2, 0, 1)
+    return np.ascontiguousarray(image, dtype=np.float32)[None] / 255.0
+
+
+def _quantize_onnx(fp32_path, int8_path, frames, imgsz):
+    """Static (QDQ) INT8 quantization with activation ranges calibrated on `frames`."""
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = onnx.load(fp32_path, load_external_data=False).graph.input[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            return None if frame is None else {input_name: preprocess(frame, imgsz)}
+
+    quantize_static(fp32_path, int8_path, FrameReader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+    # Keep the class names and stride ultralytics stores in the model metadata
+    source = onnx.load(fp32_path, load_external_data=False)
+    quantized = onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, int8_path)
+
+
+def _quantize_openvino(fp32_dir, int8_dir, frames, imgsz):
+    """NNCF post-training INT8 quantization calibrated on `frames`."""
+    import nncf
+    import openvino as ov
+
+    xml_name = next(n for n in os.listdir(fp32_dir) if n.endswith('.xml'))
+    model = ov.Core().read_model(os.path.join(fp32_dir, xml_name))
+    dataset = nncf.Dataset(frames, lambda frame: preprocess(frame, imgsz))
+    # The Detect head decodes boxes with these ops; quantizing them costs accuracy for no speed-up
+    quantized = nncf.quantize(model, dataset, preset=nncf.QuantizationPreset.MIXED, subset_size=len(frames),
+                              ignored_scope=nncf.IgnoredScope(types=['Multiply', 'Subtract', 'Sigmoid']))
+    os.makedirs(int8_dir, exist_ok=True)
+    ov.save_model(quantized, os.path.join(int8_dir, xml_name), compress_to_fp16=False)
+    shutil.copy(os.path.join(fp32_dir, 'metadata.yaml'), os.path.join(int8_dir, 'metadata.yaml'))
+
+
+def export_model(model_path, backend, precision=PRECISION_FP32, calibration=None, imgsz=640):
+    """
+    Exports `model_path` for `backend` and returns the exported path. INT8
+    exports need `calibration`: a frame directory, video file or list of frames.
+    Exports use dynamic input shapes so batched calls and other image sizes
+    (e.g. two-stage person crops) keep working.
+    """
+    if backend == BACKEND_PYTORCH:
+        return model_path
+    fp32_path = exported_path(model_path, backend)
+    if not os.path.exists(fp32_path):
+        print(f"Exporting {model_path} to {backend}...")
+        YOLO(model_path).export(format=backend, imgsz=imgsz, dynamic=True)
+    if precision == PRECISION_FP32:
+        return fp32_path
+
+    if calibration is None:
+        raise ValueError('INT8 export needs calibration frames')
+    frames = calibration if isinstance(calibration, list) else load_frames(calibration)
+    if not frames:
+        raise ValueError(f'No calibration frames found in {calibration}')
+    int8_path = exported_path(model_path, backend, PRECISION_INT8)
+    print(f"Quantizing {fp32_path} to INT8 on {len(frames)} calibration frames...")
+    if backend == BACKEND_ONNX:
+        _quantize_onnx(fp32_path, int8_path, frames, imgsz)
+    else:
+        _quantize_openvino(fp32_path, int8_path, frames, imgsz)
+    return int8_path
+
+
+def load_model(model_path, backend=BACKEND_PYTORCH, precision=PRECISION_FP32, calibration=None, imgsz=640):
+    """
+    Loads `model_path` with the given backend, exporting it first when no
+    exported model exists yet. Returns an `ultralytics.YOLO` model.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+    if backend == BACKEND_PYTORCH:
+        if precision != PRECISION_FP32:
+            raise ValueError('INT8 is only available with the onnx and openvino backends')
+        return YOLO(model_path)
+    path = exported_path(model_path, backend, precision)
+    if not os.path.exists(path):
+        path = export_model(model_path, backend, precision, calibration, imgsz)
+    return YOLO(path, task='detect')
+
+
+def average_precision(recall, precision):
+    """Area under the interpolated precision/recall curve."""
+    mrec = np.concatenate([[0.0], recall, [1.0]])
+    mpre = np.concatenate([[1.0], precision, [0.0]])
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    changes = np.where(mrec[1:] != mrec[:-1])[0]
+    return float(np.sum((mrec[changes + 1] - mrec[changes]) * mpre[changes + 1]))
+
+
+def mean_average_precision(reference, predictions, iou_threshold=0.5):
+    """
+    mAP of `predictions` using `reference` as ground truth. Both are lists of
+    per-frame `(xyxy, conf, cls)` arrays. Classes absent from the reference are ignored.
+    """
+    aps = []
+    classes = np.unique(np.concatenate([cls for _, _, cls in reference])) if reference else []
+    for c in classes:
+        scored = []
+        truth_count = 0
+        matched = []
+        for frame_idx, ((ref_xyxy, _, ref_cls), (xyxy, conf, cls)) in enumerate(zip(reference, predictions)):
+            truth_count += int((ref_cls == c).sum())
+            matched.append(np.zeros(int((ref_cls == c).sum()), dtype=bool))
+            scored.extend((float(s), frame_idx, box) for s, box in zip(conf[cls == c], xyxy[cls == c]))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        true_positives = np.zeros(len(scored))
+        for i, (_, frame_idx, box) in enumerate(scored):
+            ref_xyxy, _, ref_cls = reference[frame_idx]
+            ious = iou_matrix([box], ref_xyxy[ref_cls == c])[0]
+            if len(ious):
+                best = int(np.argmax(ious))
+                if ious[best] >= iou_threshold and not matched[frame_idx][best]:
+                    matched[frame_idx][best] = True
+                    true_positives[i] = 1
+        cumulative = np.cumsum(true_positives)
+        recall = cumulative / max(truth_count, 1)
+        precision = cumulative / np.arange(1, len(scored) + 1)
+        aps.append(average_precision(recall, precision))
+    return float(np.mean(aps)) if aps else None
+
+
+def benchmark_model(model, frames, conf_threshold=0.25, imgsz=640, warmup=3):
+    """Runs `model` frame by frame. Returns (per-frame latencies in seconds, detections)."""
+    for frame in frames[:warmup]:
+        model(frame, conf=conf_threshold, imgsz=imgsz, verbose=False)
+    latencies, detections = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        result = model(frame, conf=conf_threshold, imgsz=imgsz, verbose=False)[0]
+        latencies.append(time.perf_counter() - start)
+        detections.append(detection_arrays(result.boxes))
+    return latencies, detections
+
+
+def compare_backends(model_path, frames, variants, calibration=None, conf_threshold=0.25, imgsz=640):
+    """
+    Latency and mAP@0.5 drift of every `(backend, precision)` in `variants`
+    against the PyTorch FP32 model, measured on `frames`.
+    """
+    reference_latencies, reference = benchmark_model(YOLO(model_path), frames, conf_threshold, imgsz)
+    reference_ms = np.mean(reference_latencies) * 1000
+    rows = []
+    for backend, precision in [(BACKEND_PYTORCH, PRECISION_FP32)] + list(variants):
+        if (backend, precision) == (BACKEND_PYTORCH, PRECISION_FP32):
+            latencies, detections = reference_latencies, reference
+        else:
+            model = load_model(model_path, backend, precision, calibration, imgsz)
+            latencies, detections = benchmark_model(model, frames, conf_threshold, imgsz)
+        latencies = np.sort(latencies) * 1000
+        rows.append({
+            'backend': backend,
+            'precision': precision,
+            'mean_ms': round(float(latencies.mean()), 2),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+            'speedup': round(float(reference_ms / latencies.mean()), 2),
+            'detections': int(sum(len(cls) for _, _, cls in detections)),
+            'map50_vs_pytorch': mean_average_precision(reference, detections)
+        })
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare PyTorch, ONNX Runtime and OpenVINO inference on CPU')
+    parser.add_argument('--model', default='yolov8x.pt', help='PyTorch checkpoint')
+    parser.add_argument('--frames', required=True, help='Directory of images or video file to evaluate on')
+    parser.add_argument('--count', type=int, default=100, help='Maximum number of evaluation frames')
+    parser.add_argument('--calibration', default=None,
+                        help='Directory of images or video file for INT8 calibration (defaults to --frames)')
+    parser.add_argument('--backend', nargs='+', choices=BACKENDS[1:], default=list(BACKENDS[1:]),
+                        help='Backends to compare against PyTorch')
+    parser.add_argument('--precision', nargs='+', choices=PRECISIONS, default=list(PRECISIONS),
+                        help='Precisions to compare')
+    parser.add_argument('--imgsz', type=int, default=640, help='Model input size')
+    parser.add_argument('--conf', type=float, default=0.25, help='Confidence threshold')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    eval_frames = load_frames(args.frames, args.count)
+    if not eval_frames:
+        parser.error(f'No frames found in {args.frames}')
+    variants = [(b, p) for b in args.backend for p in args.precision]
+    results = compare_backends(args.model, eval_frames, variants, calibration=args.calibration or args.frames,
+                               conf_threshold=args.conf, imgsz=args.imgsz)
+    for row in results:
+        print(row)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'model': args.model, 'frames': len(eval_frames), 'results': results}, f, indent=2)
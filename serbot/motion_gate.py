@@ -0,0 +1,62 @@
+"""
+Cheap scene-change gate run before YOLO. Frames are shrunk to a small
+grayscale thumbnail and compared with the thumbnail of the last frame that was
+actually sent to the detector; inference is skipped while the fraction of
+changed pixels stays below a threshold, with a forced refresh every
+`refresh_seconds` so slow changes are never missed for long.
+"""
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    def __init__(self, threshold=0.01, pixel_delta=25, width=160, refresh_seconds=30.0):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.width = width
+        self.refresh_seconds = refresh_seconds
+        self.reference = None
+        self.reference_time = 0.0
+        self.checked = 0
+        self.skipped = 0
+        self.forced = 0
+        self.last_change = None
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        size = (self.width, max(int(h * self.width / w), 1))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def should_run(self, frame):
+        """True if the frame differs enough from the last inferred one, or a refresh is due."""
+        self.checked += 1
+        now = time.monotonic()
+        thumb = self._thumbnail(frame)
+        if self.reference is None or self.reference.shape != thumb.shape:
+            run = True
+        else:
+            changed = cv2.absdiff(thumb, self.reference) > self.pixel_delta
+            self.last_change = float(np.count_nonzero(changed)) / changed.size
+            run = self.last_change >= self.threshold
+            if not run and now - self.reference_time >= self.refresh_seconds:
+                self.forced += 1
+                run = True
+        if run:
+            self.reference = thumb
+            self.reference_time = now
+        else:
+            self.skipped += 1
+        return run
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'skipped': self.skipped,
+            'forced_refreshes': self.forced,
+            'skip_ratio': round(self.skipped / self.checked, 3) if self.checked else None
+        }
@@ -0,0 +1,184 @@
+"""
+Durable MQTT publishing for the serbot. Every message is first appended to a
+bounded SQLite spool on disk and a background thread drains the spool in
+batches at QoS 1 whenever the client is connected, deleting messages only once
+the broker has acknowledged them. Alerts raised while the site network is
+down are therefore delivered after reconnecting instead of being lost.
+
+The publisher only needs a client with `is_connected()` and
+`publish(topic, payload, qos)` returning a paho `MQTTMessageInfo`-like object,
+so a local broker stand-in can replace paho in tests.
+"""
+import sqlite3
+import threading
+import time
+
+
+class AlertSpool:
+    """Bounded append-only message spool backed by SQLite. Oldest messages are dropped first."""
+
+    def __init__(self, path, max_messages=10000):
+        self.path = path
+        self.max_messages = max_messages
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                qos INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        self._conn.commit()
+
+    def append(self, topic, payload, qos=1):
+        with self._lock:
+            self._conn.execute('INSERT INTO spool (topic, payload, qos, created_at) VALUES (?, ?, ?, ?)',
+                               (topic, payload, qos, time.time()))
+            overflow = self._depth() - self.max_messages
+            if overflow > 0:
+                self._conn.execute('DELETE FROM spool WHERE seq IN (SELECT seq FROM spool ORDER BY seq LIMIT ?)',
+                                   (overflow,))
+                self.dropped += overflow
+            self._conn.commit()
+
+    def peek(self, limit):
+        """Oldest `limit` messages as (seq, topic, payload, qos) tuples."""
+        with self._lock:
+            return self._conn.execute('SELECT seq, topic, payload, qos FROM spool ORDER BY seq LIMIT ?',
+                                      (limit,)).fetchall()
+
+    def delete(self, seqs):
+        if not seqs:
+            return
+        with self._lock:
+            self._conn.executemany('DELETE FROM spool WHERE seq = ?', [(s,) for s in seqs])
+            self._conn.commit()
+
+    def _depth(self):
+        return self._conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def depth(self):
+        with self._lock:
+            return self._depth()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DurablePublisher:
+    """
+    Drop-in `publish(topic, payload, qos)` target that spools to disk and
+    drains in batches. Publishing never blocks on the network.
+
+    A batch is published at `drain_qos` and its rows are deleted only after
+    every message was acknowledged within `ack_timeout`. A failed batch is
+    retried with exponential backoff between `min_backoff` and `max_backoff`.
+    """
+
+    def __init__(self, client, spool, batch_size=20, drain_qos=1, ack_timeout=5.0,
+                 min_backoff=1.0, max_backoff=60.0, metrics=None):
+        self.client = client
+        # Optional metrics.Metrics; drain batches are timed as the 'mqtt_publish' stage
+        self.metrics = metrics
+        self.spool = spool
+        self.batch_size = batch_size
+        self.drain_qos = drain_qos
+        self.ack_timeout = ack_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.delivered = 0
+        self.failed_batches = 0
+        self.last_drain_rate = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='mqtt-spool-drain', daemon=True)
+        self._thread.start()
+
+    def publish(self, topic, payload, qos=None):
+        self.spool.append(topic, payload, self.drain_qos if qos is None else max(qos, self.drain_qos))
+        self._wake.set()
+
+    def _publish_batch(self, batch):
+        """Publishes a batch and returns the sequence numbers the broker acknowledged, in order."""
+        infos = []
+        for seq, topic, payload, qos in batch:
+            info = self.client.publish(topic, payload, qos=qos)
+            if info.rc != 0:
+                break
+            infos.append((seq, info))
+        acked = []
+        deadline = time.monotonic() + self.ack_timeout
+        for seq, info in infos:
+            try:
+                info.wait_for_publish(timeout=max(deadline - time.monotonic(), 0.01))
+            except (RuntimeError, ValueError):
+                break
+            if not info.is_published():
+                break
+            acked.append(seq)
+        return acked
+
+    def drain_once(self):
+        """Sends one batch if connected. Returns the number of messages delivered."""
+        if not self.client.is_connected():
+            return 0
+        batch = self.spool.peek(self.batch_size)
+        if not batch:
+            return 0
+        start = time.perf_counter()
+        acked = self._publish_batch(batch)
+        self.spool.delete(acked)
+        self.delivered += len(acked)
+        elapsed = time.perf_counter() - start
+        if self.metrics is not None:
+            self.metrics.observe('stage_seconds', elapsed, stage='mqtt_publish')
+            self.metrics.inc('mqtt_messages_total', len(acked))
+        if acked and elapsed > 0:
+            self.last_drain_rate = len(acked) / elapsed
+        if len(acked) < len(batch):
+            self.failed_batches += 1
+            raise ConnectionError(f"Only {len(acked)} of {len(batch)} spooled messages were acknowledged")
+        return len(acked)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                sent = self.drain_once()
+                self.backoff = self.min_backoff
+            except Exception as e:
+                print(f"[SPOOL] Drain failed, retrying in {self.backoff:.0f}s: {e}")
+                self._stop.wait(self.backoff)
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                continue
+            if not sent:
+                # Idle or offline: wait for new messages or poll the connection again
+                self._wake.wait(self.min_backoff)
+                self._wake.clear()
+
+    def stats(self):
+        return {
+            'spool_depth': self.spool.depth(),
+            'delivered': self.delivered,
+            'dropped_oldest': self.spool.dropped,
+            'failed_batches': self.failed_batches,
+            'drain_rate_per_sec': round(self.last_drain_rate, 1) if self.last_drain_rate else None,
+            'connected': self.client.is_connected()
+        }
+
+    def close(self, drain_timeout=2.0):
+        """Tries to drain what is left for up to `drain_timeout` seconds, then stops."""
+        deadline = time.monotonic() + drain_timeout
+        while self.spool.depth() and self.client.is_connected() and time.monotonic() < deadline:
+            self._wake.set()
+            time.sleep(0.05)
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=1)
@@ -0,0 +1,100 @@
+"""
+Multiple camera/stream sources for the serbot CLI. Every source gets its own
+latest-frame capture thread and frame-rate limit. Frames of all due sources
+are requested at once, so waiting for the next frame overlaps across cameras,
+and are handed to the detector as a single batch so one loaded model serves
+every camera.
+"""
+import time
+from collections import deque
+
+from capture import LatestFrameCapture
+
+
+def parse_source(value):
+    """Camera indices are given as integers, everything else (RTSP URL, file path) as-is."""
+    return int(value) if str(value).isdigit() else value
+
+
+class SourceStream:
+    """One video source with a per-source rate limit and FPS/latency statistics."""
+
+    def __init__(self, source, max_fps=None, history=512):
+        self.source = parse_source(source)
+        self.name = str(source)
+        self.capture = LatestFrameCapture(self.source)
+        self.min_period = 1.0 / max_fps if max_fps else 0.0
+        self.next_due = 0.0
+        self.ended = False
+        self.processed = 0
+        self.started = None
+        self.latencies = deque(maxlen=history)
+        # Per-source pipeline state, e.g. a motion gate or a tracker
+        self.state = {}
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def start(self):
+        self.capture.start()
+        self.started = time.monotonic()
+        return self
+
+    def due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return not self.ended and now >= self.next_due
+
+    def request(self):
+        """Asks for the freshest frame and starts the source's rate-limit period."""
+        self.next_due = time.monotonic() + self.min_period
+        self.capture.request()
+
+    def collect(self):
+        ret, frame = self.capture.collect()
+        # A timeout is a stall, not the end: the capture thread reopens live sources itself
+        if not ret and self.capture.ended:
+            self.ended = True
+        return ret, frame
+
+    def read(self):
+        self.request()
+        return self.collect()
+
+    def record(self, read_at):
+        """Records that a frame read at `read_at` (perf_counter) has been fully processed."""
+        self.processed += 1
+        self.latencies.append(time.perf_counter() - read_at)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        latencies = sorted(self.latencies)
+
+        def pct(p):
+            if not latencies:
+                return None
+            return round(latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)] * 1000, 2)
+
+        return {
+            'processed': self.processed,
+            'fps': round(self.processed / elapsed, 2) if elapsed > 0 else None,
+            'latency_ms_p50': pct(50),
+            'latency_ms_p95': pct(95),
+            'ended': self.ended,
+            'capture': self.capture.stats()
+        }
+
+    def release(self):
+        self.capture.release()
+
+
+def open_sources(sources, max_fps=None):
+    """Opens and starts every source, skipping (and reporting) those that fail to open."""
+    streams = []
+    for source in sources:
+        stream = SourceStream(source, max_fps=max_fps)
+        if not stream.isOpened():
+            print(f"Could not open source {source}.")
+            stream.release()
+            continue
+        streams.append(stream.start())
+    return streams
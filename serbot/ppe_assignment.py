@@ -0,0 +1,95 @@
+"""
+Vectorized PPE-to-person assignment shared by the backend, the serbot CLI and
+the Streamlit apps. All pairwise tests are computed as (persons x items)
+matrices in one NumPy operation instead of a nested Python loop.
+"""
+import numpy as np
+
+# Assignment policies
+# center  - a PPE item belongs to every person whose box contains its center
+# overlap - a PPE item belongs to a person when more than `overlap_threshold`
+#           of the item's area lies inside the person box
+POLICY_CENTER = 'center'
+POLICY_OVERLAP = 'overlap'
+POLICIES = (POLICY_CENTER, POLICY_OVERLAP)
+
+
+def as_boxes(boxes):
+    """Returns boxes as an (N, 4) xyxy array, also for empty input."""
+    return np.asarray(boxes).reshape(-1, 4)
+
+
+def detection_arrays(boxes):
+    """
+    Converts an ultralytics `Boxes` object into plain arrays.
+    Returns (xyxy as int (N, 4), conf (N,), cls as int (N,)).
+    """
+    xyxy = boxes.xyxy.cpu().numpy().astype(int).reshape(-1, 4)
+    conf = boxes.conf.cpu().numpy().reshape(-1)
+    cls = boxes.cls.cpu().numpy().astype(int).reshape(-1)
+    return xyxy, conf, cls
+
+
+def center_in_box_matrix(person_boxes, item_boxes):
+    """Boolean (P, I) matrix: True where item i's center lies inside person p."""
+    persons = as_boxes(person_boxes)
+    items = as_boxes(item_boxes)
+    # Integer boxes keep the original floor-division center, float boxes use the exact one
+    if np.issubdtype(items.dtype, np.integer):
+        cx = (items[:, 0] + items[:, 2]) // 2
+        cy = (items[:, 1] + items[:, 3]) // 2
+    else:
+        cx = (items[:, 0] + items[:, 2]) / 2
+        cy = (items[:, 1] + items[:, 3]) / 2
+    return (
+        (persons[:, 0, None] <= cx[None, :]) & (cx[None, :] <= persons[:, 2, None]) &
+        (persons[:, 1, None] <= cy[None, :]) & (cy[None, :] <= persons[:, 3, None])
+    )
+
+
+def intersection_over_item_matrix(person_boxes, item_boxes):
+    """Float (P, I) matrix of intersection area divided by the item's own area."""
+    persons = as_boxes(person_boxes).astype(np.float64)
+    items = as_boxes(item_boxes).astype(np.float64)
+    ix1 = np.maximum(persons[:, 0, None], items[None, :, 0])
+    iy1 = np.maximum(persons[:, 1, None], items[None, :, 1])
+    ix2 = np.minimum(persons[:, 2, None], items[None, :, 2])
+    iy2 = np.minimum(persons[:, 3, None], items[None, :, 3])
+    intersection = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    item_area = (items[:, 2] - items[:, 0]) * (items[:, 3] - items[:, 1])
+    ratio = np.zeros_like(intersection)
+    np.divide(intersection, item_area[None, :], out=ratio, where=item_area[None, :] > 0)
+    return ratio
+
+
+def assignment_matrix(person_boxes, item_boxes, policy=POLICY_CENTER, overlap_threshold=0.5, exclusive=False):
+    """
+    Boolean (P, I) matrix of which PPE item is assigned to which person.
+    With `exclusive`, every item goes to the first matching person only, so
+    one pair of gloves cannot satisfy two overlapping people.
+    """
+    if policy == POLICY_CENTER:
+        matches = center_in_box_matrix(person_boxes, item_boxes)
+    elif policy == POLICY_OVERLAP:
+        matches = intersection_over_item_matrix(person_boxes, item_boxes) > overlap_threshold
+    else:
+        raise ValueError(f"Unknown assignment policy '{policy}', expected one of {POLICIES}")
+    if exclusive and matches.size:
+        first = np.argmax(matches, axis=0)
+        claimed = matches.any(axis=0)
+        matches = np.zeros_like(matches)
+        matches[first[claimed], np.flatnonzero(claimed)] = True
+    return matches
+
+
+def assign_ppe(person_boxes, item_boxes, item_labels, **options):
+    """Returns, per person, the set of PPE class names assigned to them."""
+    matches = assignment_matrix(person_boxes, item_boxes, **options)
+    labels = np.asarray(item_labels, dtype=object)
+    return [set(labels[row]) for row in matches]
+
+
+def find_missing_ppe(person_boxes, item_boxes, item_labels, required_ppe, **options):
+    """Returns, per person, the required PPE items (in `required_ppe` order) not found on them."""
+    found = assign_ppe(person_boxes, item_boxes, item_labels, **options)
+    return [[ppe for ppe in required_ppe if ppe not in ppe_found] for ppe_found in found]
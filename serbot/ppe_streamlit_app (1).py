@@ -1,16 +1,16 @@
 import streamlit as st
 import cv2
-from ultralytics import YOLO
 import numpy as np
 from PIL import Image
 import threading
 import time
 import pandas as pd
 from datetime import datetime
-import io
 import queue
 import sys
 import asyncio
+from ppe_assignment import POLICY_OVERLAP
+from streamlit_common import detect_ppe, load_app_model, report_controls
 
 # This is a workaround for a bug in Python 3.8+ on Windows
 # where asyncio.get_event_loop() can fail in some contexts.
@@ -37,7 +37,7 @@ st.sidebar.info("Note: Camera must be restarted for changes to take effect.")
 @st.cache_resource
 def load_yolo_model(path):
     try:
-        model = YOLO(path)
+        model = load_app_model(path)
         return model
     except Exception as e:
         st.error(f"Error loading YOLO model: {e}")
@@ -95,6 +95,7 @@ if "camera_running" not in st.session_state:
     st.session_state.data_queue = queue.Queue(maxsize=2)
     st.session_state.log_lines = []
     st.session_state.recent_detections = []
+    st.session_state.detection_table = None
     st.session_state.latest_frame = None
 
 run_camera = st.session_state.camera_running
@@ -113,29 +114,6 @@ def update_detection_table():
     else:
         detection_table_placeholder.info("No detections yet.")
 
-def get_csv_report():
-    if not st.session_state.recent_detections:
-        return None
-    df = pd.DataFrame(st.session_state.recent_detections)
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    return csv_buffer.getvalue()
-
-def get_intersection_area(box1, box2):
-    """Calculate the intersection area of two bounding boxes."""
-    x1 = max(box1[0], box2[0])
-    y1 = max(box1[1], box2[1])
-    x2 = min(box1[2], box2[2])
-    y2 = min(box1[3], box2[3])
-    
-    # The intersection of two axis-aligned bounding boxes is always an
-    # axis-aligned bounding box.
-    # If the intersection is valid (width and height are positive),
-    # return the area, otherwise return 0
-    if x2 > x1 and y2 > y1:
-        return (x2 - x1) * (y2 - y1)
-    return 0
-
 def camera_worker(q, stop_event, pause_event, conf_threshold, selected_ppe_list):
     """
     This function runs in a background thread. It captures frames, runs
@@ -170,38 +148,20 @@ def camera_worker(q, stop_event, pause_event, conf_threshold, selected_ppe_list)
             last_known_boxes.clear() # Clear old boxes
 
             results = model(frame, conf=conf_threshold, verbose=False)[0]
-            all_detections = [{'class': int(b.cls[0]), 'xyxy': b.xyxy[0].cpu().numpy().astype(int)} for b in results.boxes]
-            
-            persons = [d for d in all_detections if d['class'] == person_class_idx]
-            ppe_items = [d for d in all_detections if d['class'] in ppe_class_indices]
+            # A PPE item belongs to the first person covering more than half of it
+            person_boxes, missing_per_person = detect_ppe(results, class_names, person_class_idx, ppe_class_indices,
+                                                          selected_ppe_list, policy=POLICY_OVERLAP,
+                                                          overlap_threshold=0.5, exclusive=True)
 
-            if persons:
-                new_logs.append(f"[{datetime.now().strftime('%H:%M:%S')}] Running detection on {len(persons)} person(s)...")
+            if len(person_boxes):
+                new_logs.append(f"[{datetime.now().strftime('%H:%M:%S')}] Running detection on {len(person_boxes)} person(s)...")
 
-            for person in persons:
-                px1, py1, px2, py2 = person['xyxy']
-                ppe_found = set()
-                
-                # Find PPE items associated with this person
-                unassigned_ppe_items = []
-                for item in ppe_items:
-                    ix1, iy1, ix2, iy2 = item['xyxy']
-                    item_area = (ix2 - ix1) * (iy2 - iy1)
-                    intersection_area = get_intersection_area(person['xyxy'], item['xyxy'])
-                    
-                    if item_area > 0 and intersection_area / item_area > 0.5:
-                        ppe_found.add(class_names[item['class']])
-                    else:
-                        unassigned_ppe_items.append(item)
-                
-                ppe_items = unassigned_ppe_items
-                
-                missing_ppe = [ppe for ppe in selected_ppe_list if ppe not in ppe_found]
+            for (px1, py1, px2, py2), missing_ppe in zip(person_boxes.tolist(), missing_per_person):
                 label = 'Missing: ' + (', '.join(missing_ppe) if missing_ppe else 'None')
                 color = (0, 0, 255) if missing_ppe else (0, 255, 0)
                 
                 # Store the box and its info for redrawing
-                last_known_boxes.append({'xyxy': person['xyxy'], 'label': label, 'color': color})
+                last_known_boxes.append({'xyxy': (px1, py1, px2, py2), 'label': label, 'color': color})
                 
                 alert = bool(missing_ppe)
                 if alert:
@@ -267,17 +227,11 @@ if pause_cam:
 if clear_log:
     st.session_state.log_lines.clear()
     st.session_state.recent_detections.clear()
+    st.session_state.detection_table = None
     st.rerun()
 
-# Download CSV report button
-csv_report = get_csv_report()
-if csv_report:
-    download_placeholder.download_button(
-        label="Download Detection Report (CSV)",
-        data=csv_report,
-        file_name="ppe_detection_report.csv",
-        mime="text/csv"
-    )
+# Detection report export
+report_controls(download_placeholder)
 
 # Main UI Update Loop
 if run_camera:
@@ -296,7 +250,9 @@ if run_camera:
             st.session_state.latest_frame = data["frame"]
         
         st.session_state.log_lines.extend(data.get("logs", []))
-        st.session_state.recent_detections.extend(data.get("detections", []))
+        if "detections" in data:
+            st.session_state.recent_detections.extend(data["detections"])
+            st.session_state.detection_table = None
         
         # Trim logs and detections
         if len(st.session_state.log_lines) > 20:
@@ -323,21 +279,12 @@ else:
 log_placeholder.code("\n".join(st.session_state.log_lines), language="log")
 
 if st.session_state.recent_detections:
-    df = pd.DataFrame(reversed(st.session_state.recent_detections))
-    detection_table_placeholder.dataframe(df, use_container_width=True, height=350)
-    
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    download_placeholder.download_button(
-        label="Download Report (CSV)",
-        data=csv_buffer.getvalue(),
-        file_name="ppe_detection_report.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
+    # Rebuilt only when detections arrive, not on every rerun of the live feed
+    if st.session_state.detection_table is None:
+        st.session_state.detection_table = pd.DataFrame(reversed(st.session_state.recent_detections))
+    detection_table_placeholder.dataframe(st.session_state.detection_table, use_container_width=True, height=350)
 else:
     detection_table_placeholder.info("No detections recorded yet.")
-    download_placeholder.empty()
 
 # Trigger a rerun to create a live-feed effect
 if st.session_state.camera_running:
@@ -1,13 +1,12 @@
 import streamlit as st
 import cv2
-from ultralytics import YOLO
 import numpy as np
 from PIL import Image
 import time
 import pandas as pd
 from datetime import datetime
-import io
 import base64
+from streamlit_common import detect_ppe, load_app_model, report_controls
 
 # Path to your trained YOLOv8 model
 MODEL_PATH = "yolov8x.pt"
@@ -25,7 +24,7 @@ st.sidebar.header('Session PPE Requirements')
 selected_ppe = st.sidebar.multiselect('Select required PPE items:', ALL_PPE_CLASSES, default=ALL_PPE_CLASSES)
 
 # Load the model
-model = YOLO(MODEL_PATH)
+model = load_app_model(MODEL_PATH)
 class_names = model.names
 
 # Find class indices for person, excluded, and PPE classes
@@ -94,14 +93,6 @@ def update_detection_table():
     else:
         detection_table_placeholder.info("No detections yet.")
 
-def get_csv_report():
-    if not recent_detections:
-        return None
-    df = pd.DataFrame(recent_detections)
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    return csv_buffer.getvalue()
-
 # User controls
 col1, col2, col3 = st.columns(3)
 with col1:
@@ -119,6 +110,9 @@ with col3:
 if st.button("Stop Camera"):
     st.session_state['run_camera'] = False
 
+# Report export, before the camera loop so its buttons work while the camera runs
+report_controls(download_placeholder)
+
 # Camera loop in main thread
 if st.session_state['run_camera']:
     cap = cv2.VideoCapture(0)
@@ -136,29 +130,12 @@ if st.session_state['run_camera']:
                 break
             # Run YOLOv8 inference
             results = model(frame, conf=conf_threshold)[0]
-            detections = []
-            for box in results.boxes:
-                cls = int(box.cls[0])
-                conf = float(box.conf[0])
-                if conf < conf_threshold:
-                    continue
-                xyxy = box.xyxy[0].cpu().numpy().astype(int)
-                detections.append({'class': cls, 'conf': conf, 'xyxy': xyxy})
-            persons = [d for d in detections if d['class'] == person_class_idx]
-            if persons:
+            # Use only selected PPE for this session
+            person_boxes, missing_per_person = detect_ppe(results, class_names, person_class_idx, ppe_class_indices,
+                                                          selected_ppe, conf_threshold)
+            if len(person_boxes):
                 log("person detected .. starting PPE detection")
-            for person in persons:
-                px1, py1, px2, py2 = person['xyxy']
-                ppe_found = set()
-                for d in detections:
-                    if d['class'] in ppe_class_indices:
-                        x1, y1, x2, y2 = d['xyxy']
-                        cx = (x1 + x2) // 2
-                        cy = (y1 + y2) // 2
-                        if px1 <= cx <= px2 and py1 <= cy <= py2:
-                            ppe_found.add(class_names[d['class']])
-                # Use only selected PPE for this session
-                missing_ppe = [ppe for ppe in selected_ppe if ppe not in ppe_found]
+            for (px1, py1, px2, py2), missing_ppe in zip(person_boxes.tolist(), missing_per_person):
                 label = 'Missing: ' + (', '.join(missing_ppe) if missing_ppe else 'None')
                 text_x = px1
                 text_y = max(py1 - 10, 20)
@@ -186,13 +163,3 @@ if st.session_state['run_camera']:
             time.sleep(0.03)  # ~30 FPS
         cap.release()
         frame_placeholder.empty()
-
-# Download CSV report button
-csv_report = get_csv_report()
-if csv_report:
-    download_placeholder.download_button(
-        label="Download Detection Report (CSV)",
-        data=csv_report,
-        file_name="ppe_detection_report.csv",
-        mime="text/csv"
-    ) 
\ No newline at end of file
@@ -1,15 +1,15 @@
 import streamlit as st
 import cv2
-from ultralytics import YOLO
 import numpy as np
 from PIL import Image
 import threading
 import time
 import pandas as pd
 from datetime import datetime
-import io
 import base64
 import queue
+from streamlit_common import detect_ppe, load_app_model, report_controls
+from motion_gate import MotionGate
 
 # Path to your trained YOLOv8 model
 MODEL_PATH = 'yolov8x.pt'
@@ -50,6 +50,7 @@ selected_ppe = st.sidebar.multiselect(
     ALL_PPE_CLASSES, 
     default=ALL_PPE_CLASSES
 )
+skip_static = st.sidebar.checkbox('Skip detection on unchanged frames', value=True)
 
 # Live status indicator
 status_placeholder = st.empty()
@@ -83,7 +84,7 @@ download_placeholder = st.empty()
 
 # Load the model
 try:
-    model = YOLO(MODEL_PATH)
+    model = load_app_model(MODEL_PATH)
     class_names = model.names
     
     # Find class indices
@@ -120,100 +121,70 @@ def update_detection_table():
     else:
         detection_table_placeholder.info("No detections yet.")
 
-def get_csv_report():
-    if not state.recent_detections:
-        return None
-    df = pd.DataFrame(state.recent_detections)
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    return csv_buffer.getvalue()
-
-# Download CSV report button
-csv_report = get_csv_report()
-if csv_report:
-    download_placeholder.download_button(
-        label="Download Detection Report (CSV)",
-        data=csv_report,
-        file_name="ppe_detection_report.csv",
-        mime="text/csv"
-    )
+# Detection report export
+report_controls(download_placeholder)
 
 def camera_loop():
     cap = cv2.VideoCapture(0)
     if not cap.isOpened():
         log("Could not open webcam.")
         return
-        
+    gate = MotionGate() if skip_static else None
+    last_boxes = []
+
     try:
         while state.run_camera:
             if state.video_paused:
                 time.sleep(0.1)
                 continue
-                
+
             ret, frame = cap.read()
             if not ret:
                 log("Failed to capture frame.")
                 break
-                
-            # Run YOLOv8 inference
-            results = model(frame, conf=conf_threshold)[0]
-            detections = []
-            
-            for box in results.boxes:
-                cls = int(box.cls[0])
-                conf = float(box.conf[0])
-                
-                if conf < conf_threshold:
-                    continue
-                    
-                xyxy = box.xyxy[0].cpu().numpy().astype(int)
-                detections.append({'class': cls, 'conf': conf, 'xyxy': xyxy})
-                
-            persons = [d for d in detections if d['class'] == person_class_idx]
-            
-            if persons:
-                log("Person detected .. starting PPE detection")
-                
-            for person in persons:
-                px1, py1, px2, py2 = person['xyxy']
-                ppe_found = set()
-                
-                for d in detections:
-                    if d['class'] in ppe_class_indices:
-                        x1, y1, x2, y2 = d['xyxy']
-                        cx = (x1 + x2) // 2
-                        cy = (y1 + y2) // 2
-                        if px1 <= cx <= px2 and py1 <= cy <= py2:
-                            ppe_found.add(class_names[d['class']])
-                            
-                missing_ppe = [ppe for ppe in selected_ppe if ppe not in ppe_found]
-                label = 'Missing: ' + (', '.join(missing_ppe) if missing_ppe else 'None')
-                
-                # Add detection record
-                detection_record = {
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'person_location': f'[{px1},{py1},{px2},{py2}]',
-                    'missing_PPE': ', '.join(missing_ppe) if missing_ppe else 'None',
-                    'alert': 'Yes' if missing_ppe else 'No'
-                }
-                
-                state.update_queue.put(('detection', detection_record))
-                
-                # Draw detection box
-                color = (0, 0, 255) if missing_ppe else (0, 255, 0)
+
+            if gate is None or gate.should_run(frame):
+                # Run YOLOv8 inference
+                results = model(frame, conf=conf_threshold)[0]
+                person_boxes, missing_per_person = detect_ppe(results, class_names, person_class_idx,
+                                                              ppe_class_indices, selected_ppe, conf_threshold)
+
+                if len(person_boxes):
+                    log("Person detected .. starting PPE detection")
+
+                last_boxes = []
+                for (px1, py1, px2, py2), missing_ppe in zip(person_boxes.tolist(), missing_per_person):
+                    label = 'Missing: ' + (', '.join(missing_ppe) if missing_ppe else 'None')
+                    color = (0, 0, 255) if missing_ppe else (0, 255, 0)
+                    last_boxes.append(((px1, py1, px2, py2), label, color))
+
+                    # Add detection record
+                    detection_record = {
+                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        'person_location': f'[{px1},{py1},{px2},{py2}]',
+                        'missing_PPE': ', '.join(missing_ppe) if missing_ppe else 'None',
+                        'alert': 'Yes' if missing_ppe else 'No'
+                    }
+
+                    state.update_queue.put(('detection', detection_record))
+
+            # Draw the latest detections, also on frames the motion gate skipped
+            for (px1, py1, px2, py2), label, color in last_boxes:
                 cv2.rectangle(frame, (px1, py1), (px2, py2), color, 2)
-                cv2.putText(frame, label, (px1, max(py1 - 10, 20)), 
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-                
+                cv2.putText(frame, label, (px1, max(py1 - 10, 20)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+
             # Convert frame for display
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             frame_pil = Image.fromarray(frame_rgb)
             state.update_queue.put(('frame', frame_pil))
-            
+
             time.sleep(0.03)  # ~30 FPS
-            
+
     finally:
         cap.release()
+        if gate is not None:
+            log(f"Motion gate skipped {gate.skipped} of {gate.checked} frames.")
         state.update_queue.put(('status', 'Camera Stopped'))
 
 # Camera thread management
@@ -1,6 +1,3 @@
-import cv2
-from ultralytics import YOLO
-import numpy as np
 from datetime import datetime
 import time
 import argparse
@@ -8,13 +5,32 @@ import sys
 import paho.mqtt.client as mqtt
 import json
 import os
+import socket
 from dotenv import load_dotenv
+from ppe_assignment import POLICIES, POLICY_CENTER, find_missing_ppe
+from ensemble import FUSION_MODES, FUSION_NMS, extract_detections, missing_ppe_per_person
+from tracker import PersonTracker
+from alert_publisher import AlertPublisher
+from mqtt_spool import AlertSpool, DurablePublisher
+from multi_source import open_sources
+from motion_gate import MotionGate
+from model_backends import BACKEND_PYTORCH, BACKENDS, PRECISION_FP32, PRECISIONS, load_model
+from worker_pool import InferencePool, build_detector, detector_spec
+from detection_store import open_history, source_name
+from metrics import Metrics
 
 # Load environment variables from .env file
 load_dotenv()
 
 # --- CONFIGURATION ---
 MODEL_PATHS = ['yolo8s.pt', 'yolo8n.pt', 'yolov8x.pt']
+# Cascade tiers, cheapest first
+CASCADE_MODEL_PATHS = ['yolo8n.pt', 'yolo8s.pt', 'yolov8x.pt']
+# Two-stage mode: persons on a downscaled frame, PPE on full-resolution person crops
+TWO_STAGE_MODEL_PATHS = ['yolo8n.pt', 'yolov8x.pt']
+DETECTION_MODES = ['ensemble', 'cascade', 'two-stage']
+# Light person detector that drives the tracker in --track mode
+TRACKING_MODEL_PATH = 'yolo8n.pt'
 ALL_PPE_CLASSES = ['face-guard', 'ear-mufs', 'safety-vest', 'gloves', 'glasses']
 EXCLUDED_CLASSES = ['hands', 'head', 'face', 'ear', 'tools', 'foot', 'medical-suit', 'safety-suit', 'face-mask-medical']
 
@@ -23,8 +39,13 @@ BROKER = os.getenv("MQTT_BROKER")
 PORT = os.getenv("MQTT_PORT")
 TOPIC = os.getenv("MQTT_TOPIC", "alerts")
 CLIENT_ID = "serbot_inference"
+# Sent with every alert as its 'robot' field
+ROBOT_ID = os.getenv("SERBOT_ROBOT_ID", socket.gethostname())
 USERNAME = os.getenv("MQTT_USERNAME")
 PASSWORD = os.getenv("MQTT_PASSWORD")
+# Alerts are spooled here until the broker acknowledges them
+SPOOL_PATH = os.getenv("SERBOT_SPOOL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alert_spool.db'))
+SPOOL_MAX_MESSAGES = int(os.getenv("SERBOT_SPOOL_MAX_MESSAGES", 10000))
 
 # Print MQTT config for debugging
 print("BROKER:", BROKER)
@@ -54,120 +75,295 @@ def setup_mqtt():
     client = mqtt.Client(client_id=CLIENT_ID, protocol=mqtt.MQTTv5)
     client.tls_set()  # Enable TLS for secure connection
     client.username_pw_set(USERNAME, PASSWORD)
-    client.connect(BROKER, PORT)
+    client.reconnect_delay_set(min_delay=1, max_delay=60)
+    # connect_async lets the network loop keep retrying while the site Wi-Fi is down
+    client.connect_async(BROKER, PORT)
     client.loop_start()
     return client
 
-def send_alert_mqtt(client, person_box, missing_ppe):
-    alert_payload = {
-        "icon": "⚠️",
-        "title": "CRITICAL: PPE Missing",
-        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "description": f"Person at {person_box} is missing: {', '.join(missing_ppe)}",
-        "priority": "HIGH",
-        "type": "critical",
-        "person_box": person_box,
-        "missing_ppe": missing_ppe
-    }
-    client.publish(TOPIC, json.dumps(alert_payload))
-    print(f"[ALERT] Sent MQTT: {alert_payload}")
-
-def main(conf_threshold=0.5, camera_index=0, required_ppe=None, interval=5):
-    print("Loading models...")
+def update_tracks(frame, frame_idx, tracker, person_model, detector, conf_threshold, required_ppe,
+                  assignment_policy, detect_every, ppe_refresh, metrics, history=None, source=None):
+    """
+    One tracking cycle: refresh or propagate the person tracks, then run the
+    heavy detector only if some track has no valid cached PPE status.
+    Rechecked tracks are recorded in `history`. Returns the number of tracks
+    that were (re)checked.
+    """
+    if frame_idx % detect_every == 0:
+        with metrics.timed('stage_seconds', stage='inference'):
+            results = person_model(frame, conf=tracker.low_score, verbose=False)[0]
+        people = extract_detections(results, person_model.names, ALL_PPE_CLASSES)
+        if people is not None:
+            tracker.update(people.person_boxes, people.person_scores)
+    else:
+        tracker.predict()
+
+    stale = tracker.tracks_needing_ppe_check(max_age=ppe_refresh)
+    if stale:
+        with metrics.timed('stage_seconds', stage='inference'):
+            detections = detector(frame, conf_threshold)
+        missing_per_track = find_missing_ppe([t.int_box for t in stale], detections.ppe_boxes,
+                                             detections.ppe_labels, required_ppe, policy=assignment_policy)
+        for track, missing_ppe in zip(stale, missing_per_track):
+            track.set_ppe_status(missing_ppe)
+        if history is not None:
+            history.record(source_name(source, ROBOT_ID), [t.int_box for t in stale], [t.score for t in stale],
+                           missing_per_track, detections.ppe_boxes, detections.ppe_scores, detections.ppe_labels)
+    return len(stale)
+
+def report_tracks(publisher, tracker, source):
+    """Queues alerts for tracks whose missing-PPE set changed since their last accepted report."""
+    for t in tracker.tracks:
+        if t.missing_ppe is None or t.misses:
+            continue
+        status = frozenset(t.missing_ppe)
+        if status == t.alerted:
+            continue
+        px1, py1, px2, py2 = t.int_box
+        if t.missing_ppe:
+            # A suppressed or dropped alert is tried again on the next frame
+            if not publisher.add(t.int_box, t.missing_ppe, track_id=t.track_id, source=source):
+                continue
+        else:
+            print(f"[{datetime.now()}] [{source}] Person #{t.track_id} at [{px1},{py1},{px2},{py2}] - All PPE present.")
+        t.alerted = status
+
+def report_detections(publisher, detections, required_ppe, assignment_policy, source, history=None):
+    """Queues alerts for every detected person missing required PPE and records the frame in `history`."""
+    missing_per_person = missing_ppe_per_person(detections, required_ppe, policy=assignment_policy)
+    if history is not None:
+        history.record_detections(source_name(source, ROBOT_ID), detections, missing_per_person)
+    for person_box, missing_ppe in zip(detections.person_boxes.tolist(), missing_per_person):
+        px1, py1, px2, py2 = person_box
+        if missing_ppe:
+            publisher.add(person_box, missing_ppe, source=source)
+        else:
+            print(f"[{datetime.now()}] [{source}] Person at [{px1},{py1},{px2},{py2}] - All PPE present.")
+
+def export_metrics(metrics, streams, publisher, durable, mqtt_client, metrics_file=None, metrics_topic=None):
+    """Refreshes the gauges and writes the metrics to the metrics file and/or topic."""
+    for stream in streams:
+        stream_stats = stream.stats()
+        metrics.set('source_fps', stream_stats['fps'] or 0, source=stream.name)
+        metrics.set('source_latency_p95_ms', stream_stats['latency_ms_p95'] or 0, source=stream.name)
+    for key, value in publisher.stats().items():
+        metrics.set('alerts', value, kind=key)
+    spool_stats = durable.stats()
+    metrics.set('spool_depth', spool_stats['spool_depth'])
+    metrics.set('mqtt_connected', int(bool(spool_stats['connected'])))
+    try:
+        if metrics_file:
+            metrics.write(metrics_file)
+        if metrics_topic and mqtt_client.is_connected():
+            # Metrics are only worth sending while fresh, so they skip the durable spool
+            mqtt_client.publish(metrics_topic, json.dumps(metrics.snapshot()), qos=0)
+    except OSError as e:
+        print(f"Failed to write metrics: {e}")
+
+def main(conf_threshold=0.5, camera_index=0, required_ppe=None, interval=5, assignment_policy=POLICY_CENTER,
+         fusion=FUSION_NMS, parallel=True, mode='ensemble', cascade_margin=0.15,
+         track=False, detect_every=1, ppe_refresh=60.0, alert_window=60.0, alert_rate=0.5, alert_burst=3,
+         motion_gate=False, motion_threshold=0.01, motion_refresh=30.0, person_imgsz=640, crop_imgsz=640,
+         sources=None, source_fps=None, backend=BACKEND_PYTORCH, precision=PRECISION_FP32, calibration=None,
+         metrics_file=None, metrics_topic=None, metrics_interval=30.0, workers=0,
+         history=True):
+    model_paths = {'cascade': CASCADE_MODEL_PATHS, 'two-stage': TWO_STAGE_MODEL_PATHS}.get(mode, MODEL_PATHS)
+    mode_options = {
+        'ensemble': {'fusion': fusion, 'parallel': parallel},
+        'cascade': {'margin': cascade_margin},
+        'two-stage': {'person_imgsz': person_imgsz, 'crop_imgsz': crop_imgsz}
+    }[mode]
+    print(f"Loading models ({backend}, {precision})...")
+    spec = detector_spec(mode, model_paths, ALL_PPE_CLASSES, backend, precision, calibration, **mode_options)
     try:
-        models = [YOLO(path) for path in MODEL_PATHS]
-        print(f"Successfully loaded {len(models)} models.")
+        if workers:
+            # Worker processes are forked before this process loads models or starts threads
+            detector = InferencePool(spec, workers)
+            print(f"Started {workers} inference workers with {len(model_paths)} models each.")
+        else:
+            detector = build_detector(spec)
+            print(f"Successfully loaded {len(model_paths)} models.")
     except Exception as e:
         print(f"Error loading models: {e}")
-        print(f"Please ensure all model files in {MODEL_PATHS} are present in the directory.")
+        print(f"Please ensure all model files in {model_paths} are present in the directory.")
         sys.exit(1)
 
     if required_ppe is None:
         required_ppe = ALL_PPE_CLASSES
 
-    cap = cv2.VideoCapture(camera_index)
-    if not cap.isOpened():
-        print("Could not open webcam.")
+    if track:
+        person_model = load_model(TRACKING_MODEL_PATH, backend, precision, calibration)
+    frames_seen = 0
+    heavy_runs = 0
+
+    # All sources share the loaded models; --camera is the single-source default
+    streams = open_sources(sources or [camera_index], max_fps=source_fps)
+    if not streams:
+        print("Could not open any video source.")
         sys.exit(1)
+    for stream in streams:
+        if motion_gate:
+            stream.state['gate'] = MotionGate(threshold=motion_threshold, refresh_seconds=motion_refresh)
+        if track:
+            stream.state['tracker'] = PersonTracker(high_score=conf_threshold)
+            stream.state['frame_idx'] = 0
+
+    metrics = Metrics('serbot')
+    metrics.describe('stage_seconds', 'Time spent per pipeline stage (capture, motion_gate, inference, '
+                                      'postprocess, alert_flush, mqtt_publish)')
+    metrics.describe('frames_total', 'Frames captured per source')
+    metrics.describe('frames_skipped_total', 'Frames skipped by the motion gate per source')
+    next_metrics = time.monotonic() + metrics_interval
 
     mqtt_client = setup_mqtt()
+    durable = DurablePublisher(mqtt_client, AlertSpool(SPOOL_PATH, max_messages=SPOOL_MAX_MESSAGES), metrics=metrics)
+    # Every detection is kept on disk, see detection_store.py for retention and rollups
+    history_store = open_history() if history else None
+    publisher = AlertPublisher(durable, TOPIC, suppress_window=alert_window, rate=alert_rate, burst=alert_burst, qos=1,
+                               robot=ROBOT_ID)
 
-    print("Starting inference. Press Ctrl+C to stop.")
+    print(f"Starting inference on {len(streams)} source(s). Press Ctrl+C to stop.")
     try:
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("Failed to capture frame.")
+            # Collect the freshest frame of every source that is due this cycle
+            batch = []
+            read_at = time.perf_counter()
+            due = [stream for stream in streams if stream.due()]
+            for stream in due:
+                stream.request()
+            for stream in due:
+                with metrics.timed('stage_seconds', stage='capture'):
+                    ret, frame = stream.collect()
+                if not ret:
+                    print(f"Source {stream.name} ended." if stream.ended else f"No frame from {stream.name} yet.")
+                    continue
+                frames_seen += 1
+                metrics.inc('frames_total', source=stream.name)
+                gate = stream.state.get('gate')
+                if gate is not None:
+                    with metrics.timed('stage_seconds', stage='motion_gate'):
+                        run = gate.should_run(frame)
+                    if not run:
+                        metrics.inc('frames_skipped_total', source=stream.name)
+                        continue
+                batch.append((stream, frame, read_at))
+            if all(stream.ended for stream in streams):
                 break
 
-            all_person_boxes = []
-            all_person_scores = []
-            all_ppe_detections = []
+            if track:
+                for stream, frame, read_at in batch:
+                    checked = update_tracks(frame, stream.state['frame_idx'], stream.state['tracker'], person_model,
+                                            detector, conf_threshold, required_ppe, assignment_policy,
+                                            detect_every, ppe_refresh, metrics, history_store, stream.name)
+                    heavy_runs += 1 if checked else 0
+                    stream.state['frame_idx'] += 1
+                    with metrics.timed('stage_seconds', stage='postprocess'):
+                        report_tracks(publisher, stream.state['tracker'], stream.name)
+                    stream.record(read_at)
+            elif batch:
+                # One forward pass for the frames of all sources
+                with metrics.timed('stage_seconds', stage='inference'):
+                    results = detector.detect_batch([frame for _, frame, _ in batch], conf_threshold,
+                                                    keys=[stream.name for stream, _, _ in batch])
+                for (stream, _, read_at), detections in zip(batch, results):
+                    with metrics.timed('stage_seconds', stage='postprocess'):
+                        report_detections(publisher, detections, required_ppe, assignment_policy, stream.name,
+                                          history_store)
+                    stream.record(read_at)
+            with metrics.timed('stage_seconds', stage='alert_flush'):
+                publisher.flush()
 
-            for model in models:
-                results = model(frame, conf=conf_threshold, verbose=False)[0]
-                model_class_names = model.names
-                
-                person_class_indices = [k for k, v in model_class_names.items() if v == 'person']
-                if not person_class_indices:
-                    continue
-                person_class_idx = person_class_indices[0]
-                
-                ppe_class_indices = [k for k, v in model_class_names.items() if v in ALL_PPE_CLASSES]
-
-                for r in results.boxes:
-                    class_id = int(r.cls[0])
-                    box = r.xyxy[0].cpu().numpy()
-                    
-                    if class_id == person_class_idx:
-                        all_person_boxes.append(list(box.astype(int)))
-                        all_person_scores.append(float(r.conf[0]))
-                    elif class_id in ppe_class_indices:
-                        all_ppe_detections.append({
-                            'class_name': model_class_names[class_id],
-                            'xyxy': box.astype(int)
-                        })
-
-            # Use Non-Maximum Suppression (NMS) to merge overlapping person boxes
-            person_boxes_xywh = [[x1, y1, x2 - x1, y2 - y1] for x1, y1, x2, y2 in all_person_boxes]
-            unique_person_indices = []
-            if all_person_boxes:
-                unique_person_indices = cv2.dnn.NMSBoxes(person_boxes_xywh, all_person_scores, conf_threshold, 0.45)
-                if isinstance(unique_person_indices, np.ndarray):
-                    unique_person_indices = unique_person_indices.flatten()
-            
-            final_person_boxes = [all_person_boxes[i] for i in unique_person_indices]
-
-            for person_box in final_person_boxes:
-                px1, py1, px2, py2 = person_box
-                ppe_found = set()
-                for d in all_ppe_detections:
-                    x1, y1, x2, y2 = d['xyxy']
-                    cx = (x1 + x2) // 2
-                    cy = (y1 + y2) // 2
-                    if px1 <= cx <= px2 and py1 <= cy <= py2:
-                        ppe_found.add(d['class_name'])
-                
-                missing_ppe = [ppe for ppe in required_ppe if ppe not in ppe_found]
-                if missing_ppe:
-                    send_alert_mqtt(mqtt_client, f"[{px1},{py1},{px2},{py2}]", missing_ppe)
-                else:
-                    print(f"[{datetime.now()}] Person at [{px1},{py1},{px2},{py2}] - All PPE present.")
+            if (metrics_file or metrics_topic) and time.monotonic() >= next_metrics:
+                export_metrics(metrics, streams, publisher, durable, mqtt_client, metrics_file, metrics_topic)
+                next_metrics = time.monotonic() + metrics_interval
 
             time.sleep(interval)  # Wait before next detection
 
     except KeyboardInterrupt:
         print("Stopping inference.")
     finally:
-        cap.release()
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
+        # The MQTT client is stopped even when reporting or closing something else fails
+        try:
+            print(f"Detector stats ({mode}): {detector.stats()}")
+            if track:
+                print(f"Tracking: {frames_seen} frames, heavy detector ran on {heavy_runs}.")
+            print(f"Alert publisher: {publisher.stats()}")
+            durable.close()
+            print(f"Alert spool: {durable.stats()}")
+            if metrics_file or metrics_topic:
+                export_metrics(metrics, streams, publisher, durable, mqtt_client, metrics_file, metrics_topic)
+            durable.spool.close()
+            for stream in streams:
+                print(f"Source {stream.name}: {stream.stats()}")
+                if 'gate' in stream.state:
+                    print(f"Motion gate {stream.name}: {stream.state['gate'].stats()}")
+                stream.release()
+            detector.close()
+            if history_store is not None:
+                history_store.close()
+                print(f"Detection history: {history_store.stats()}")
+        finally:
+            mqtt_client.loop_stop()
+            mqtt_client.disconnect()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="PPE Detection CLI")
     parser.add_argument('--conf', type=float, default=0.5, help='Confidence threshold')
     parser.add_argument('--camera', type=int, default=0, help='Camera index')
+    parser.add_argument('--source', nargs='+', default=None,
+                        help='Camera indices, RTSP URLs or video files to process together (overrides --camera)')
+    parser.add_argument('--source-fps', type=float, default=None, help='Maximum frames per second taken from each source')
     parser.add_argument('--ppe', nargs='*', default=ALL_PPE_CLASSES, help='Required PPE items')
-    parser.add_argument('--interval', type=int, default=5, help='Detection interval in seconds')
+    parser.add_argument('--interval', type=float, default=5, help='Detection interval in seconds')
+    parser.add_argument('--assignment', choices=POLICIES, default=POLICY_CENTER, help='PPE-to-person assignment policy')
+    parser.add_argument('--mode', choices=DETECTION_MODES, default='ensemble',
+                        help='Run all models as an ensemble, as a confidence-gated cascade, or as '
+                             'person detection followed by PPE detection on person crops')
+    parser.add_argument('--cascade-margin', type=float, default=0.15,
+                        help='Scores within this distance of --conf escalate to the next cascade tier')
+    parser.add_argument('--fusion', choices=FUSION_MODES, default=FUSION_NMS,
+                        help='How detections of the ensemble members are merged')
+    parser.add_argument('--sequential', action='store_true', help='Run ensemble members one after another')
+    parser.add_argument('--track', action='store_true',
+                        help='Track persons and only re-check PPE on new or changed tracks')
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help='In --track mode, run the person detector every N frames and propagate tracks in between')
+    parser.add_argument('--ppe-refresh', type=float, default=60.0,
+                        help='In --track mode, re-check the PPE of unchanged tracks after this many seconds')
+    parser.add_argument('--alert-window', type=float, default=60.0,
+                        help='Suppress repeats of the same person/location and missing PPE for this many seconds')
+    parser.add_argument('--alert-rate', type=float, default=0.5, help='Sustained alert messages per second per topic')
+    parser.add_argument('--alert-burst', type=int, default=3, help='Alert messages allowed in a burst per topic')
+    parser.add_argument('--motion-gate', action='store_true', help='Skip inference while the scene is unchanged')
+    parser.add_argument('--motion-threshold', type=float, default=0.01,
+                        help='Fraction of changed pixels that counts as a scene change')
+    parser.add_argument('--motion-refresh', type=float, default=30.0,
+                        help='Run inference at least this often (seconds) even if nothing changed')
+    parser.add_argument('--person-imgsz', type=int, default=640,
+                        help='In two-stage mode, longest side of the downscaled frame used to find persons')
+    parser.add_argument('--crop-imgsz', type=int, default=640, help='In two-stage mode, model input size for person crops')
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKEND_PYTORCH,
+                        help='Inference backend; onnx/openvino models are exported next to the .pt files on first use')
+    parser.add_argument('--precision', choices=PRECISIONS, default=PRECISION_FP32,
+                        help='Model precision; int8 needs --calibration on first use')
+    parser.add_argument('--calibration', default=None,
+                        help='Directory of sample images or a video file used to calibrate INT8 models')
+    parser.add_argument('--metrics-file', default=None,
+                        help='Periodically write stage latency metrics here (Prometheus text for .prom, JSON otherwise)')
+    parser.add_argument('--metrics-topic', default=None, help='Periodically publish the metrics as JSON on this MQTT topic')
+    parser.add_argument('--metrics-interval', type=float, default=30.0, help='Seconds between metrics exports')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Run the detector in this many processes pinned to separate CPU cores (0: in-process)')
+    parser.add_argument('--no-history', action='store_true',
+                        help='Do not record detections in the detection history (SERBOT_HISTORY_PATH)')
     args = parser.parse_args()
-    main(conf_threshold=args.conf, camera_index=args.camera, required_ppe=args.ppe, interval=args.interval)
\ No newline at end of file
+    main(conf_threshold=args.conf, camera_index=args.camera, required_ppe=args.ppe, interval=args.interval,
+         assignment_policy=args.assignment, fusion=args.fusion, parallel=not args.sequential,
+         mode=args.mode, cascade_margin=args.cascade_margin, track=args.track,
+         detect_every=max(args.detect_every, 1), ppe_refresh=args.ppe_refresh, alert_window=args.alert_window,
+         alert_rate=args.alert_rate, alert_burst=args.alert_burst, motion_gate=args.motion_gate,
+         motion_threshold=args.motion_threshold, motion_refresh=args.motion_refresh,
+         person_imgsz=args.person_imgsz, crop_imgsz=args.crop_imgsz, sources=args.source, source_fps=args.source_fps,
+         backend=args.backend, precision=args.precision, calibration=args.calibration,
+         metrics_file=args.metrics_file, metrics_topic=args.metrics_topic, metrics_interval=args.metrics_interval,
+         workers=args.workers, history=not args.no_history)
\ No newline at end of file
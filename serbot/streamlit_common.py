@@ -0,0 +1,87 @@
+"""
+Pieces shared by the Streamlit demo apps (ppe_streamlit_app*.py), so they are
+configured and fixed in one place: the inference backend settings, detection
+history recording and the detection report export.
+"""
+import os
+from datetime import datetime
+
+import numpy as np
+import streamlit as st
+
+from detection_store import REPORT_FORMATS, open_history, report_formats, source_name
+from model_backends import load_model
+from ppe_assignment import detection_arrays, find_missing_ppe
+
+# Inference backend (pytorch, onnx or openvino) and precision (fp32 or int8);
+# INT8 models are calibrated on PPE_CALIBRATION (image folder or video) on first use
+INFERENCE_BACKEND = os.getenv('PPE_BACKEND', 'pytorch')
+INFERENCE_PRECISION = os.getenv('PPE_PRECISION', 'fp32')
+CALIBRATION_SOURCE = os.getenv('PPE_CALIBRATION')
+
+
+def load_app_model(path):
+    """The detector at `path` on the configured inference backend and precision."""
+    return load_model(path, INFERENCE_BACKEND, INFERENCE_PRECISION, CALIBRATION_SOURCE)
+
+
+# Every detection is kept on disk (SERBOT_HISTORY_PATH), see detection_store.py
+history = open_history()
+HISTORY_SOURCE = source_name(0)
+
+
+def detect_ppe(results, class_names, person_class_idx, ppe_class_indices, required_ppe, conf_threshold=None,
+               **assignment):
+    """
+    Splits one YOLO result into persons and PPE, finds the required PPE each
+    person is missing (`assignment` as for find_missing_ppe) and records the
+    frame in the detection history. Boxes below `conf_threshold` are dropped
+    first when it is given. Returns (person_boxes, missing_per_person).
+    """
+    xyxy, conf, cls = detection_arrays(results.boxes)
+    if conf_threshold is not None:
+        keep = conf >= conf_threshold
+        xyxy, conf, cls = xyxy[keep], conf[keep], cls[keep]
+    person_mask = cls == person_class_idx
+    ppe_mask = np.isin(cls, ppe_class_indices)
+    ppe_labels = [class_names[c] for c in cls[ppe_mask]]
+    person_boxes = xyxy[person_mask]
+    missing_per_person = find_missing_ppe(person_boxes, xyxy[ppe_mask], ppe_labels, required_ppe, **assignment)
+    history.record(HISTORY_SOURCE, person_boxes, conf[person_mask], missing_per_person,
+                   xyxy[ppe_mask], conf[ppe_mask], ppe_labels)
+    return person_boxes, missing_per_person
+
+
+def discard_report():
+    """Deletes the prepared report file, if any."""
+    report = st.session_state.pop('report', None)
+    if report is not None and os.path.exists(report['path']):
+        os.remove(report['path'])
+
+
+def report_controls(container):
+    """Detection report from the detection history, exported a chunk at a time and only when asked for."""
+    with container.container():
+        today = datetime.now().date()
+        period_col, format_col = st.columns(2)
+        period = period_col.date_input("Report period", (today, today),
+                                       help=f"Detections are kept for {history.raw_retention / 86400:g} days")
+        report_format = format_col.selectbox("Report format", report_formats(), format_func=str.upper)
+        if st.button("Prepare Detection Report", disabled=not period):
+            discard_report()
+            first_day, last_day = period[0], period[-1]
+            path, rows = history.export_file(report_format,
+                                             datetime.combine(first_day, datetime.min.time()).timestamp(),
+                                             datetime.combine(last_day, datetime.max.time()).timestamp())
+            st.session_state['report'] = {'path': path, 'rows': rows, 'format': report_format,
+                                          'name': f"ppe_detection_report_{first_day}_{last_day}.{report_format}"}
+        report = st.session_state.get('report')
+        if report is not None:
+            with open(report['path'], 'rb') as file:
+                st.download_button(
+                    label=f"Download Detection Report ({report['rows']} detections)",
+                    data=file,
+                    file_name=report['name'],
+                    mime=REPORT_FORMATS[report['format']],
+                    on_click=discard_report
+                )
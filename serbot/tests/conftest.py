@@ -0,0 +1,5 @@
+import os
+import sys
+
+# serbot modules import each other by name, as when run from serbot/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
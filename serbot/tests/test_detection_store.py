@@ -0,0 +1,43 @@
+import threading
+import time
+
+from detection_store import DetectionStore
+
+
+FLUSH_SECONDS = 3600
+
+
+def open_store(path):
+    # No background flushes or maintenance: the test drives both
+    return DetectionStore(str(path), flush_seconds=FLUSH_SECONDS, maintenance_seconds=3600)
+
+
+def test_concurrent_maintenance_from_two_processes_rolls_up_each_row_once(tmp_path):
+    path = tmp_path / 'history.db'
+    stores = [open_store(path), open_store(path)]
+    now = time.time()
+    recorded = 0
+    for round_ in range(30):
+        for minute in range(4):
+            stores[round_ % 2].record('robot-1/0', [[0, 0, 10, 20]] * 3, [0.9] * 3, [['helmet'], [], ['vest']],
+                                      timestamp=now - 3600 + round_ * 300 + minute * 60)
+            recorded += 3
+        stores[round_ % 2].flush()
+        barrier = threading.Barrier(2)
+
+        # maintain() leaves out the last 2 * flush_seconds for rows still queued
+        def maintain(store, when=now - 3300 + round_ * 300 + 2 * FLUSH_SECONDS):
+            barrier.wait()
+            store.maintain(now=when)
+
+        threads = [threading.Thread(target=maintain, args=(store,)) for store in stores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    rollups = list(stores[0].rollups(label='person'))
+    assert sum(row['detections'] for row in rollups) == recorded
+    assert sum(row['missing'] for row in rollups) == recorded * 2 // 3
+    for store in stores:
+        store.close()
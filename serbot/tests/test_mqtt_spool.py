@@ -0,0 +1,108 @@
+import threading
+import time
+
+from mqtt_spool import AlertSpool, DurablePublisher
+
+
+class FakeInfo:
+    def __init__(self, rc, published):
+        self.rc = rc
+        self.published = published
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+    def is_published(self):
+        return self.published
+
+
+class FakeBroker:
+    """Stands in for a paho client: rejects the first `reject` publishes, then acknowledges everything."""
+
+    def __init__(self, reject=0, unacked=0):
+        self.reject = reject
+        self.unacked = unacked
+        self.attempts = []
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def is_connected(self):
+        return True
+
+    def publish(self, topic, payload, qos=0):
+        with self.lock:
+            self.attempts.append(time.monotonic())
+            if self.reject:
+                self.reject -= 1
+                return FakeInfo(rc=4, published=False)
+            if self.unacked:
+                self.unacked -= 1
+                return FakeInfo(rc=0, published=False)
+            self.delivered.append((topic, payload, qos))
+            return FakeInfo(rc=0, published=True)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_spooled_messages_survive_rejections_and_drain_in_order(tmp_path):
+    spool = AlertSpool(str(tmp_path / 'spool.db'))
+    broker = FakeBroker(reject=3)
+    publisher = DurablePublisher(broker, spool, batch_size=4, min_backoff=0.05, max_backoff=0.2)
+    for i in range(10):
+        publisher.publish('alerts', f'alert-{i}')
+
+    wait_for(lambda: len(broker.attempts) >= 3)
+    # Nothing was acknowledged yet, so nothing left the spool
+    assert spool.depth() == 10 and broker.delivered == []
+
+    wait_for(lambda: spool.depth() == 0)
+    assert [payload for _, payload, _ in broker.delivered] == [f'alert-{i}' for i in range(10)]
+    assert all(qos == 1 for _, _, qos in broker.delivered)
+    assert publisher.delivered == 10 and publisher.failed_batches == 3
+    publisher.close()
+    spool.close()
+
+
+def test_failed_batches_back_off_exponentially(tmp_path):
+    spool = AlertSpool(str(tmp_path / 'spool.db'))
+    broker = FakeBroker(reject=4)
+    publisher = DurablePublisher(broker, spool, min_backoff=0.05, max_backoff=0.2)
+    publisher.publish('alerts', 'alert')
+    wait_for(lambda: spool.depth() == 0)
+
+    gaps = [b - a for a, b in zip(broker.attempts, broker.attempts[1:])]
+    # Waits after the 1st..4th rejection: 0.05, 0.1, 0.2, then capped at 0.2
+    for gap, backoff in zip(gaps, (0.05, 0.1, 0.2, 0.2)):
+        assert gap >= backoff * 0.9
+    assert publisher.backoff == publisher.min_backoff
+    publisher.close()
+    spool.close()
+
+
+def test_unacknowledged_messages_stay_spooled_until_acked(tmp_path):
+    spool = AlertSpool(str(tmp_path / 'spool.db'))
+    for i in range(3):
+        spool.append('alerts', f'alert-{i}')
+    broker = FakeBroker(unacked=1)
+    publisher = DurablePublisher(broker, spool, batch_size=5, ack_timeout=0.05, min_backoff=0.05)
+    wait_for(lambda: spool.depth() == 0)
+
+    # alert-0 was never acknowledged, so the whole batch stayed spooled and went again (at least once)
+    assert [payload for _, payload, _ in broker.delivered] == ['alert-1', 'alert-2', 'alert-0', 'alert-1', 'alert-2']
+    assert publisher.failed_batches == 1
+    publisher.close()
+    spool.close()
+
+
+def test_spool_drops_oldest_beyond_its_bound(tmp_path):
+    spool = AlertSpool(str(tmp_path / 'spool.db'), max_messages=3)
+    for i in range(5):
+        spool.append('alerts', f'alert-{i}')
+    assert [payload for _, _, payload, _ in spool.peek(10)] == ['alert-2', 'alert-3', 'alert-4']
+    assert spool.dropped == 2
+    spool.close()
@@ -0,0 +1,153 @@
+"""
+CPU-only multi-object tracker for persons, in the spirit of SORT/ByteTrack.
+Tracks move with a constant-velocity model between detections and are matched
+to new detections greedily by IoU, high-confidence detections first and the
+remaining low-confidence ones second. Each track caches its PPE status so the
+heavy detector only has to look at new or changed tracks.
+"""
+import time
+
+import numpy as np
+
+from ensemble import box_iou
+from ppe_assignment import as_boxes
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """(A, B) IoU matrix of two xyxy box arrays."""
+    boxes_a = as_boxes(boxes_a)
+    boxes_b = as_boxes(boxes_b)
+    if not len(boxes_a) or not len(boxes_b):
+        return np.zeros((len(boxes_a), len(boxes_b)))
+    return np.stack([box_iou(box, boxes_b) for box in boxes_a])
+
+
+def greedy_match(ious, threshold):
+    """Pairs rows and columns by descending IoU. Returns (matches, unmatched rows, unmatched cols)."""
+    matches = []
+    if ious.size:
+        rows, cols = np.unravel_index(np.argsort(-ious, axis=None), ious.shape)
+        used_rows, used_cols = set(), set()
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            if ious[r, c] < threshold:
+                break
+            if r in used_rows or c in used_cols:
+                continue
+            used_rows.add(r)
+            used_cols.add(c)
+            matches.append((r, c))
+    matched_rows = {r for r, _ in matches}
+    matched_cols = {c for _, c in matches}
+    return (matches,
+            [r for r in range(ious.shape[0]) if r not in matched_rows],
+            [c for c in range(ious.shape[1]) if c not in matched_cols])
+
+
+class Track:
+    def __init__(self, track_id, box, score):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float64)
+        self.velocity = np.zeros(4)
+        self.score = float(score)
+        self.hits = 1
+        self.misses = 0
+        # PPE status cache: the box it was computed on, when, and the result
+        self.ppe_box = None
+        self.ppe_checked_at = 0.0
+        self.missing_ppe = None
+        # Missing PPE set of the last alert sent for this track
+        self.alerted = None
+
+    @property
+    def int_box(self):
+        return [int(v) for v in np.rint(self.box)]
+
+    def predict(self):
+        self.box = self.box + self.velocity
+
+    def update(self, box, score, gain=0.5):
+        # Alpha-beta style correction: `self.box` is the predicted position here
+        box = np.asarray(box, dtype=np.float64)
+        self.velocity = self.velocity + gain * (box - self.box)
+        self.box = box
+        self.score = float(score)
+        self.hits += 1
+        self.misses = 0
+
+    def set_ppe_status(self, missing_ppe):
+        self.missing_ppe = list(missing_ppe)
+        self.ppe_box = self.box.copy()
+        self.ppe_checked_at = time.time()
+
+
+class PersonTracker:
+    """
+    Keeps person tracks across frames.
+
+    `update` consumes person detections, `predict` only advances the tracks and
+    is what runs between detections. Tracks unmatched for more than
+    `max_misses` updates are dropped.
+    """
+
+    def __init__(self, iou_threshold=0.3, high_score=0.5, low_score=0.1, max_misses=5):
+        self.iou_threshold = iou_threshold
+        self.high_score = high_score
+        self.low_score = low_score
+        self.max_misses = max_misses
+        self.tracks = []
+        self._next_id = 1
+
+    def predict(self):
+        for track in self.tracks:
+            track.predict()
+        return self.tracks
+
+    def update(self, boxes, scores):
+        """Matches detections to tracks and returns the live tracks."""
+        self.predict()
+        boxes = as_boxes(boxes)
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        high = np.flatnonzero(scores >= self.high_score)
+        low = np.flatnonzero((scores >= self.low_score) & (scores < self.high_score))
+
+        track_boxes = np.array([t.box for t in self.tracks]).reshape(-1, 4)
+        matches, unmatched_tracks, unmatched_high = greedy_match(
+            iou_matrix(track_boxes, boxes[high]), self.iou_threshold)
+        for t, d in matches:
+            self.tracks[t].update(boxes[high[d]], scores[high[d]])
+
+        # Second pass: low-confidence detections may only extend existing tracks
+        remaining = [self.tracks[t] for t in unmatched_tracks]
+        remaining_boxes = np.array([t.box for t in remaining]).reshape(-1, 4)
+        matches, still_unmatched, _ = greedy_match(
+            iou_matrix(remaining_boxes, boxes[low]), self.iou_threshold)
+        for t, d in matches:
+            remaining[t].update(boxes[low[d]], scores[low[d]])
+        for t in still_unmatched:
+            remaining[t].misses += 1
+
+        for d in unmatched_high:
+            self.tracks.append(Track(self._next_id, boxes[high[d]], scores[high[d]]))
+            self._next_id += 1
+
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        return self.tracks
+
+    def tracks_needing_ppe_check(self, change_iou=0.5, max_age=None):
+        """
+        Tracks whose cached PPE status is missing, was computed on a box that
+        has since moved (IoU below `change_iou`) or is older than `max_age` seconds.
+        """
+        now = time.time()
+        stale = []
+        for track in self.tracks:
+            if track.misses:
+                # Coasting tracks are not re-checked until they are detected again
+                continue
+            if track.missing_ppe is None:
+                stale.append(track)
+            elif box_iou(track.ppe_box, track.box[None, :])[0] < change_iou:
+                stale.append(track)
+            elif max_age is not None and now - track.ppe_checked_at > max_age:
+                stale.append(track)
+        return stale
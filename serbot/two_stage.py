@@ -0,0 +1,126 @@
+"""
+Two-stage PPE detection for high-resolution cameras. Persons are detected on
+a downscaled copy of the frame, then PPE is detected on crops of those person
+regions taken from the full-resolution frame, all crops in one batched call.
+Small items such as glasses, gloves and ear-muffs keep enough pixels to be
+found without running the large model on the whole 4K frame, and every PPE
+item is owned by the person whose crop it was found in.
+"""
+import time
+
+import cv2
+import numpy as np
+
+from ensemble import Detections
+from ppe_assignment import detection_arrays
+
+
+def class_indices(class_names, wanted):
+    return [k for k, v in class_names.items() if v in wanted]
+
+
+class TwoStageDetector:
+    """
+    `person_model` finds persons on the frame shrunk to `person_imgsz` on its
+    longest side; `ppe_model` runs on the person crops (padded by
+    `crop_padding` of the box size) at `crop_imgsz`. Both may be the same model.
+    """
+
+    STAGES = ('downscale', 'persons', 'crop', 'ppe')
+
+    def __init__(self, person_model, ppe_model, ppe_classes, person_imgsz=640, crop_imgsz=640, crop_padding=0.1):
+        self.person_model = person_model
+        self.ppe_model = ppe_model
+        self.ppe_classes = ppe_classes
+        self.person_imgsz = person_imgsz
+        self.crop_imgsz = crop_imgsz
+        self.crop_padding = crop_padding
+        self.person_classes = class_indices(person_model.names, ['person'])
+        self.ppe_class_ids = class_indices(ppe_model.names, ppe_classes)
+        if not self.person_classes:
+            raise ValueError('The person model has no "person" class')
+        self.timings = dict.fromkeys(self.STAGES, 0.0)
+        self.frames = 0
+        self.crops = 0
+
+    def _downscale(self, frame):
+        h, w = frame.shape[:2]
+        scale = min(self.person_imgsz / max(h, w), 1.0)
+        if scale == 1.0:
+            return frame, 1.0
+        small = cv2.resize(frame, (max(int(w * scale), 1), max(int(h * scale), 1)), interpolation=cv2.INTER_AREA)
+        return small, scale
+
+    def _crop_box(self, box, shape):
+        h, w = shape[:2]
+        x1, y1, x2, y2 = box
+        pad_x = int((x2 - x1) * self.crop_padding)
+        pad_y = int((y2 - y1) * self.crop_padding)
+        return max(x1 - pad_x, 0), max(y1 - pad_y, 0), min(x2 + pad_x, w), min(y2 + pad_y, h)
+
+    def detect_batch(self, frames, conf_threshold, keys=None):
+        """Runs both stages over several frames and returns one Detections per frame."""
+        start = time.perf_counter()
+        downscaled = [self._downscale(f) for f in frames]
+        t_downscale = time.perf_counter()
+
+        person_results = self.person_model([small for small, _ in downscaled], conf=conf_threshold,
+                                           imgsz=self.person_imgsz, classes=self.person_classes, verbose=False)
+        persons = []
+        for result, (_, scale) in zip(person_results, downscaled):
+            xyxy, conf, cls = detection_arrays(result.boxes)
+            mask = np.isin(cls, self.person_classes)
+            boxes = np.rint(xyxy[mask] / scale).astype(int) if len(xyxy) else xyxy[mask]
+            persons.append((boxes, conf[mask]))
+        t_persons = time.perf_counter()
+
+        crops, origins = [], []
+        for frame_idx, (frame, (boxes, _)) in enumerate(zip(frames, persons)):
+            for person_idx, box in enumerate(boxes.tolist()):
+                cx1, cy1, cx2, cy2 = self._crop_box(box, frame.shape)
+                if cx2 - cx1 < 2 or cy2 - cy1 < 2:
+                    continue
+                crops.append(frame[cy1:cy2, cx1:cx2])
+                origins.append((frame_idx, person_idx, cx1, cy1))
+        t_crop = time.perf_counter()
+
+        ppe = [([], [], [], []) for _ in frames]
+        if crops:
+            crop_results = self.ppe_model(crops, conf=conf_threshold, imgsz=self.crop_imgsz,
+                                          classes=self.ppe_class_ids, verbose=False)
+            for result, (frame_idx, person_idx, ox, oy) in zip(crop_results, origins):
+                xyxy, conf, cls = detection_arrays(result.boxes)
+                mask = np.isin(cls, self.ppe_class_ids)
+                boxes, scores, labels, owners = ppe[frame_idx]
+                boxes.extend((xyxy[mask] + [ox, oy, ox, oy]).tolist())
+                scores.extend(conf[mask].tolist())
+                labels.extend(self.ppe_model.names[c] for c in cls[mask])
+                owners.extend([person_idx] * int(mask.sum()))
+        t_ppe = time.perf_counter()
+
+        self.timings['downscale'] += t_downscale - start
+        self.timings['persons'] += t_persons - t_downscale
+        self.timings['crop'] += t_crop - t_persons
+        self.timings['ppe'] += t_ppe - t_crop
+        self.frames += len(frames)
+        self.crops += len(crops)
+
+        return [
+            Detections(person_boxes, person_scores,
+                       np.array(boxes, dtype=int).reshape(-1, 4), np.array(scores), labels, owners)
+            for (person_boxes, person_scores), (boxes, scores, labels, owners) in zip(persons, ppe)
+        ]
+
+    def __call__(self, frame, conf_threshold):
+        return self.detect_batch([frame], conf_threshold)[0]
+
+    def stats(self):
+        """Mean milliseconds per frame for each stage, and crops per frame."""
+        frames = max(self.frames, 1)
+        stats = {f'{stage}_ms': round(t / frames * 1000, 2) for stage, t in self.timings.items()}
+        stats['frames'] = self.frames
+        stats['crops_per_frame'] = round(self.crops / frames, 2)
+        return stats
+
+    def close(self):
+        pass
@@ -0,0 +1,453 @@
+"""
+Multi-process inference for the PPE detectors. Each worker process loads its
+own copy of the detector and is pinned to its own set of CPU cores, so N
+workers run N frames truly in parallel instead of contending for the GIL and
+for one set of intra-op threads. Frames are copied once into a per-worker
+shared-memory slot and only a small task tuple crosses the worker's pipe;
+detections come back on a second pipe. The pool has the detector interface
+(`detect_batch`, `__call__`, `stats`, `close`), so the backend and the serbot
+can use it in place of an in-process detector.
+
+Run this module directly to measure throughput scaling over 1..N workers.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+# Largest frame passed through shared memory: a 4K BGR frame. Slot pages are
+# only committed when written, so smaller frames do not pay for the full size.
+DEFAULT_SLOT_BYTES = 3840 * 2160 * 3
+# Slots per worker: the parent fills one while the worker runs another
+DEFAULT_SLOTS_PER_WORKER = 2
+# Model loading (and a first-run export for onnx/openvino) can be slow
+STARTUP_TIMEOUT = 600.0
+# How often an idle worker checks that the process that started it is still alive
+PARENT_CHECK_INTERVAL = 1.0
+
+DETECTOR_KINDS = ('model', 'ensemble', 'cascade', 'two-stage')
+
+
+class ModelDetector:
+    """A single model with the detector interface, for the backend's one-model path."""
+
+    def __init__(self, model, ppe_classes):
+        self.model = model
+        self.names = model.names
+        self.ppe_classes = ppe_classes
+
+    def detect_batch(self, frames, conf_threshold, keys=None):
+        from ensemble import extract_detections
+        results = self.model(frames, conf=conf_threshold, verbose=False)
+        return [extract_detections(r, self.names, self.ppe_classes) for r in results]
+
+    def __call__(self, frame, conf_threshold):
+        return self.detect_batch([frame], conf_threshold)[0]
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def detector_spec(kind, model_paths, ppe_classes, backend='pytorch', precision='fp32', calibration=None, **options):
+    """
+    Describes the detector every worker builds: `kind` is one of
+    DETECTOR_KINDS, `options` are passed to its constructor (e.g. fusion,
+    parallel, margin, person_imgsz, crop_imgsz).
+    """
+    if kind not in DETECTOR_KINDS:
+        raise ValueError(f"Unknown detector kind '{kind}', expected one of {DETECTOR_KINDS}")
+    return {'kind': kind, 'model_paths': list(model_paths), 'ppe_classes': list(ppe_classes), 'backend': backend,
+            'precision': precision, 'calibration': calibration, 'options': options}
+
+
+def build_detector(spec):
+    """Loads the models of `spec` and wraps them in the requested detector."""
+    from model_backends import load_model
+    loaded = {}
+    for path in spec['model_paths']:
+        if path not in loaded:
+            loaded[path] = load_model(path, spec['backend'], spec['precision'], spec['calibration'])
+    models = [loaded[path] for path in spec['model_paths']]
+    kind, ppe_classes, options = spec['kind'], spec['ppe_classes'], spec['options']
+    if kind == 'cascade':
+        from cascade import ModelCascade
+        return ModelCascade(models, ppe_classes, **options)
+    if kind == 'two-stage':
+        from two_stage import TwoStageDetector
+        return TwoStageDetector(models[0], models[1], ppe_classes, **options)
+    if kind == 'ensemble':
+        from ensemble import ModelEnsemble
+        return ModelEnsemble(models, ppe_classes, **options)
+    return ModelDetector(models[0], ppe_classes)
+
+
+def assign_cores(num_workers):
+    """
+    Splits the CPUs this process may run on into `num_workers` contiguous sets.
+    With more workers than CPUs, workers share single CPUs round-robin.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if num_workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(num_workers)]
+    return [[int(cpu) for cpu in chunk] for chunk in np.array_split(cpus, num_workers)]
+
+
+def _limit_threads(count):
+    cv2.setNumThreads(count)
+    torch = sys.modules.get('torch')
+    if torch is None:
+        try:
+            import torch
+        except ImportError:
+            return
+    torch.set_num_threads(count)
+
+
+def _worker_main(index, spec, cores, shm_name, slot_bytes, tasks, results, parent_pid):
+    """Worker process: loads the detector, then runs frames from its slots until told to stop."""
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    _limit_threads(max(len(cores or ()), 1))
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        detector = build_detector(spec)
+    except Exception as e:
+        results.send(('failed', f'{type(e).__name__}: {e}'))
+        shm.close()
+        return
+    results.send(('ready', getattr(detector, 'names', None)))
+
+    while True:
+        if not tasks.poll(PARENT_CHECK_INTERVAL):
+            if os.getppid() != parent_pid:
+                break
+            continue
+        task = tasks.recv()
+        if task is None:
+            break
+        task_id, slot, shape, dtype, frame, conf_threshold, key = task
+        if frame is None:
+            frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=slot * slot_bytes)
+        start = time.perf_counter()
+        try:
+            detections = detector.detect_batch([frame], conf_threshold, keys=None if key is None else [key])[0]
+            results.send(('result', task_id, detections, None, time.perf_counter() - start))
+        except Exception as e:
+            results.send(('result', task_id, None, f'{type(e).__name__}: {e}', time.perf_counter() - start))
+        frame = None
+
+    detector.close()
+    try:
+        shm.close()
+    except BufferError:
+        # The detector still references the last slot view; the OS unmaps it at exit
+        pass
+
+
+class InferencePool:
+    """
+    `workers` processes each running the detector described by `spec` (see
+    detector_spec()) on one frame at a time. Frames with the same key (e.g. a
+    camera name) always go to the same worker, so per-stream detector state
+    such as the cascade's previous detections stays consistent; other frames
+    go to the least busy worker. When every slot of the chosen worker is in
+    use, submit() blocks until one frees up.
+
+    Every worker has its own task and result pipe, so a worker that crashes
+    only fails its own frames. Workers are forked on Linux, so create the pool
+    before starting threads or loading models in the parent; elsewhere they
+    are spawned.
+    """
+
+    def __init__(self, spec, workers, pin=True, slots_per_worker=DEFAULT_SLOTS_PER_WORKER,
+                 slot_bytes=DEFAULT_SLOT_BYTES, start_method=None, startup_timeout=STARTUP_TIMEOUT):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        self.spec = spec
+        self.slot_bytes = slot_bytes
+        self.slots_per_worker = slots_per_worker
+        self.names = None
+        start_method = start_method or ('fork' if sys.platform.startswith('linux') else 'spawn')
+        context = multiprocessing.get_context(start_method)
+        core_sets = assign_cores(workers) if pin else [None] * workers
+
+        self._lock = threading.Condition()
+        self._ids = itertools.count()
+        self._pending = {}
+        self._ready = threading.Event()
+        self._startup = {'ready': 0, 'errors': []}
+        self._closed = False
+        self.counters = {'shared_memory_frames': 0, 'pickled_frames': 0, 'failed': 0}
+        self._workers = []
+        for index, cores in enumerate(core_sets):
+            shm = shared_memory.SharedMemory(create=True, size=slot_bytes * slots_per_worker)
+            task_reader, task_writer = context.Pipe(duplex=False)
+            result_reader, result_writer = context.Pipe(duplex=False)
+            process = context.Process(target=_worker_main, name=f'ppe-worker-{index}', daemon=True,
+                                      args=(index, spec, cores, shm.name, slot_bytes, task_reader, result_writer,
+                                            os.getpid()))
+            self._workers.append({'process': process, 'tasks': task_writer, 'results': result_reader,
+                                  'send_lock': threading.Lock(), 'shm': shm, 'cores': cores,
+                                  'free': list(range(slots_per_worker)), 'pending': 0, 'frames': 0,
+                                  'seconds': 0.0, 'alive': True})
+        for worker in self._workers:
+            worker['process'].start()
+        self._collector = threading.Thread(target=self._collect, name='ppe-pool-results', daemon=True)
+        self._collector.start()
+
+        if not self._ready.wait(startup_timeout) or self._startup['errors']:
+            errors = self._startup['errors'] or [f'workers not ready after {startup_timeout:.0f}s']
+            self.close()
+            raise RuntimeError(f"Inference workers failed to start: {'; '.join(errors)}")
+
+    def _collect(self):
+        """Result thread: frees slots and resolves futures; fails the work of workers that died."""
+        while True:
+            with self._lock:
+                if self._closed and not self._pending:
+                    return
+                watched = {}
+                for index, worker in enumerate(self._workers):
+                    if worker['alive']:
+                        watched[worker['results']] = index
+                        watched[worker['process'].sentinel] = index
+            if not watched:
+                return
+            for ready in multiprocessing.connection.wait(list(watched), timeout=1.0):
+                index = watched[ready]
+                worker = self._workers[index]
+                if ready is worker['process'].sentinel:
+                    # Drain what the worker sent before it exited, then fail the rest
+                    try:
+                        while worker['results'].poll():
+                            self._handle(index, worker['results'].recv())
+                    except (EOFError, OSError):
+                        pass
+                    self._worker_exited(index)
+                    continue
+                try:
+                    self._handle(index, worker['results'].recv())
+                except (EOFError, OSError):
+                    self._worker_exited(index)
+
+    def _handle(self, index, message):
+        kind = message[0]
+        if kind == 'result':
+            _, task_id, detections, error, seconds = message
+            with self._lock:
+                future, _, slot = self._pending.pop(task_id)
+                worker = self._workers[index]
+                worker['pending'] -= 1
+                worker['frames'] += 1
+                worker['seconds'] += seconds
+                if slot is not None:
+                    worker['free'].append(slot)
+                if error is not None:
+                    self.counters['failed'] += 1
+                self._lock.notify_all()
+            if error is None:
+                future.set_result(detections)
+            else:
+                future.set_exception(RuntimeError(error))
+        elif kind == 'ready':
+            self.names = self.names or message[1]
+            self._startup['ready'] += 1
+            if self._startup['ready'] == len(self._workers):
+                self._ready.set()
+        elif kind == 'failed':
+            self._startup['errors'].append(f'worker {index}: {message[1]}')
+            self._ready.set()
+
+    def _worker_exited(self, index):
+        worker = self._workers[index]
+        with self._lock:
+            if not worker['alive']:
+                return
+            worker['alive'] = False
+            lost = [(task_id, entry[0]) for task_id, entry in self._pending.items() if entry[1] == index]
+            for task_id, _ in lost:
+                del self._pending[task_id]
+            worker['pending'] = 0
+            self.counters['failed'] += len(lost)
+            self._lock.notify_all()
+        worker['process'].join(timeout=1)
+        if not self._closed:
+            print(f"Inference worker {index} exited with code {worker['process'].exitcode}")
+        if not self._ready.is_set():
+            self._startup['errors'].append(f'worker {index} exited during startup')
+            self._ready.set()
+        for _, future in lost:
+            future.set_exception(RuntimeError('Inference worker exited'))
+
+    def _choose_worker(self, key):
+        alive = [i for i, w in enumerate(self._workers) if w['alive']]
+        if not alive:
+            raise RuntimeError('No inference workers are running')
+        if key is not None:
+            return alive[zlib.crc32(str(key).encode()) % len(alive)]
+        with_slots = [i for i in alive if self._workers[i]['free']] or alive
+        return min(with_slots, key=lambda i: self._workers[i]['pending'])
+
+    def submit(self, frame, conf_threshold, key=None):
+        """Queues one BGR frame on a worker. Returns a Future resolving to its Detections."""
+        frame = np.ascontiguousarray(frame)
+        fits = frame.nbytes <= self.slot_bytes
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('InferencePool is closed')
+            while True:
+                index = self._choose_worker(key)
+                worker = self._workers[index]
+                if worker['free'] or not fits:
+                    break
+                self._lock.wait()
+            slot = worker['free'].pop() if fits else None
+            task_id = next(self._ids)
+            self._pending[task_id] = (future, index, slot)
+            worker['pending'] += 1
+            self.counters['shared_memory_frames' if fits else 'pickled_frames'] += 1
+
+        if fits:
+            # The one copy of the frame; only its slot, shape and dtype are pickled
+            view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=worker['shm'].buf,
+                              offset=slot * self.slot_bytes)
+            view[...] = frame
+            del view
+            task = (task_id, slot, frame.shape, frame.dtype.str, None, conf_threshold, key)
+        else:
+            task = (task_id, None, None, None, frame, conf_threshold, key)
+        try:
+            with worker['send_lock']:
+                worker['tasks'].send(task)
+        except OSError:
+            self._worker_exited(index)
+        return future
+
+    def detect_batch(self, frames, conf_threshold, keys=None):
+        """Spreads `frames` over the workers and waits for all of them."""
+        keys = keys or [None] * len(frames)
+        futures = [self.submit(frame, conf_threshold, key) for frame, key in zip(frames, keys)]
+        return [future.result() for future in futures]
+
+    def __call__(self, frame, conf_threshold):
+        return self.submit(frame, conf_threshold).result()
+
+    def stats(self):
+        with self._lock:
+            workers = [{
+                'pid': w['process'].pid,
+                'cores': w['cores'],
+                'alive': w['alive'],
+                'frames': w['frames'],
+                'pending': w['pending'],
+                'mean_ms': round(w['seconds'] / w['frames'] * 1000, 2) if w['frames'] else None
+            } for w in self._workers]
+            pending = len(self._pending)
+        return dict(self.counters, kind=self.spec['kind'], workers=workers, pending=pending)
+
+    def close(self):
+        """Stops the workers after their queued frames and releases the shared memory."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for worker in self._workers:
+            if worker['alive']:
+                try:
+                    with worker['send_lock']:
+                        worker['tasks'].send(None)
+                except OSError:
+                    pass
+        for worker in self._workers:
+            worker['process'].join(timeout=10)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+                worker['process'].join()
+        self._collector.join(timeout=5)
+        for worker in self._workers:
+            worker['tasks'].close()
+            worker['results'].close()
+            worker['shm'].close()
+            worker['shm'].unlink()
+
+
+def scaling_curve(spec, frames, worker_counts, conf_threshold=0.25, count=200, warmup=2):
+    """
+    Throughput of an InferencePool for every worker count in `worker_counts`,
+    running `count` frames (cycling through `frames`) with all workers kept busy.
+    """
+    rows = []
+    for workers in worker_counts:
+        pool = InferencePool(spec, workers)
+        try:
+            pool.detect_batch([frames[i % len(frames)] for i in range(warmup * workers)], conf_threshold)
+            start = time.perf_counter()
+            futures = [pool.submit(frames[i % len(frames)], conf_threshold) for i in range(count)]
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - start
+            stats = pool.stats()
+        finally:
+            pool.close()
+        fps = count / elapsed
+        base = rows[0] if rows else {'workers': workers, 'frames_per_sec': fps}
+        speedup = fps / base['frames_per_sec']
+        rows.append({
+            'workers': workers,
+            'cores': [w['cores'] for w in stats['workers']],
+            'frames_per_sec': round(fps, 2),
+            'speedup': round(speedup, 2),
+            'efficiency': round(speedup * base['workers'] / workers, 2),
+            'worker_mean_ms': round(float(np.mean([w['mean_ms'] for w in stats['workers'] if w['mean_ms']])), 2),
+            'pickled_frames': stats['pickled_frames']
+        })
+        print(rows[-1])
+    return rows
+
+
+if __name__ == '__main__':
+    from model_backends import BACKENDS, PRECISIONS, load_frames
+
+    parser = argparse.ArgumentParser(description='Measure inference throughput over 1..N worker processes')
+    parser.add_argument('--model', default='yolov8x.pt', help='PyTorch checkpoint')
+    parser.add_argument('--frames', required=True, help='Directory of images or video file to run')
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='Worker counts to measure (default: 1, 2, 4, ... up to the CPU count)')
+    parser.add_argument('--count', type=int, default=200, help='Frames run per worker count')
+    parser.add_argument('--backend', choices=BACKENDS, default=BACKENDS[0], help='Inference backend')
+    parser.add_argument('--precision', choices=PRECISIONS, default=PRECISIONS[0], help='Model precision')
+    parser.add_argument('--calibration', default=None, help='Calibration frames for INT8 models')
+    parser.add_argument('--conf', type=float, default=0.25, help='Confidence threshold')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    bench_frames = load_frames(args.frames, 50)
+    if not bench_frames:
+        parser.error(f'No frames found in {args.frames}')
+    cpus = len(assign_cores(1)[0])
+    counts = args.workers or sorted({min(2 ** i, cpus) for i in range(cpus.bit_length() + 1)})
+    bench_spec = detector_spec('model', [args.model], ['face-guard', 'ear-mufs', 'safety-vest', 'gloves', 'glasses'],
+                               args.backend, args.precision, args.calibration)
+    results = scaling_curve(bench_spec, bench_frames, counts, args.conf, args.count)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'model': args.model, 'backend': args.backend, 'precision': args.precision,
+                       'cpus': cpus, 'frames': args.count, 'results': results}, f, indent=2)